@@ -0,0 +1,433 @@
+"""
+Benchmarks the whole pipeline on synthetic star-schema data (see synthetic.py) at one or more
+scales, and prints the results as JSON.
+
+For every --rows scale, in a scratch directory:
+
+- generate:  builds the synthetic tables in Arrow (the baseline cost of the generator itself)
+- extract:   transfer_data.extract_full against a stand-in Postgres connection serving the
+             synthetic rows, i.e. driver rows -> Arrow -> parquet, as in production minus the database
+- write:     writes the generated Arrow data straight to parquet with TableWriter
+- summaries: transfer_data.build_summaries over the extracted fact table
+- upload:    upload_files_to_s3 into an in-process S3 stand-in (moto), manifest included
+- load:      load_data_from_s3 of every table, and of only the columns the analyses use, per --backends,
+             with and without compaction, recording the in-memory size of the loaded tables
+- analysis:  each sales_by_* analysis over the loaded tables (compacted or not) with pandas, with
+             DuckDB, and from the up to date summary tables through a Dataset
+
+Each result records wall and CPU seconds and the peak resident memory above what the process
+used when the stage started. Results are a flat list keyed by (rows, stage, name), so two runs can
+be compared with --compare, which adds the ratio of every timing to the baseline run and flags
+the ones slower than --threshold.
+
+    python benchmarks/bench_pipeline.py --rows 10000 1000000 --output results.json
+    python benchmarks/bench_pipeline.py --rows 10000 1000000 --compare results.json
+"""
+import argparse
+import gc
+import json
+import logging
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+import boto3
+import pyarrow as pa
+from moto import mock_aws
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+for directory in ('streamlit_app', 'transfer_data', 'upload_script'):
+    sys.path.insert(0, os.path.join(BENCHMARKS_DIR, '..', directory))
+
+import synthetic  # noqa: E402
+import transfer_data  # noqa: E402
+from writers import TableWriter  # noqa: E402
+from upload_to_s3 import upload_files_to_s3  # noqa: E402
+from s3_loader import load_data_from_s3  # noqa: E402
+from dataset import DatasetStore  # noqa: E402
+from analysis import sales_by_staff_and_location, sales_by_product_design, sales_by_currency, required_columns  # noqa: E402
+from sql_engine import run_analysis  # noqa: E402
+
+BUCKET_NAME = "bench-bucket"
+S3_FOLDER = "db/parquet_files"
+REGION = 'eu-west-2'
+
+STAGES = ('generate', 'extract', 'write', 'summaries', 'upload', 'load', 'analysis')
+ANALYSES = [sales_by_staff_and_location, sales_by_product_design, sales_by_currency]
+
+# How often the resident memory is sampled while a stage runs
+RSS_SAMPLE_SECONDS = 0.005
+
+# Timings slower than the baseline by more than this fraction are flagged by --compare
+DEFAULT_THRESHOLD = 0.2
+# ... unless both runs took less than this, where the noise is larger than any slowdown
+MIN_COMPARED_SECONDS = 0.05
+
+# Bumped when the layout of the results changes
+RESULTS_VERSION = 1
+
+
+def rss_bytes():
+    """
+    Current resident memory of the process, or None where /proc is not available.
+    """
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return None
+
+
+class PeakMemory:
+    """
+    Samples the resident memory in a background thread and keeps its peak.
+
+    Falls back to the high-water mark of getrusage where /proc is not available, which only
+    shows stages that use more memory than any stage before them.
+    """
+
+    def __init__(self, interval=RSS_SAMPLE_SECONDS):
+        self.interval = interval
+        self.start = rss_bytes()
+        self.peak = self.start
+        self._stop = threading.Event()
+        self._thread = None
+        self._maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, rss_bytes())
+
+    def __enter__(self):
+        if self.start is not None:
+            self._thread = threading.Thread(target=self._sample, daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self.peak = max(self.peak, rss_bytes())
+
+    @property
+    def peak_increase(self):
+        if self.start is None:
+            # ru_maxrss is in KiB on Linux, bytes on macOS
+            scale = 1 if sys.platform == 'darwin' else 1024
+            return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - self._maxrss) * scale
+        return self.peak - self.start
+
+
+class Recorder:
+    """
+    Collects one result per measured step.
+    """
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.results = []
+
+    @contextmanager
+    def measure(self, stage, name, **extra):
+        """
+        Times the body of the with block and records it; the body can add fields to the yielded dict.
+        """
+        gc.collect()
+        result = {'rows': self.rows, 'stage': stage, 'name': name, **extra}
+        cpu_start = time.process_time()
+        with PeakMemory() as memory:
+            start = time.perf_counter()
+            yield result
+            result['seconds'] = time.perf_counter() - start
+        result['cpu_seconds'] = time.process_time() - cpu_start
+        result['peak_memory_bytes'] = memory.peak_increase
+        self.results.append(result)
+        logging.getLogger('bench_pipeline').info(
+            f"{self.rows} rows {stage}/{name}: {result['seconds']:.3f}s, +{result['peak_memory_bytes'] / 2**20:.0f} MiB"
+        )
+
+
+def parquet_files(root):
+    """
+    Lists the parquet files under root as the upload lambda does: the files of partitioned tables
+    under their sub-directories, then single-file tables and summaries.
+    """
+    files = []
+    for directory, _, file_names in sorted(os.walk(root)):
+        if os.path.basename(directory) == 'delta':
+            continue
+        files += [os.path.join(directory, name) for name in sorted(file_names) if name.endswith('.parquet')]
+    return files
+
+
+def directory_bytes(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(directory, name)) for directory, _, names in os.walk(path) for name in names)
+
+
+def bench_generate(recorder, args):
+    for table in synthetic.TABLES:
+        with recorder.measure('generate', table) as result:
+            if table == synthetic.FACT_TABLE:
+                result['bytes'] = sum(batch.nbytes for batch in synthetic.iter_fact_batches(recorder.rows, args.seed))
+            else:
+                result['bytes'] = synthetic.dimension_table(table, recorder.rows, args.seed).nbytes
+
+
+def bench_extract(recorder, args):
+    transfer_data.ensure_output_dirs(('parquet',))
+    for table in synthetic.TABLES:
+        conn = synthetic.SyntheticConnection(recorder.rows, args.seed)
+        with recorder.measure('extract', table, batch_size=args.batch_size) as result:
+            result['rows_extracted'] = transfer_data.extract_full(conn, table, synthetic.CATALOG[table],
+                                                                  batch_size=args.batch_size, formats=('parquet',))
+        partitioned = transfer_data.get_partition_column(table, synthetic.CATALOG[table]) is not None
+        result['bytes'] = directory_bytes(transfer_data.output_files_for(table, ('parquet',), partitioned)['parquet'])
+
+
+def bench_write(recorder, args):
+    output_dir = os.path.join(args.workdir, 'write')
+    os.makedirs(output_dir, exist_ok=True)
+    for table in synthetic.TABLES:
+        partition_column = transfer_data.PARTITIONED_TABLES.get(table)
+        path = os.path.join(output_dir, table if partition_column else f'{table}.parquet')
+        if table == synthetic.FACT_TABLE:
+            batches = synthetic.iter_fact_batches(recorder.rows, args.seed)
+        else:
+            batches = [synthetic.dimension_table(table, recorder.rows, args.seed)]
+        # Includes generating the batches; the generate stage gives that cost on its own
+        with recorder.measure('write', table) as result:
+            with TableWriter({'parquet': path}, synthetic.schema(table), partition_column) as writer:
+                for batch in batches:
+                    writer.write(batch)
+        result['bytes'] = directory_bytes(path)
+
+
+def bench_summaries(recorder, args):
+    with recorder.measure('summaries', 'all') as result:
+        outcome = transfer_data.build_summaries()
+    if outcome['error']:
+        raise RuntimeError(f"Building the summaries failed: {outcome['error']}")
+    result['summary_rows'] = outcome['rows']
+
+
+def bench_upload(recorder, args):
+    root = transfer_data.formats_dirs['parquet']
+    files = parquet_files(root)
+    with recorder.measure('upload', 'all', files=len(files)) as result:
+        results = upload_files_to_s3(BUCKET_NAME, files, S3_FOLDER, max_workers=args.workers, local_root=root)
+    failed = [upload['name'] for upload in results if upload['status'] not in ('uploaded', 'skipped')]
+    if failed:
+        raise RuntimeError(f"Uploads failed: {failed}")
+    result['bytes'] = sum(os.path.getsize(path) for path in files)
+
+
+def table_bytes(table):
+    # What a loaded table holds in memory, Python objects included
+    if isinstance(table, pa.Table):
+        return table.nbytes
+    return int(table.memory_usage(deep=True, index=False).sum())
+
+
+def bench_load(recorder, args):
+    for backend in args.backends:
+        for projection, columns in (('all_columns', None), ('analysis_columns', required_columns())):
+            for compact in (False, True):
+                name = f'{backend}/{projection}/compact' if compact else f'{backend}/{projection}'
+                with recorder.measure('load', name, backend=backend, compact=compact) as result:
+                    data, stats = load_data_from_s3(BUCKET_NAME, S3_FOLDER, region_name=REGION, max_workers=args.workers,
+                                                    with_stats=True, columns=columns, backend=backend, compact=compact)
+                result['bytes_downloaded'] = sum(table_stats.get('bytes') or 0 for table_stats in stats.values())
+                result['memory_bytes'] = sum(table_bytes(table) for table in data.values())
+                del data, stats
+
+
+def bench_analysis(recorder, args):
+    for backend in args.backends:
+        if backend == 'arrow':
+            # The analyses take DataFrames
+            continue
+        for compact in (False, True):
+            data = load_data_from_s3(BUCKET_NAME, S3_FOLDER, region_name=REGION, max_workers=args.workers,
+                                     columns=required_columns(), backend=backend, compact=compact)
+            variant = f'{backend}/compact' if compact else backend
+            for analysis in ANALYSES:
+                # A plain dict has no cached join indexes, so this includes building them
+                with recorder.measure('analysis', f'pandas/{variant}/{analysis.__name__}', backend=backend) as result:
+                    result['result_rows'] = len(analysis(data))
+                with recorder.measure('analysis', f'duckdb/{variant}/{analysis.__name__}', backend=backend) as result:
+                    result['result_rows'] = len(run_analysis(data, analysis.__name__))
+            del data
+
+        store = DatasetStore(BUCKET_NAME, S3_FOLDER, region_name=REGION, max_workers=args.workers,
+                             columns=required_columns(), backend=backend)
+        dataset = store.get()
+        for analysis in ANALYSES:
+            with recorder.measure('analysis', f'summaries/{backend}/{analysis.__name__}', backend=backend) as result:
+                result['result_rows'] = len(analysis(dataset))
+        del dataset, store
+
+
+STAGE_FUNCTIONS = {
+    'generate': bench_generate,
+    'extract': bench_extract,
+    'write': bench_write,
+    'summaries': bench_summaries,
+    'upload': bench_upload,
+    'load': bench_load,
+    'analysis': bench_analysis,
+}
+
+
+def run_scale(rows, args):
+    """
+    Runs the selected stages at one scale, in a scratch directory of its own.
+    """
+    recorder = Recorder(rows)
+    if args.workdir:
+        os.makedirs(args.workdir, exist_ok=True)
+    workdir = tempfile.mkdtemp(prefix=f'bench-{rows}-', dir=args.workdir)
+    cwd = os.getcwd()
+    args_for_scale = argparse.Namespace(**{**vars(args), 'workdir': workdir})
+    try:
+        # transfer_data.py writes under ./db
+        os.chdir(workdir)
+        with mock_aws():
+            boto3.client('s3', region_name=REGION).create_bucket(
+                Bucket=BUCKET_NAME, CreateBucketConfiguration={'LocationConstraint': REGION}
+            )
+            for stage in STAGES:
+                if stage in args.stages:
+                    STAGE_FUNCTIONS[stage](recorder, args_for_scale)
+    finally:
+        os.chdir(cwd)
+        if not args.keep_files:
+            shutil.rmtree(workdir, ignore_errors=True)
+    return recorder.results
+
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=BENCHMARKS_DIR, capture_output=True, text=True,
+                                check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    import duckdb
+    import pandas
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'pandas': pandas.__version__,
+        'pyarrow': pa.__version__,
+        'duckdb': duckdb.__version__,
+        'commit': commit,
+    }
+
+
+def result_key(result):
+    return result['rows'], result['stage'], result['name']
+
+
+def compare(results, baseline, threshold=DEFAULT_THRESHOLD):
+    """
+    Matches the results to those of a baseline run by (rows, stage, name).
+
+    Returns:
+    - list: One dict per result found in both runs, with both timings, their ratio, the change in
+      peak memory, and whether it is a regression (ratio above 1 + threshold, for steps taking
+      at least MIN_COMPARED_SECONDS)
+    """
+    baseline_results = {result_key(result): result for result in baseline['results']}
+    comparison = []
+    for result in results:
+        before = baseline_results.get(result_key(result))
+        if before is None:
+            continue
+        ratio = result['seconds'] / before['seconds'] if before['seconds'] else None
+        comparison.append({
+            'rows': result['rows'],
+            'stage': result['stage'],
+            'name': result['name'],
+            'baseline_seconds': before['seconds'],
+            'seconds': result['seconds'],
+            'ratio': ratio,
+            'peak_memory_change_bytes': result['peak_memory_bytes'] - before['peak_memory_bytes'],
+            'regression': ratio is not None and ratio > 1 + threshold
+                          and max(result['seconds'], before['seconds']) >= MIN_COMPARED_SECONDS,
+        })
+    return comparison
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, nargs='+', default=[10_000, 100_000],
+                        help='fact_sales_order rows of each scale, from 10k to 50M')
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=list(STAGES),
+                        help='stages to run; summaries, upload, load and analysis need the ones before them')
+    parser.add_argument('--backends', nargs='+', choices=('numpy', 'pyarrow', 'arrow'), default=['numpy', 'pyarrow'])
+    parser.add_argument('--seed', type=int, default=synthetic.DEFAULT_SEED)
+    parser.add_argument('--batch-size', type=int, default=transfer_data.DEFAULT_BATCH_SIZE,
+                        help='rows per batch when extracting')
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--workdir', default=None, help='directory for the scratch files, the system temp dir by default')
+    parser.add_argument('--keep-files', action='store_true', help='keep the scratch files')
+    parser.add_argument('--output', help='also write the results to this file')
+    parser.add_argument('--compare', help='results file of an earlier run to compare with')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='slowdown (as a fraction) above which --compare flags a regression')
+    parser.add_argument('--fail-on-regression', action='store_true', help='exit with status 1 if --compare flags any')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    os.environ.setdefault('AWS_ACCESS_KEY_ID', 'testing')
+    os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'testing')
+    os.environ.setdefault('AWS_DEFAULT_REGION', REGION)
+    logging.basicConfig(level=logging.WARNING, stream=sys.stderr)
+    logging.getLogger('bench_pipeline').setLevel(logging.INFO)
+    # Per-table logging of the pipeline would drown the benchmark's own output
+    for name in ('transfer_data', 'writers', 'aggregates', 'upload_to_s3', 's3_loader', 'dataset', 'star_schema',
+                 'summaries', 'sql_engine'):
+        logging.getLogger(name).setLevel(logging.WARNING)
+
+    results = []
+    for rows in args.rows:
+        results += run_scale(rows, args)
+
+    output = {
+        'version': RESULTS_VERSION,
+        'suite': 'pipeline',
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'environment': environment(),
+        'parameters': {key: vars(args)[key] for key in ('rows', 'stages', 'backends', 'seed', 'batch_size', 'workers')},
+        'results': results,
+    }
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as rfile:
+            output['comparison'] = compare(results, json.load(rfile), args.threshold)
+
+    text = json.dumps(output, indent=4, default=str)
+    if args.output:
+        with open(args.output, 'w', encoding="utf-8") as wfile:
+            wfile.write(text)
+    print(text)
+
+    if args.fail_on_regression and any(item['regression'] for item in output.get('comparison', [])):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
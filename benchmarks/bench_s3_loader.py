@@ -0,0 +1,126 @@
+"""
+Benchmarks load_data_from_s3 against an in-process S3 stand-in (moto).
+
+Uploads one parquet file per table per day for --days days, so the listing spans several
+list_objects_v2 pages, then times the loader with one worker (the old sequential behaviour),
+with a thread pool, and with a thread pool reading the latest.json manifest instead of listing.
+moto answers instantly, so --latency-ms adds a fixed delay to every S3 call to approximate the
+round-trip to a real bucket.
+
+    python benchmarks/bench_s3_loader.py --days 200 --rows 100000 --latency-ms 50
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import date, timedelta
+from io import BytesIO
+
+import boto3
+import pyarrow.parquet as pq
+from moto import mock_aws
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'streamlit_app'))
+
+from s3_loader import MANIFEST_NAME, TABLES, list_latest_objects, load_data_from_s3  # noqa: E402
+from synthetic import generate_table  # noqa: E402
+
+BUCKET_NAME = "bench-bucket"
+S3_FOLDER = "db/parquet_files"
+
+
+def populate_bucket(s3_client, days, rows):
+    """
+    Uploads the same synthetic parquet bodies (see synthetic.py) under --days daily folders and
+    returns the number of keys.
+    """
+    s3_client.create_bucket(Bucket=BUCKET_NAME, CreateBucketConfiguration={'LocationConstraint': 'eu-west-2'})
+    bodies = {}
+    for table in TABLES:
+        buffer = BytesIO()
+        pq.write_table(generate_table(table, rows), buffer)
+        bodies[table] = buffer.getvalue()
+
+    first_day = date(2024, 1, 1)
+    for day in range(days):
+        folder = (first_day + timedelta(days=day)).strftime("%Y/%m/%d")
+        for table in TABLES:
+            s3_client.put_object(Bucket=BUCKET_NAME, Key=f"{S3_FOLDER}/{folder}/{table}.parquet", Body=bodies[table])
+    return days * len(TABLES)
+
+
+def write_manifest(s3_client):
+    """
+    Writes a latest.json manifest for the bucket, as upload_to_s3.py does after an upload.
+    """
+    latest_objects = list_latest_objects(s3_client, BUCKET_NAME, S3_FOLDER)
+    tables = {table: {'key': obj['Key'], 'etag': obj['ETag'], 'size': obj['Size']} for table, obj in latest_objects.items()}
+    s3_client.put_object(Bucket=BUCKET_NAME, Key=f"{S3_FOLDER}/{MANIFEST_NAME}", Body=json.dumps({'tables': tables}))
+
+
+def add_latency(latency_ms):
+    """
+    Delays every S3 call made by clients of the default boto3 session.
+    """
+    def sleep(**kwargs):
+        time.sleep(latency_ms / 1000)
+
+    boto3.setup_default_session()
+    boto3.DEFAULT_SESSION.events.register('before-call.s3', sleep)
+
+
+def run(label, max_workers, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        data, stats = load_data_from_s3(BUCKET_NAME, S3_FOLDER, region_name='eu-west-2',
+                                        max_workers=max_workers, with_stats=True)
+        timings.append(time.perf_counter() - start)
+    return {
+        'label': label,
+        'max_workers': max_workers,
+        'tables_loaded': len(data),
+        'best_seconds': min(timings),
+        'mean_seconds': sum(timings) / len(timings),
+        'slowest_table_seconds': max(s['total_seconds'] for s in stats.values()),
+        'sum_of_tables_seconds': sum(s['total_seconds'] for s in stats.values()),
+        'tables': stats,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--days', type=int, default=200, help='daily folders to upload (7 keys each)')
+    parser.add_argument('--rows', type=int, default=100_000, help='fact_sales_order rows')
+    parser.add_argument('--latency-ms', type=float, default=30, help='simulated latency per S3 call')
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    os.environ.setdefault('AWS_ACCESS_KEY_ID', 'testing')
+    os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'testing')
+
+    with mock_aws():
+        s3_client = boto3.client('s3', region_name='eu-west-2')
+        keys = populate_bucket(s3_client, args.days, args.rows)
+        add_latency(args.latency_ms)
+
+        runs = [
+            run('sequential', 1, args.repeat),
+            run('parallel', args.workers, args.repeat),
+        ]
+        write_manifest(s3_client)
+        runs.append(run('parallel+manifest', args.workers, args.repeat))
+
+        results = {
+            'keys_in_bucket': keys,
+            'latency_ms': args.latency_ms,
+            'runs': runs,
+        }
+
+    print(json.dumps(results, indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,415 @@
+"""
+Deterministic synthetic data for the warehouse star schema: fact_sales_order and its six dim_*
+tables, at any scale.
+
+Every table follows the column layout of the warehouse (CATALOG, in the form returned by
+catalog.get_catalog) and is generated directly in the Arrow schema transfer_data.py writes, so
+the benchmarks exercise the same types (dictionary-encoded text, decimal prices, dates and times)
+as the real pipeline. The dimensions grow with the fact table, foreign keys always reference an
+existing dimension row, and the same fact_rows and seed always give the same data.
+
+The fact table is generated in chunks of CHUNK_ROWS, each from its own random stream, so it can
+be streamed at sizes that do not fit in memory (iter_fact_batches) and any chunk can be
+regenerated on its own.
+"""
+import itertools
+import os
+import sys
+from datetime import date
+
+import numpy as np
+import pyarrow as pa
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'transfer_data'))
+
+from catalog import arrow_schema  # noqa: E402
+
+FACT_TABLE = 'fact_sales_order'
+
+# Rows generated at a time; the data does not depend on the batch size callers read it in
+CHUNK_ROWS = 1024 * 1024
+
+# created_date of the first fact row, and the number of days the fact rows are spread over
+START_DATE = date(2022, 11, 1)
+DEFAULT_DAYS = 730
+
+DEFAULT_SEED = 0
+
+
+def _columns(primary_key, *columns):
+    return [
+        {'name': name, 'data_type': data_type, 'precision': precision, 'scale': scale, 'primary_key': name == primary_key}
+        for name, data_type, precision, scale in columns
+    ]
+
+
+# Columns of every table, in SELECT * order, as catalog.get_catalog returns them
+CATALOG = {
+    'fact_sales_order': _columns(
+        'sales_record_id',
+        ('sales_record_id', 'integer', 32, 0),
+        ('sales_order_id', 'integer', 32, 0),
+        ('created_date', 'date', None, None),
+        ('created_time', 'time without time zone', None, None),
+        ('last_updated_date', 'date', None, None),
+        ('last_updated_time', 'time without time zone', None, None),
+        ('sales_staff_id', 'integer', 32, 0),
+        ('counterparty_id', 'integer', 32, 0),
+        ('units_sold', 'integer', 32, 0),
+        ('unit_price', 'numeric', 10, 2),
+        ('currency_id', 'integer', 32, 0),
+        ('design_id', 'integer', 32, 0),
+        ('agreed_payment_date', 'date', None, None),
+        ('agreed_delivery_date', 'date', None, None),
+        ('agreed_delivery_location_id', 'integer', 32, 0),
+    ),
+    'dim_staff': _columns(
+        'staff_id',
+        ('staff_id', 'integer', 32, 0),
+        ('first_name', 'character varying', None, None),
+        ('last_name', 'character varying', None, None),
+        ('department_name', 'character varying', None, None),
+        ('location', 'character varying', None, None),
+        ('email_address', 'character varying', None, None),
+    ),
+    'dim_location': _columns(
+        'location_id',
+        ('location_id', 'integer', 32, 0),
+        ('address_line_1', 'character varying', None, None),
+        ('address_line_2', 'character varying', None, None),
+        ('district', 'character varying', None, None),
+        ('city', 'character varying', None, None),
+        ('postal_code', 'character varying', None, None),
+        ('country', 'character varying', None, None),
+        ('phone', 'character varying', None, None),
+    ),
+    'dim_design': _columns(
+        'design_id',
+        ('design_id', 'integer', 32, 0),
+        ('design_name', 'character varying', None, None),
+        ('file_location', 'character varying', None, None),
+        ('file_name', 'character varying', None, None),
+    ),
+    'dim_date': _columns(
+        'date_id',
+        ('date_id', 'date', None, None),
+        ('year', 'integer', 32, 0),
+        ('month', 'integer', 32, 0),
+        ('day', 'integer', 32, 0),
+        ('day_of_week', 'integer', 32, 0),
+        ('day_name', 'character varying', None, None),
+        ('month_name', 'character varying', None, None),
+        ('quarter', 'integer', 32, 0),
+    ),
+    'dim_currency': _columns(
+        'currency_id',
+        ('currency_id', 'integer', 32, 0),
+        ('currency_code', 'character varying', None, None),
+        ('currency_name', 'character varying', None, None),
+    ),
+    'dim_counterparty': _columns(
+        'counterparty_id',
+        ('counterparty_id', 'integer', 32, 0),
+        ('counterparty_legal_name', 'character varying', None, None),
+        ('counterparty_legal_address_line_1', 'character varying', None, None),
+        ('counterparty_legal_address_line_2', 'character varying', None, None),
+        ('counterparty_legal_district', 'character varying', None, None),
+        ('counterparty_legal_city', 'character varying', None, None),
+        ('counterparty_legal_postal_code', 'character varying', None, None),
+        ('counterparty_legal_country', 'character varying', None, None),
+        ('counterparty_legal_phone_number', 'character varying', None, None),
+    ),
+}
+
+TABLES = list(CATALOG)
+
+FIRST_NAMES = ['Jeremie', 'Deron', 'Jeanette', 'Ana', 'Magdalena', 'Korey', 'Raphael', 'Oswaldo', 'Brody', 'Jazmyn',
+               'Meda', 'Imani', 'Stan', 'Rigoberto', 'Tom', 'Fay', 'Lena', 'Ravi', 'Yusuf', 'Marta']
+LAST_NAMES = ['Franey', 'Beier', 'Erdman', 'Glover', 'Zieme', 'Pfannerstill', 'Kuhlman', 'Rohan', 'Ratke', 'Langworth',
+              'Hahn', 'Walsh', 'Bauch', 'Rippin', 'Okuneva', 'Hills', 'Kemmer', 'Reilly', 'Stroman', 'Koch']
+DEPARTMENTS = ['Sales', 'Purchasing', 'Production', 'Dispatch', 'Finance', 'Facilities', 'Communications', 'HR']
+OFFICES = ['Manchester', 'Leeds', 'London', 'Birmingham', 'Bristol']
+COUNTRIES = ['United Kingdom', 'United States', 'Germany', 'France', 'Spain', 'Italy', 'Netherlands', 'Belgium',
+             'Portugal', 'Ireland', 'Poland', 'Sweden', 'Norway', 'Denmark', 'Finland', 'Austria', 'Switzerland',
+             'Greece', 'Turkey', 'Japan', 'China', 'India', 'Brazil', 'Mexico', 'Canada', 'Australia', 'Chile',
+             'Argentina', 'Egypt', 'Nigeria', 'Kenya', 'South Africa', 'Morocco', 'Iceland', 'Estonia', 'Latvia',
+             'Lithuania', 'Czech Republic', 'Hungary', 'Romania']
+CITIES = ['New Patienceburgh', 'Aliso Viejo', 'Lake Charles', 'Fort Shadburgh', 'Utica', 'Pricetown', 'Sayreville',
+          'Kendraburgh', 'Olsonside', 'Ryanside', 'Oakland Park', 'Lake Arne', 'East Bobbie', 'Wisokyborough']
+DISTRICTS = ['Avon', 'Buckinghamshire', 'Cambridgeshire', 'Bedfordshire', 'Cheshire', 'Cornwall', 'Cumbria']
+DESIGN_WORDS = ['Wooden', 'Bronze', 'Granite', 'Steel', 'Soft', 'Frozen', 'Fresh', 'Cotton', 'Rubber', 'Plastic',
+                'Concrete', 'Metal', 'Fantastic', 'Practical', 'Sleek', 'Rustic']
+CURRENCIES = [('GBP', 'British Pound'), ('USD', 'US Dollar'), ('EUR', 'Euro'), ('JPY', 'Japanese Yen'),
+              ('CHF', 'Swiss Franc'), ('CAD', 'Canadian Dollar'), ('AUD', 'Australian Dollar'),
+              ('SEK', 'Swedish Krona'), ('NOK', 'Norwegian Krone'), ('DKK', 'Danish Krone')]
+COMPANY_SUFFIXES = ['Ltd', 'Inc', 'LLC', 'Group', 'and Sons', 'Partners']
+DAY_NAMES = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+MONTH_NAMES = ['January', 'February', 'March', 'April', 'May', 'June', 'July', 'August', 'September', 'October',
+               'November', 'December']
+
+
+def table_sizes(fact_rows, days=DEFAULT_DAYS):
+    """
+    Number of rows of every table for a fact table of fact_rows rows.
+
+    The dimensions grow with the fact table, more slowly, so the joins and group counts of the
+    analyses grow with the scale as they would in the warehouse.
+    """
+    return {
+        'fact_sales_order': fact_rows,
+        'dim_staff': max(20, fact_rows // 5_000),
+        'dim_location': max(30, fact_rows // 2_000),
+        'dim_design': max(50, fact_rows // 1_000),
+        'dim_date': days + 60,
+        'dim_currency': len(CURRENCIES),
+        'dim_counterparty': max(20, fact_rows // 10_000),
+    }
+
+
+def schema(table):
+    """
+    The Arrow schema transfer_data.py writes the table with.
+    """
+    return arrow_schema(CATALOG[table])
+
+
+def _text(values, codes, nulls=None):
+    """
+    Dictionary-encoded text column from a list of values and one code per row.
+    """
+    indices = pa.array(np.asarray(codes, dtype='int32'), mask=nulls)
+    return pa.DictionaryArray.from_arrays(indices, pa.array(values, pa.string()))
+
+
+def _labels(prefix, rows, start=1):
+    return [f"{prefix} {i}" for i in range(start, start + rows)]
+
+
+def _decimal(cents, type_):
+    """
+    Decimal column from integer cents, building the 128-bit unscaled values directly.
+    """
+    cents = np.asarray(cents, dtype='int64')
+    unscaled = np.stack([cents, cents >> 63], axis=1)
+    return pa.Array.from_buffers(type_, len(cents), [None, pa.py_buffer(np.ascontiguousarray(unscaled))])
+
+
+def _dates(days):
+    return pa.array(np.datetime64(START_DATE, 'D') + np.asarray(days, dtype='int64')).cast(pa.date32())
+
+
+def _times(rng, rows):
+    return pa.array(rng.integers(0, 86_400_000_000, rows, dtype='int64')).cast(pa.time64('us'))
+
+
+def _dimension_columns(table, rows, rng):
+    ids = pa.array(np.arange(1, rows + 1, dtype='int32'))
+    if table == 'dim_staff':
+        first = rng.integers(0, len(FIRST_NAMES), rows)
+        last = rng.integers(0, len(LAST_NAMES), rows)
+        return [
+            ids,
+            _text(FIRST_NAMES, first),
+            _text(LAST_NAMES, last),
+            _text(DEPARTMENTS, rng.integers(0, len(DEPARTMENTS), rows)),
+            _text(OFFICES, rng.integers(0, len(OFFICES), rows)),
+            pa.array([f"{FIRST_NAMES[f].lower()}.{LAST_NAMES[l].lower()}{i}@terrifictotes.com"
+                      for i, (f, l) in enumerate(zip(first, last), 1)]).dictionary_encode(),
+        ]
+    if table == 'dim_location':
+        return [
+            ids,
+            _text(_labels('Street', rows), np.arange(rows)),
+            _text(_labels('Flat', 50), rng.integers(0, 50, rows), nulls=rng.random(rows) < 0.5),
+            _text(DISTRICTS, rng.integers(0, len(DISTRICTS), rows), nulls=rng.random(rows) < 0.4),
+            _text(CITIES, rng.integers(0, len(CITIES), rows)),
+            _text([f"{i:05d}" for i in range(rows)], np.arange(rows)),
+            _text(COUNTRIES, rng.integers(0, len(COUNTRIES), rows)),
+            _text([f"1{i:09d}" for i in range(rows)], np.arange(rows)),
+        ]
+    if table == 'dim_design':
+        # Names repeat, as they do in the warehouse, so the analysis groups several designs together
+        name_count = max(1, rows // 4)
+        names = [f"{DESIGN_WORDS[i % len(DESIGN_WORDS)]} {i // len(DESIGN_WORDS)}" for i in range(name_count)]
+        return [
+            ids,
+            _text(names, rng.integers(0, name_count, rows)),
+            _text(['/usr', '/private', '/System', '/opt/include', '/etc/periodic'], rng.integers(0, 5, rows)),
+            _text([f"design-{i}.json" for i in range(1, rows + 1)], np.arange(rows)),
+        ]
+    if table == 'dim_date':
+        dates = np.datetime64(START_DATE, 'D') + np.arange(rows)
+        years = dates.astype('datetime64[Y]').astype('int64') + 1970
+        months = dates.astype('datetime64[M]').astype('int64') % 12 + 1
+        day_of_week = (dates.astype('int64') + 3) % 7
+        return [
+            _dates(np.arange(rows)),
+            pa.array(years.astype('int32')),
+            pa.array(months.astype('int32')),
+            pa.array((dates - dates.astype('datetime64[M]')).astype('int32') + 1),
+            pa.array((day_of_week + 1).astype('int32')),
+            _text(DAY_NAMES, day_of_week),
+            _text(MONTH_NAMES, months - 1),
+            pa.array(((months - 1) // 3 + 1).astype('int32')),
+        ]
+    if table == 'dim_currency':
+        return [
+            ids,
+            _text([code for code, _ in CURRENCIES], np.arange(rows)),
+            _text([name for _, name in CURRENCIES], np.arange(rows)),
+        ]
+    if table == 'dim_counterparty':
+        return [
+            ids,
+            _text([f"{LAST_NAMES[i % len(LAST_NAMES)]} {COMPANY_SUFFIXES[i % len(COMPANY_SUFFIXES)]} {i}"
+                   for i in range(rows)], np.arange(rows)),
+            _text(_labels('Road', rows), np.arange(rows)),
+            _text(_labels('Unit', 20), rng.integers(0, 20, rows), nulls=rng.random(rows) < 0.5),
+            _text(DISTRICTS, rng.integers(0, len(DISTRICTS), rows), nulls=rng.random(rows) < 0.4),
+            _text(CITIES, rng.integers(0, len(CITIES), rows)),
+            _text([f"{i:05d}" for i in range(rows)], np.arange(rows)),
+            _text(COUNTRIES, rng.integers(0, len(COUNTRIES), rows)),
+            _text([f"2{i:09d}" for i in range(rows)], np.arange(rows)),
+        ]
+    raise KeyError(table)
+
+
+def dimension_table(table, fact_rows, seed=DEFAULT_SEED, days=DEFAULT_DAYS):
+    """
+    Generates a dimension table sized for a fact table of fact_rows rows.
+
+    Parameters:
+    - table: str: One of the dim_* tables of CATALOG
+    - fact_rows: int: Rows of the fact table the dimension goes with
+    - seed: int: Seed of the generator
+    - days: int: Days the fact rows are spread over
+
+    Returns:
+    - pyarrow.Table: The table, in schema(table)
+    """
+    rows = table_sizes(fact_rows, days)[table]
+    rng = np.random.default_rng([seed, TABLES.index(table)])
+    return pa.Table.from_arrays(_dimension_columns(table, rows, rng), schema=schema(table))
+
+
+def fact_chunk(chunk, fact_rows, seed=DEFAULT_SEED, days=DEFAULT_DAYS):
+    """
+    Generates chunk number chunk (CHUNK_ROWS rows, fewer for the last one) of the fact table.
+
+    Rows are in sales_record_id order, which is also created_date order: the table grows by
+    appending the most recent sales, as the warehouse does.
+
+    Returns:
+    - pyarrow.RecordBatch: The rows, in schema('fact_sales_order')
+    """
+    sizes = table_sizes(fact_rows, days)
+    start = chunk * CHUNK_ROWS
+    rows = max(0, min(CHUNK_ROWS, fact_rows - start))
+    rng = np.random.default_rng([seed, TABLES.index(FACT_TABLE), chunk])
+
+    record_ids = np.arange(start + 1, start + rows + 1, dtype='int64')
+    created = (record_ids - 1) * days // max(fact_rows, 1)
+    updated = created + rng.integers(0, 3, rows)
+    # Roughly 1.5 lines per sales order
+    order_ids = (record_ids * 2 + 2) // 3
+
+    def foreign_keys(table):
+        return pa.array(rng.integers(1, sizes[table] + 1, rows, dtype='int32'))
+
+    columns = [
+        pa.array(record_ids.astype('int32')),
+        pa.array(order_ids.astype('int32')),
+        _dates(created),
+        _times(rng, rows),
+        _dates(updated),
+        _times(rng, rows),
+        foreign_keys('dim_staff'),
+        foreign_keys('dim_counterparty'),
+        pa.array(rng.integers(1, 100_001, rows, dtype='int32')),
+        _decimal(rng.integers(200, 400, rows), pa.decimal128(10, 2)),
+        foreign_keys('dim_currency'),
+        foreign_keys('dim_design'),
+        _dates(updated + rng.integers(1, 30, rows)),
+        _dates(updated + rng.integers(1, 60, rows)),
+        foreign_keys('dim_location'),
+    ]
+    return pa.RecordBatch.from_arrays(columns, schema=schema(FACT_TABLE))
+
+
+def iter_fact_batches(fact_rows, seed=DEFAULT_SEED, days=DEFAULT_DAYS):
+    """
+    Yields the fact table chunk by chunk, so it never has to be held in memory as a whole.
+    """
+    for chunk in range(-(-fact_rows // CHUNK_ROWS)):
+        yield fact_chunk(chunk, fact_rows, seed, days)
+
+
+def generate_table(table, fact_rows, seed=DEFAULT_SEED, days=DEFAULT_DAYS):
+    """
+    Generates any table of the star schema as a single pyarrow Table.
+    """
+    if table == FACT_TABLE:
+        return pa.Table.from_batches(list(iter_fact_batches(fact_rows, seed, days)), schema=schema(FACT_TABLE))
+    return dimension_table(table, fact_rows, seed, days)
+
+
+def generate_star_schema(fact_rows, seed=DEFAULT_SEED, days=DEFAULT_DAYS):
+    """
+    Generates every table of the star schema.
+
+    Returns:
+    - dict: table name -> pyarrow Table
+    """
+    return {table: generate_table(table, fact_rows, seed, days) for table in TABLES}
+
+
+def iter_rows(table, fact_rows, seed=DEFAULT_SEED, days=DEFAULT_DAYS):
+    """
+    Yields the rows of a table as tuples of Python values, as a Postgres driver returns them.
+    """
+    if table == FACT_TABLE:
+        batches = iter_fact_batches(fact_rows, seed, days)
+    else:
+        batches = dimension_table(table, fact_rows, seed, days).to_batches(CHUNK_ROWS)
+    for batch in batches:
+        yield from zip(*(column.to_pylist() for column in batch.columns))
+
+
+class SyntheticConnection:
+    """
+    Stands in for a pg8000 Connection serving the synthetic tables, for benchmarking
+    transfer_data.py without a database.
+
+    Only the statements transfer_data.py runs to extract a table are understood: a plain
+    SELECT * of a table, and the server-side cursor of streaming mode. Rows are built from the
+    generator as they are fetched, so the cost measured is the client side of the extraction:
+    turning driver rows into Arrow and writing them.
+    """
+
+    def __init__(self, fact_rows, seed=DEFAULT_SEED, days=DEFAULT_DAYS):
+        self.fact_rows = fact_rows
+        self.seed = seed
+        self.days = days
+        self._cursor = None
+
+    def _table(self, sql):
+        for table in TABLES:
+            if f'"{table}"' in sql or f" {table}" in sql:
+                return table
+        raise ValueError(f"No synthetic table in query: {sql}")
+
+    def run(self, sql, **params):
+        statement = sql.strip()
+        if statement.startswith('DECLARE'):
+            self._cursor = iter_rows(self._table(statement), self.fact_rows, self.seed, self.days)
+            return []
+        if statement.startswith('FETCH FORWARD'):
+            return list(itertools.islice(self._cursor, int(statement.split()[2])))
+        if statement.startswith('SELECT'):
+            return list(iter_rows(self._table(statement), self.fact_rows, self.seed, self.days))
+        # START TRANSACTION, CLOSE, ROLLBACK
+        self._cursor = None if statement.startswith(('CLOSE', 'ROLLBACK')) else self._cursor
+        return []
+
+    def close(self):
+        self._cursor = None
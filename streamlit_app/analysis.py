@@ -0,0 +1,146 @@
+import pandas as pd
+
+from star_schema import FACT_TABLE, star_schema_columns
+from summaries import sales_totals, summary_table
+
+
+def sales_by_staff_and_location(data):
+    """
+    Total sales amount per staff member and delivery location (country), largest first.
+
+    Parameters:
+    - data: Dataset or dict: table name -> DataFrame
+
+    Returns:
+    - pandas.DataFrame: staff_name, location_name, total_sales_amount
+    """
+    (staff_positions, location_positions), totals = sales_totals(data, 'sales_staff_id', 'agreed_delivery_location_id')
+
+    df_staff = data['dim_staff']
+    df_location = data['dim_location']
+
+    df = pd.DataFrame({
+        'first_name': df_staff['first_name'].to_numpy()[staff_positions],
+        'last_name': df_staff['last_name'].to_numpy()[staff_positions],
+        # Renaming 'country' column to 'location_name'
+        'location_name': df_location['country'].to_numpy()[location_positions],
+        'total_sales_amount': totals,
+    })
+
+    # Different staff ids or locations can share a name, so the totals are still combined by name
+    df = df.groupby(['first_name', 'last_name', 'location_name']).agg(total_sales_amount=('total_sales_amount', 'sum')).reset_index()
+
+    df['staff_name'] = df['first_name'] + ' ' + df['last_name']
+
+    df['total_sales_amount'] = pd.to_numeric(df['total_sales_amount'], errors='coerce')
+
+    # Sort by 'total_sales_amount' in descending order, without the old index being added as a column
+    df = df.sort_values(by='total_sales_amount', ascending=False).reset_index(drop=True)
+
+    return df[['staff_name', 'location_name', 'total_sales_amount']]
+
+
+def sales_by_product_design(data):
+    """
+    Total sales amount per product design, largest first.
+
+    Parameters:
+    - data: Dataset or dict: table name -> DataFrame
+
+    Returns:
+    - pandas.DataFrame: design_name, total_sales_amount
+    """
+    (design_positions,), totals = sales_totals(data, 'design_id')
+
+    df = pd.DataFrame({
+        'design_name': data['dim_design']['design_name'].to_numpy()[design_positions],
+        'total_sales_amount': totals,
+    })
+
+    df = df.groupby('design_name').agg(total_sales_amount=('total_sales_amount', 'sum')).reset_index()
+
+    df['total_sales_amount'] = pd.to_numeric(df['total_sales_amount'], errors='coerce')
+
+    # Sort by 'total_sales_amount' in descending order, without the old index being added as a column
+    df = df.sort_values(by='total_sales_amount', ascending=False).reset_index(drop=True)
+
+    return df
+
+
+def sales_by_currency(data):
+    """
+    Total sales amount per currency, largest first.
+
+    Parameters:
+    - data: Dataset or dict: table name -> DataFrame
+
+    Returns:
+    - pandas.DataFrame: currency_code, total_sales_amount
+    """
+    (currency_positions,), totals = sales_totals(data, 'currency_id')
+
+    df = pd.DataFrame({
+        'currency_code': data['dim_currency']['currency_code'].to_numpy()[currency_positions],
+        'total_sales_amount': totals,
+    })
+
+    df = df.groupby('currency_code').agg(total_sales_amount=('total_sales_amount', 'sum')).reset_index()
+
+    df['total_sales_amount'] = pd.to_numeric(df['total_sales_amount'], errors='coerce')
+
+    # Sort by 'total_sales_amount' in descending order, without the old index being added as a column
+    df = df.sort_values(by='total_sales_amount', ascending=False).reset_index(drop=True)
+
+    return df
+
+
+# Fact foreign keys each analysis totals sales by, and the dimension columns it displays
+ANALYSIS_KEYS = {
+    'sales_by_staff_and_location': (['sales_staff_id', 'agreed_delivery_location_id'],
+                                    {'dim_staff': ['first_name', 'last_name'], 'dim_location': ['country']}),
+    'sales_by_product_design': (['design_id'], {'dim_design': ['design_name']}),
+    'sales_by_currency': (['currency_id'], {'dim_currency': ['currency_code']}),
+}
+
+# Columns each analysis reads, by table; everything else can be left out when loading
+REQUIRED_COLUMNS = {
+    analysis: star_schema_columns(foreign_keys, dimension_columns)
+    for analysis, (foreign_keys, dimension_columns) in ANALYSIS_KEYS.items()
+}
+
+
+def required_columns(analyses=None):
+    """
+    Merges the columns of the given analyses into the projection passed to the loader.
+
+    Parameters:
+    - analyses: list: Analysis function names, all of REQUIRED_COLUMNS by default
+
+    Returns:
+    - dict: table name -> list of columns, in first-seen order
+    """
+    columns = {}
+    for analysis in analyses or REQUIRED_COLUMNS:
+        for table, table_columns in REQUIRED_COLUMNS[analysis].items():
+            columns[table] = list(dict.fromkeys(columns.get(table, []) + table_columns))
+    return columns
+
+
+def required_tables(data, analyses=None):
+    """
+    Lists the tables the given analyses will read from a dataset: an up to date summary table
+    instead of the fact table where there is one.
+
+    Parameters:
+    - data: Dataset: The dataset
+    - analyses: list: Analysis function names, all of REQUIRED_COLUMNS by default
+
+    Returns:
+    - list: Table names, in first-seen order
+    """
+    tables = []
+    for analysis in analyses or REQUIRED_COLUMNS:
+        summary = summary_table(data, ANALYSIS_KEYS[analysis][0])
+        for table in REQUIRED_COLUMNS[analysis]:
+            tables.append(summary if table == FACT_TABLE and summary else table)
+    return list(dict.fromkeys(tables))
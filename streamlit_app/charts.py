@@ -0,0 +1,75 @@
+from io import BytesIO
+
+import pandas as pd
+from matplotlib.figure import Figure
+
+DEFAULT_TOP_N = 15
+OTHER_LABEL = 'Other'
+
+
+def top_n(df, x_column, y_columns, n=DEFAULT_TOP_N, other_label=OTHER_LABEL):
+    """
+    Limits the bars of a chart: keeps the n bars with the largest totals and sums the rest into a
+    single 'Other' bar. With several y columns (one series each), the n largest series are kept
+    and the rest summed into an 'Other' series as well.
+
+    Parameters:
+    - df: pandas.DataFrame: The chart data, one row per x value
+    - x_column: str: The column with the bar labels
+    - y_columns: list: The columns with the bar heights
+    - n: int: Maximum number of bars (and series) kept before the 'Other' one; None keeps everything
+    - other_label: str: Label of the bar and series the rest is summed into
+
+    Returns:
+    - tuple: (pandas.DataFrame with x_column and the y columns kept, list of those y columns)
+    """
+    values = df.set_index(df[x_column].astype(str))[list(y_columns)]
+    if n is None:
+        return values.rename_axis(x_column).reset_index(), list(values.columns)
+
+    if len(values.columns) > n + 1:
+        column_totals = values.sum().sort_values(ascending=False)
+        kept = list(column_totals.index[:n])
+        values = values[kept].assign(**{other_label: values.drop(columns=kept).sum(axis=1)})
+
+    if len(values) > n + 1:
+        row_totals = values.sum(axis=1).sort_values(ascending=False)
+        rest = values.loc[row_totals.index[n:]].sum().to_frame(other_label).T
+        values = pd.concat([values.loc[row_totals.index[:n]], rest])
+
+    return values.rename_axis(x_column).reset_index(), list(values.columns)
+
+
+def render_bar_chart(df, x_column, y_columns, title, x_label, y_label, dpi=100):
+    """
+    Renders a bar chart to PNG bytes.
+
+    The figure is created directly, not through pyplot, so it is never registered with pyplot's
+    global figure list, and it is cleared once rendered; nothing outlives the call.
+
+    Parameters:
+    - df: pandas.DataFrame: The chart data
+    - x_column: str: The column for the x-axis
+    - y_columns: list: The columns for the bars
+    - title, x_label, y_label: str: Chart labels
+    - dpi: int: Resolution of the PNG
+
+    Returns:
+    - bytes: The PNG image
+    """
+    fig = Figure(figsize=(10, 6))
+    try:
+        ax = fig.subplots()
+        df.plot(kind='bar', x=x_column, y=list(y_columns), ax=ax)
+        ax.set_xlabel(x_label)
+        ax.set_ylabel(y_label)
+        ax.set_title(title)
+        for label in ax.get_xticklabels():
+            label.set_rotation(45)
+            label.set_horizontalalignment('right')
+        fig.tight_layout()
+        buffer = BytesIO()
+        fig.savefig(buffer, format='png', dpi=dpi)
+        return buffer.getvalue()
+    finally:
+        fig.clear()
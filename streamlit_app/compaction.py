@@ -0,0 +1,125 @@
+import logging
+from decimal import Decimal
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+logger = logging.getLogger('compaction')
+logger.setLevel(logging.INFO)
+
+# Text columns with at most this many distinct values per row are stored as categoricals
+CATEGORY_MAX_RATIO = 0.5
+
+# Significant decimal digits float64 always gives back exactly once rounded
+FLOAT64_DIGITS = 15
+
+INT_TYPES = (pa.int8(), pa.int16(), pa.int32(), pa.int64())
+
+
+def smallest_int_type(min_value, max_value):
+    """
+    Returns the narrowest signed integer type holding every value between min_value and max_value.
+    """
+    for int_type in INT_TYPES:
+        limits = np.iinfo(int_type.to_pandas_dtype())
+        if limits.min <= min_value and max_value <= limits.max:
+            return int_type
+    return pa.int64()
+
+
+def fits_float64(column, scale):
+    """
+    Whether every value of a decimal column has at most FLOAT64_DIGITS significant digits, so that
+    its float64 rounded back to scale decimal places is the exact decimal.
+    """
+    min_max = pc.min_max(column)
+    largest = max(abs(float(min_max['min'].as_py())), abs(float(min_max['max'].as_py())))
+    return largest < 10 ** (FLOAT64_DIGITS - scale)
+
+
+def decimal_to_float64(column):
+    """
+    Converts a decimal column that fits_float64 to the float64 nearest to each value, as float() of
+    a Python Decimal gives: the unscaled integer and 10 ** scale are both exact in float64, so their
+    quotient is correctly rounded, which Arrow's own decimal to float cast is not.
+    """
+    scale = column.type.scale
+    unscaled = pc.multiply(column.cast(pa.decimal128(18, scale)), pa.scalar(Decimal(10 ** scale))).cast(pa.int64())
+    return pc.divide(unscaled.cast(pa.float64()), float(10 ** scale))
+
+
+def compact_column(column):
+    """
+    Returns the column in a smaller type when its values allow it without losing any:
+
+    - integers are downcast to the narrowest type holding their min and max
+    - text is dictionary-encoded (a pandas categorical) when at most CATEGORY_MAX_RATIO of the rows
+      are distinct values, and dictionaries get the narrowest index type
+    - decimals such as unit_price, which pandas would hold as Python Decimal objects, become float64,
+      exact to their scale
+
+    Parameters:
+    - column: pyarrow.ChunkedArray: The column
+
+    Returns:
+    - pyarrow.ChunkedArray: The compacted column, or the column itself when it cannot be compacted
+    """
+    if len(column) == column.null_count:
+        return column
+    column_type = column.type
+
+    if pa.types.is_integer(column_type):
+        min_max = pc.min_max(column)
+        int_type = smallest_int_type(min_max['min'].as_py(), min_max['max'].as_py())
+        if int_type.bit_width < column_type.bit_width:
+            return column.cast(int_type)
+
+    elif pa.types.is_string(column_type) or pa.types.is_large_string(column_type):
+        encoded = pc.dictionary_encode(column)
+        distinct = max((len(chunk.dictionary) for chunk in encoded.chunks), default=0)
+        if distinct <= CATEGORY_MAX_RATIO * len(column):
+            return compact_dictionary(pa.chunked_array(encoded.chunks, encoded.type), distinct)
+
+    elif pa.types.is_dictionary(column_type):
+        distinct = max((len(chunk.dictionary) for chunk in column.chunks), default=0)
+        return compact_dictionary(column, distinct)
+
+    elif pa.types.is_decimal(column_type) and column_type.scale >= 0 and fits_float64(column, column_type.scale):
+        # The value the analyses already compute with, without a Python Decimal object per row
+        return decimal_to_float64(column)
+
+    return column
+
+
+def compact_dictionary(column, distinct):
+    index_type = smallest_int_type(0, max(distinct - 1, 0))
+    if index_type.bit_width < column.type.index_type.bit_width:
+        return column.cast(pa.dictionary(index_type, column.type.value_type))
+    return column
+
+
+def compact_table(arrow_table):
+    """
+    Stores every column of a decoded table in the smallest type that holds its values exactly
+    (see compact_column), before it is converted to pandas.
+
+    Parameters:
+    - arrow_table: pyarrow.Table: The decoded table
+
+    Returns:
+    - tuple: (pyarrow.Table, dict with the Arrow 'bytes_before' and 'bytes_after' compaction and
+      the 'compacted_columns' as {column: 'old type -> new type'})
+    """
+    bytes_before = arrow_table.nbytes
+    columns, compacted = [], {}
+    for field, column in zip(arrow_table.schema, arrow_table.columns):
+        compact = compact_column(column)
+        if compact.type != field.type:
+            compacted[field.name] = f"{field.type} -> {compact.type}"
+        columns.append(compact)
+    schema = pa.schema([field.with_type(column.type) for field, column in zip(arrow_table.schema, columns)],
+                       metadata=arrow_table.schema.metadata)
+    # Gives the chunks of each dictionary column one dictionary, so it is stored and converted once
+    compact = pa.Table.from_arrays(columns, schema=schema).unify_dictionaries()
+    return compact, {'bytes_before': bytes_before, 'bytes_after': compact.nbytes, 'compacted_columns': compacted}
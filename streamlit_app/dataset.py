@@ -0,0 +1,432 @@
+import hashlib
+import logging
+import threading
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from functools import partial
+from types import MappingProxyType
+
+from instrumentation import in_context, span
+from s3_loader import DEFAULT_BACKEND, DEFAULT_MAX_WORKERS, get_s3_client, get_latest_objects, get_manifest_etag, fetch_table
+
+logger = logging.getLogger('dataset')
+logger.setLevel(logging.INFO)
+
+
+def dataset_version(sources, filters=None):
+    """
+    Derives a short version id from the S3 key and ETag of every table, and the row filter it is
+    loaded with, so the same files in S3 read with the same filters always give the same version.
+
+    Parameters:
+    - sources: dict: table name -> {'Key', 'ETag', ...}
+    - filters: dict: Optional table name -> row filter
+
+    Returns:
+    - str: The version id
+    """
+    digest = hashlib.sha1()
+    for table in sorted(sources):
+        digest.update(f"{table}:{sources[table]['Key']}:{sources[table].get('ETag')}\n".encode("utf-8"))
+    for table in sorted(filters or {}):
+        if table in sources:
+            digest.update(f"{table}:{filters[table]!r}\n".encode("utf-8"))
+    return digest.hexdigest()[:12]
+
+
+class Dataset(Mapping):
+    """
+    Read-only, versioned snapshot of the warehouse tables, loaded lazily table by table.
+
+    One instance is shared by every session of the server process, so it behaves like the
+    {table_name: DataFrame} dict returned by load_data_from_s3 but cannot be modified. The
+    DataFrames themselves are shared too: callers must copy before changing them.
+
+    The snapshot is fixed by its sources (the S3 object of every table), but a table is only
+    downloaded and decoded the first time it is accessed, once, however many sessions ask for it
+    at the same time. prefetch() starts loading tables in the background ahead of their use.
+    Tables loaded with a column projection only hold the projected columns; full_table() reads
+    the rest on demand.
+    """
+
+    def __init__(self, tables, sources, stats=None, columns=None, load_table=None, executor=None, filters=None):
+        """
+        Parameters:
+        - tables: dict: table name -> DataFrame, for the tables that are already loaded
+        - sources: dict: table name -> S3 object of every table in the snapshot
+        - stats: dict: Optional table name -> load timings of the loaded tables
+        - columns: dict: Optional table name -> columns, for the tables loaded with a projection
+        - load_table: callable: Function of (table name, S3 object, columns or None) returning
+          (DataFrame, load timings); needed for the tables not in tables and by full_table
+        - executor: concurrent.futures.Executor: Runs prefetch(); without one prefetch does nothing
+        - filters: dict: Optional table name -> row filter the tables are loaded with
+        """
+        self.sources = MappingProxyType({table: dict(obj) for table, obj in sources.items()})
+        self._tables = {table: df for table, df in tables.items() if table in self.sources}
+        self._stats = {table: table_stats for table, table_stats in (stats or {}).items() if table in self._tables}
+        self.columns = MappingProxyType({table: list(columns[table]) for table in (columns or {}) if table in self.sources})
+        self.filters = MappingProxyType({table: table_filter for table, table_filter in (filters or {}).items() if table in self.sources})
+        self.version = dataset_version(sources, self.filters)
+        self.loaded_at = datetime.now()
+        self._load_table = load_table
+        self._executor = executor
+        self._table_locks = {table: threading.Lock() for table in self.sources}
+        self._derived = {}
+        self._builders = {}
+        self._derived_locks = {}
+        self._derived_lock = threading.Lock()
+
+    @property
+    def stats(self):
+        """
+        Load timings of the tables loaded so far.
+        """
+        return MappingProxyType(dict(self._stats))
+
+    @property
+    def loaded(self):
+        """
+        Names of the tables loaded so far.
+        """
+        return [table for table in self.sources if table in self._tables]
+
+    @property
+    def builders(self):
+        """
+        name -> build function of the derived structures requested so far, so a newer snapshot can
+        rebuild them.
+        """
+        return MappingProxyType(dict(self._builders))
+
+    def derived(self, name, build):
+        """
+        Returns a structure derived from this snapshot (join indexes, profiles, ...), calling
+        build(dataset) the first time it is requested. Because a Dataset never changes, the result is
+        valid for as long as the Dataset is in use.
+
+        Parameters:
+        - name: str: Name the structure is memoized under
+        - build: callable: Function of the Dataset that builds the structure
+        """
+        if name in self._derived:
+            return self._derived[name]
+        # One lock per name, so a slow build does not hold up the others
+        with self._derived_lock:
+            lock = self._derived_locks.setdefault(name, threading.Lock())
+        with lock:
+            if name not in self._derived:
+                self._derived[name] = build(self)
+                self._builders[name] = build
+            return self._derived[name]
+
+    def full_table(self, table_name):
+        """
+        Returns a table with all of its columns. A projected table is loaded in full the first time
+        it is asked for, and kept for the life of this Dataset.
+        """
+        if table_name not in self.columns:
+            return self[table_name]
+        return self.derived(f"full_table:{table_name}",
+                            lambda dataset: dataset._load_table(table_name, dataset.sources[table_name], None)[0])
+
+    def prefetch(self, table_names):
+        """
+        Starts loading tables in the background, so they are ready (or further along) when accessed.
+
+        Parameters:
+        - table_names: iterable: Table names; unknown and already loaded tables are skipped
+
+        Returns:
+        - list: The futures of the loads started
+        """
+        if self._executor is None:
+            return []
+        futures = []
+        for table_name in table_names:
+            if table_name in self.sources and table_name not in self._tables:
+                future = self._executor.submit(in_context(self.__getitem__), table_name)
+                future.add_done_callback(self._log_prefetch_error)
+                futures.append(future)
+        return futures
+
+    def prefetch_derived(self, name, build):
+        """
+        Starts building a derived structure (see derived()) in the background, e.g. the profile of a
+        table as soon as it is opened, so it is ready when first asked for.
+
+        Returns:
+        - concurrent.futures.Future: The build, or None when it is already built or there is no executor
+        """
+        if self._executor is None or name in self._derived:
+            return None
+        future = self._executor.submit(in_context(self.derived), name, build)
+        future.add_done_callback(self._log_prefetch_error)
+        return future
+
+    @staticmethod
+    def _log_prefetch_error(future):
+        if not future.cancelled() and future.exception() is not None:
+            logger.error(f"Prefetch failed: {future.exception()}")
+
+    def __getitem__(self, table_name):
+        df = self._tables.get(table_name)
+        if df is not None:
+            return df
+        if table_name not in self.sources:
+            raise KeyError(table_name)
+        with self._table_locks[table_name]:
+            if table_name not in self._tables:
+                df, table_stats = self._load_table(table_name, self.sources[table_name], self.columns.get(table_name))
+                self._stats[table_name] = table_stats
+                self._tables[table_name] = df
+        return self._tables[table_name]
+
+    def __contains__(self, table_name):
+        # Without this, Mapping would load the table to answer
+        return table_name in self.sources
+
+    def __iter__(self):
+        return iter(self.sources)
+
+    def __len__(self):
+        return len(self.sources)
+
+    def __repr__(self):
+        return f"Dataset(version={self.version!r}, tables={list(self.sources)}, loaded={self.loaded})"
+
+
+class DatasetStore:
+    """
+    Holds the current Dataset for the whole server process.
+
+    Readers take store.current without locking; a refresh builds a complete new Dataset and then
+    replaces the reference in a single assignment, so a reader sees either the old or the new
+    snapshot, never a mix. Refreshes are serialised and only read the manifest: tables are loaded
+    when first accessed, and tables whose S3 key and ETag did not change are carried over from the
+    current snapshot if it has loaded them.
+
+    columns and filters ({table name: ...}, see load_data_from_s3) are applied to every load, e.g.
+    to read only the columns the analyses use, or only the recent months of the partitioned fact
+    table. Dataset.full_table() still gives every column of a projected table, loaded on demand.
+    filters may also be a function returning that dict, called for every refresh, so filters relative
+    to the current date (see recent_months_filter) move forward: a refresh swaps in a new Dataset
+    when they change, even if the data in S3 did not.
+    backend picks how tables are held (see s3_loader.BACKENDS): 'pyarrow' keeps the decoded Arrow
+    memory behind pandas ArrowDtype columns instead of converting it to NumPy. compact stores the
+    columns in the smallest types that hold their values (see compaction.compact_table).
+
+    poll() is the cheap check a DatasetRefresher runs in the background: one HEAD of the manifest,
+    and a refresh only when it changed. Its refreshes are warm: the new Dataset loads the tables and
+    rebuilds the derived structures the current one has, and runs the warmers, before it is swapped
+    in, so sessions never wait on them. Both snapshots are in memory while it warms.
+    """
+
+    def __init__(self, bucket_name, s3_folder="", aws_access_key_id=None, aws_secret_access_key=None,
+                 region_name=None, cache=None, max_workers=DEFAULT_MAX_WORKERS, columns=None, filters=None,
+                 backend=DEFAULT_BACKEND, compact=False):
+        self.bucket_name = bucket_name
+        self.s3_folder = s3_folder
+        self.cache = cache
+        self.max_workers = max_workers
+        self.columns = columns
+        self.filters = filters
+        self.backend = backend
+        self.compact = compact
+        self._s3_client = get_s3_client(aws_access_key_id, aws_secret_access_key, region_name, max_workers)
+        # Background loads of Dataset.prefetch, shared by every snapshot
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix='dataset-prefetch')
+        self._refresh_lock = threading.Lock()
+        self._current = None
+        self._listeners = []
+        self._warmers = []
+        self._manifest_etag = None
+
+    @property
+    def current(self):
+        """
+        The latest Dataset, or None before the first load.
+        """
+        return self._current
+
+    def subscribe(self, listener):
+        """
+        Registers a callable that is given the new Dataset every time one is swapped in,
+        e.g. to invalidate caches derived from the previous version.
+        """
+        if listener not in self._listeners:
+            self._listeners.append(listener)
+
+    def add_warmer(self, warmer):
+        """
+        Registers a callable that is given a new Dataset before a warm refresh swaps it in, e.g. to
+        compute the cached query results of the new version ahead of the first session asking.
+        """
+        if warmer not in self._warmers:
+            self._warmers.append(warmer)
+
+    def get(self):
+        """
+        Returns the current Dataset, reading the manifest first if nothing has been loaded yet.
+        """
+        current = self._current
+        if current is not None:
+            return current
+        with self._refresh_lock:
+            if self._current is None:
+                self._refresh()
+            return self._current
+
+    def refresh(self):
+        """
+        Reads the manifest (or lists S3) and swaps in a new Dataset if any table has a newer file.
+
+        Returns:
+        - Dataset: The current Dataset after the refresh
+        """
+        with self._refresh_lock:
+            return self._refresh()
+
+    def poll(self):
+        """
+        Swaps in a new, warmed Dataset if the data in S3 changed. Unless the manifest's ETag
+        changed (or there is no manifest to check) this is a single HEAD request.
+
+        Returns:
+        - Dataset: The current Dataset after the poll
+        """
+        with self._refresh_lock:
+            manifest_etag = get_manifest_etag(self._s3_client, self.bucket_name, self.s3_folder)
+            current = self._current
+            if manifest_etag is not None and manifest_etag == self._manifest_etag and current is not None \
+                    and current.version == dataset_version(current.sources, self._filters()):
+                return current
+            dataset = self._refresh(warm=True)
+            # Only remembered once the refresh succeeded, so a failed one is retried on the next poll
+            self._manifest_etag = manifest_etag
+            return dataset
+
+    def _filters(self):
+        return (self.filters() if callable(self.filters) else self.filters) or {}
+
+    def _load_table(self, table, s3_object, columns=None, filters=None):
+        return fetch_table(self._s3_client, self.bucket_name, table, s3_object, self.cache, columns,
+                           (filters or {}).get(table), self.max_workers, self.backend, self.compact)
+
+    def _warm(self, dataset, current):
+        """
+        Loads the tables and builds the derived structures of current into dataset, then runs the
+        warmers. A table that fails to load fails the refresh, leaving current in place; a failed
+        derived structure or warmer is only logged, and built again on first use.
+        """
+        with span('dataset.warm', version=dataset.version) as attributes:
+            futures = dataset.prefetch(current.loaded) if current is not None else []
+            for future in futures:
+                future.result()
+            builders = current.builders if current is not None else {}
+            for name, build in builders.items():
+                try:
+                    dataset.derived(name, build)
+                except Exception as e:
+                    logger.error(f"Could not rebuild {name} for dataset {dataset.version}: {e}")
+            for warmer in self._warmers:
+                try:
+                    warmer(dataset)
+                except Exception as e:
+                    logger.error(f"Dataset warmer {warmer} failed: {e}")
+            attributes.update(tables=len(futures), derived=len(builders))
+
+    def _refresh(self, warm=False):
+        latest_objects = get_latest_objects(self._s3_client, self.bucket_name, self.s3_folder)
+        if not latest_objects:
+            logger.error(f"No files found in the S3 folder: {self.s3_folder}")
+
+        filters = self._filters()
+        current = self._current
+        if current is not None and current.version == dataset_version(latest_objects, filters):
+            logger.info(f"Dataset {current.version} is up to date")
+            return current
+
+        # Loaded tables whose object and filter did not change are reused as they are
+        unchanged = [
+            table for table, s3_object in latest_objects.items()
+            if current is not None and table in current.loaded
+            and (current.sources[table]['Key'], current.sources[table].get('ETag')) == (s3_object['Key'], s3_object.get('ETag'))
+            and repr(current.filters.get(table)) == repr(filters.get(table))
+        ]
+        tables = {table: current[table] for table in unchanged}
+        stats = {table: current.stats[table] for table in unchanged if table in current.stats}
+
+        # Every table of the snapshot, including the ones loaded later, is read with the same filters
+        load_table = partial(self._load_table, filters=filters)
+        dataset = Dataset(tables, latest_objects, stats, self.columns, load_table, self._executor, filters)
+        if warm:
+            self._warm(dataset, current)
+        self._current = dataset
+        logger.info(f"Swapped in dataset {dataset.version} ({len(unchanged)} of {len(latest_objects)} tables carried over)")
+
+        for listener in self._listeners:
+            try:
+                listener(dataset)
+            except Exception as e:
+                logger.error(f"Dataset listener {listener} failed: {e}")
+        return dataset
+
+
+class DatasetRefresher:
+    """
+    Polls a DatasetStore for newer data on a daemon thread, so fresh data reaches every session
+    without anyone waiting for it to load: sessions pick up the swapped in Dataset on their next rerun.
+
+    There is one refresher per server process, so the S3 requests it makes are bounded by the
+    interval, not by the number of sessions. request() asks for a poll now, e.g. from a reload button.
+    """
+
+    def __init__(self, store, interval=None):
+        """
+        Parameters:
+        - store: DatasetStore: The store to poll
+        - interval: float: Seconds between polls; None or 0 only polls on request()
+        """
+        self.store = store
+        self.interval = interval or None
+        self.last_polled = None
+        self.last_error = None
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='dataset-refresher', daemon=True)
+            self._thread.start()
+            logger.info(f"Polling for new data every {self.interval} seconds" if self.interval
+                        else "Polling for new data on request only")
+        return self
+
+    def request(self):
+        """
+        Wakes the refresher up to poll now rather than at the end of its interval.
+        """
+        self._wake.set()
+
+    def stop(self):
+        self._stopped.set()
+        self._wake.set()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            if self._stopped.is_set():
+                break
+            try:
+                with span('dataset.poll') as attributes:
+                    previous = self.store.current
+                    attributes['swapped'] = self.store.poll() is not previous
+                self.last_error = None
+            except Exception as e:
+                # The current Dataset stays in place; the next poll tries again
+                self.last_error = e
+                logger.error(f"Polling for new data failed: {e}")
+            self.last_polled = datetime.now()
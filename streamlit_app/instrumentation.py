@@ -0,0 +1,237 @@
+"""
+Timing and memory spans around the hot paths, exported as JSON lines and Prometheus metrics.
+
+    with span('s3.get', key=key) as attributes:
+        body = ...
+        attributes['bytes'] = len(body)
+
+Every span records its wall and CPU (thread) seconds and how much the resident memory and the
+memory allocated by Arrow grew while it ran. Finished spans are aggregated into per-name counters
+and a duration histogram (prometheus_text), appended to a JSON lines file when one is configured,
+and handed to the active SpanCollector, which gathers the spans of one unit of work such as a
+Streamlit rerun.
+
+Spans nest: each one records the id of the span it started in. Work submitted to a thread pool
+keeps its parent and collector when the function is wrapped with in_context().
+
+This is the only copy: transfer_data.py and upload_to_s3.py add streamlit_app/ to sys.path to
+import it.
+"""
+import contextvars
+import itertools
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+import pyarrow as pa
+
+logger = logging.getLogger('instrumentation')
+logger.setLevel(logging.INFO)
+
+# Upper bounds of the span duration histogram buckets, in seconds
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 60)
+
+_span_ids = itertools.count(1)
+_parent = contextvars.ContextVar('instrumentation_parent', default=None)
+_collector = contextvars.ContextVar('instrumentation_collector', default=None)
+
+
+def rss_bytes():
+    """
+    Current resident memory of the process, or None where /proc is not available.
+    """
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return None
+
+
+class SpanRegistry:
+    """
+    Process-wide sink of finished spans: per-name counters, a duration histogram per name and an
+    optional JSON lines file.
+    """
+
+    def __init__(self, service='app'):
+        self.service = service
+        self.jsonl_path = None
+        self._file = None
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    def configure(self, service=None, jsonl_path=None):
+        """
+        Sets the service label of the metrics and the JSON lines file spans are appended to
+        (None for no file, '-' for standard output). Calling it again with the same values does nothing.
+        """
+        with self._lock:
+            if service:
+                self.service = service
+            if jsonl_path != self.jsonl_path:
+                if self._file is not None and self._file is not sys.stdout:
+                    self._file.close()
+                self._file = None
+                if jsonl_path == '-':
+                    self._file = sys.stdout
+                elif jsonl_path:
+                    self._file = open(jsonl_path, 'a', encoding="utf-8")
+                self.jsonl_path = jsonl_path
+
+    def record(self, span_record):
+        with self._lock:
+            metrics = self._metrics.get(span_record['name'])
+            if metrics is None:
+                metrics = self._metrics[span_record['name']] = {
+                    'count': 0, 'errors': 0, 'seconds': 0.0, 'cpu_seconds': 0.0, 'buckets': [0] * len(DURATION_BUCKETS),
+                }
+            metrics['count'] += 1
+            metrics['errors'] += span_record['error'] is not None
+            metrics['seconds'] += span_record['seconds']
+            metrics['cpu_seconds'] += span_record['cpu_seconds']
+            for i, bound in enumerate(DURATION_BUCKETS):
+                if span_record['seconds'] <= bound:
+                    metrics['buckets'][i] += 1
+            if self._file is not None:
+                try:
+                    self._file.write(json.dumps({'service': self.service, **span_record}, default=str) + '\n')
+                    self._file.flush()
+                except (OSError, ValueError) as e:
+                    logger.error(f"Could not write span to {self.jsonl_path}: {e}")
+
+    def metrics(self):
+        """
+        Returns:
+        - dict: span name -> {'count', 'errors', 'seconds', 'cpu_seconds', 'buckets'} since the process started
+        """
+        with self._lock:
+            return {name: {**metrics, 'buckets': list(metrics['buckets'])} for name, metrics in self._metrics.items()}
+
+    def prometheus_text(self):
+        """
+        The metrics in the Prometheus text exposition format.
+        """
+        lines = [
+            '# HELP span_duration_seconds Wall time of instrumented spans.',
+            '# TYPE span_duration_seconds histogram',
+        ]
+        metrics = self.metrics()
+        for name, span_metrics in sorted(metrics.items()):
+            labels = f'service="{self.service}",span="{name}"'
+            for bound, count in zip(DURATION_BUCKETS, span_metrics['buckets']):
+                lines.append(f'span_duration_seconds_bucket{{{labels},le="{bound}"}} {count}')
+            lines.append(f'span_duration_seconds_bucket{{{labels},le="+Inf"}} {span_metrics["count"]}')
+            lines.append(f'span_duration_seconds_sum{{{labels}}} {span_metrics["seconds"]}')
+            lines.append(f'span_duration_seconds_count{{{labels}}} {span_metrics["count"]}')
+        for metric, key, help_text in (('span_cpu_seconds_total', 'cpu_seconds', 'CPU time of the thread running the span.'),
+                                       ('span_errors_total', 'errors', 'Spans that ended with an exception.')):
+            lines += [f'# HELP {metric} {help_text}', f'# TYPE {metric} counter']
+            lines += [f'{metric}{{service="{self.service}",span="{name}"}} {span_metrics[key]}'
+                      for name, span_metrics in sorted(metrics.items())]
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path):
+        """
+        Writes the metrics to a file for the node_exporter textfile collector (or a push to a
+        gateway), replacing it atomically so a scrape never sees a partial file.
+        """
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding="utf-8") as wfile:
+            wfile.write(self.prometheus_text())
+        os.replace(tmp_path, path)
+
+
+registry = SpanRegistry()
+
+
+def configure(service, jsonl_path=None):
+    registry.configure(service, jsonl_path)
+
+
+class SpanCollector:
+    """
+    Gathers the spans finished between start() and stop() in the current context, e.g. one
+    Streamlit rerun, including those of work wrapped with in_context().
+    """
+
+    def __init__(self):
+        self.spans = []
+        self.started = None
+        self.seconds = None
+
+    def start(self):
+        self.started = time.perf_counter()
+        _collector.set(self)
+        return self
+
+    def stop(self):
+        if _collector.get() is self:
+            _collector.set(None)
+        self.seconds = time.perf_counter() - self.started
+        return self.spans
+
+
+@contextmanager
+def span(name, **attributes):
+    """
+    Measures the body of the with block as a span named name.
+
+    Parameters:
+    - name: str: The span name, dotted by area, e.g. 's3.get' or 'analysis'
+    - attributes: Values recorded with the span; the yielded dict can be updated in the block
+
+    Yields:
+    - dict: The span's attributes
+    """
+    span_id = next(_span_ids)
+    parent_id = _parent.get()
+    token = _parent.set(span_id)
+    started_at = time.time()
+    rss_start = rss_bytes()
+    arrow_start = pa.total_allocated_bytes()
+    cpu_start = time.thread_time()
+    start = time.perf_counter()
+    error = None
+    try:
+        yield attributes
+    except Exception as e:
+        error = type(e).__name__
+        raise
+    finally:
+        seconds = time.perf_counter() - start
+        _parent.reset(token)
+        rss_end = rss_bytes()
+        span_record = {
+            'name': name,
+            'span_id': span_id,
+            'parent_id': parent_id,
+            'thread': threading.current_thread().name,
+            'started_at': started_at,
+            'seconds': seconds,
+            'cpu_seconds': time.thread_time() - cpu_start,
+            'rss_delta_bytes': rss_end - rss_start if rss_start is not None and rss_end is not None else None,
+            'arrow_delta_bytes': pa.total_allocated_bytes() - arrow_start,
+            'error': error,
+            'attributes': attributes,
+        }
+        registry.record(span_record)
+        collector = _collector.get()
+        if collector is not None:
+            collector.spans.append(span_record)
+
+
+def in_context(function):
+    """
+    Wraps a function so that, wherever it runs (e.g. on a thread pool), its spans have the current
+    span as parent and go to the current collector.
+    """
+    context = contextvars.copy_context()
+
+    def run(*args, **kwargs):
+        # A context can only be entered by one thread at a time, so every call runs in its own copy
+        return context.copy().run(function, *args, **kwargs)
+    return run
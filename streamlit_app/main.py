@@ -1,11 +1,24 @@
 from io import BytesIO
+import json
+import logging
 import streamlit as st
 import pandas as pd
-import matplotlib.pyplot as plt
 import pyarrow as pa 
 import boto3
-
-from s3_loader import load_data_from_s3
+import duckdb
+
+from dataset import DatasetRefresher, DatasetStore
+from instrumentation import SpanCollector, configure as configure_spans, registry as span_registry, span
+from s3_loader import PARTITION_DATE_COLUMNS, TABLES, recent_months_filter
+from query_cache import QueryCache, DEFAULT_MAX_ENTRIES
+from sql_engine import run_analysis, run_sql, DEFAULT_MAX_ROWS, DEFAULT_TIMEOUT_SECONDS
+from charts import top_n, render_bar_chart, DEFAULT_TOP_N
+from profiles import NullHandledView, NULL_METHODS, get_profile, prefetch_profile
+from table_pages import TablePager, PAGE_SIZES, DEFAULT_PAGE_SIZE, DEFAULT_MAX_PAGES
+from analysis import sales_by_staff_and_location, sales_by_product_design, sales_by_currency, required_columns, required_tables, ANALYSIS_KEYS
+from summaries import SUMMARY_TABLES, DAILY_SUFFIX, summary_table
+from star_schema import PRIMARY_KEY_COLUMNS
+from parquet_cache import ParquetCache, DEFAULT_CACHE_DIR, DEFAULT_MAX_BYTES
 from dotenv import load_dotenv
 import os
 
@@ -13,7 +26,11 @@ if os.path.exists('.env'):
     load_dotenv()
 
 def get_env_var(var_name, default=None):
-    return os.getenv(var_name) or st.secrets["aws"].get(var_name, default)
+    try:
+        return os.getenv(var_name) or st.secrets["aws"].get(var_name, default)
+    except FileNotFoundError:
+        # No secrets.toml: optional settings fall back to their defaults
+        return default
 # BUCKET_NAME = os.environ.get("DATA_BUCKET_NAME")
 
 AWS_ACCESS_KEY_ID = get_env_var('AWS_ACCESS_KEY_ID')
@@ -23,156 +40,348 @@ BUCKET_NAME = get_env_var('DATA_BUCKET_NAME')
 
 s3_folder = "db/parquet_files"
 
+PARQUET_CACHE_DIR = get_env_var('PARQUET_CACHE_DIR', DEFAULT_CACHE_DIR)
+PARQUET_CACHE_MAX_BYTES = int(get_env_var('PARQUET_CACHE_MAX_BYTES', DEFAULT_MAX_BYTES))
+QUERY_CACHE_MAX_ENTRIES = int(get_env_var('QUERY_CACHE_MAX_ENTRIES', DEFAULT_MAX_ENTRIES))
+PAGE_CACHE_MAX_ENTRIES = int(get_env_var('PAGE_CACHE_MAX_ENTRIES', DEFAULT_MAX_PAGES))
+# Only load this many recent months of sales; unset loads the full history
+SALES_HISTORY_MONTHS = get_env_var('SALES_HISTORY_MONTHS')
+# Load only the columns the analyses read; the table viewer loads whole tables when asked
+COLUMN_PROJECTION = str(get_env_var('COLUMN_PROJECTION', 'true')).lower() not in ('0', 'false', 'no')
+# 'numpy' converts tables to NumPy-backed DataFrames; 'pyarrow' keeps the decoded Arrow memory behind
+# ArrowDtype columns, skipping the conversion and its second copy of every table
+DATA_BACKEND = get_env_var('DATA_BACKEND', 'numpy')
+if DATA_BACKEND not in ('numpy', 'pyarrow'):
+    raise ValueError(f"DATA_BACKEND must be 'numpy' or 'pyarrow', not {DATA_BACKEND!r}")
+# Downcast integer keys and quantities, store repeated text as categoricals and decimals such as unit_price as floats
+COMPACT_TABLES = str(get_env_var('COMPACT_TABLES', 'false')).lower() in ('1', 'true', 'yes')
+# 'pandas' runs the analyses over the cached join indexes; 'duckdb' runs them as SQL
+QUERY_ENGINE = get_env_var('QUERY_ENGINE', 'pandas')
+if QUERY_ENGINE not in ('pandas', 'duckdb'):
+    raise ValueError(f"QUERY_ENGINE must be 'pandas' or 'duckdb', not {QUERY_ENGINE!r}")
+# 'matplotlib' renders charts to cached PNGs on the server; 'streamlit' sends the chart data to the
+# browser and draws it there with st.bar_chart
+CHART_RENDERER = get_env_var('CHART_RENDERER', 'matplotlib')
+if CHART_RENDERER not in ('matplotlib', 'streamlit'):
+    raise ValueError(f"CHART_RENDERER must be 'matplotlib' or 'streamlit', not {CHART_RENDERER!r}")
+CHART_CACHE_MAX_ENTRIES = int(get_env_var('CHART_CACHE_MAX_ENTRIES', DEFAULT_MAX_ENTRIES))
+# Limits of the free-form SQL box
+SQL_MAX_ROWS = int(get_env_var('SQL_MAX_ROWS', DEFAULT_MAX_ROWS))
+SQL_TIMEOUT_SECONDS = float(get_env_var('SQL_TIMEOUT_SECONDS', DEFAULT_TIMEOUT_SECONDS))
+# Log lines of the app's modules go to stderr at this level
+LOG_LEVEL = get_env_var('LOG_LEVEL', 'INFO')
+# Timing spans are appended to SPANS_JSONL_FILE as JSON lines ('-' for stdout), and their counters are written to
+# METRICS_FILE in the Prometheus text format after every rerun
+SPANS_JSONL_FILE = get_env_var('SPANS_JSONL_FILE')
+METRICS_FILE = get_env_var('METRICS_FILE')
+# Seconds between background checks of S3 for new data; 0 only checks when the reload button is pressed
+DATA_REFRESH_SECONDS = float(get_env_var('DATA_REFRESH_SECONDS', 300))
+# Show the performance panel at the bottom of every page; ?perf=1 in the URL shows it for one session
+PERFORMANCE_PANEL = str(get_env_var('PERFORMANCE_PANEL', 'false')).lower() in ('1', 'true', 'yes')
+
+# Without a handler on the root logger the modules' log lines are dropped; basicConfig does nothing once one exists
+logging.basicConfig(level=LOG_LEVEL, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+configure_spans('dashboard', SPANS_JSONL_FILE)
+# Collects the spans of this rerun for the performance panel
+rerun_spans = SpanCollector().start()
+
+
+@st.cache_resource
+def get_parquet_cache():
+    # One on-disk cache per server process, shared by every session
+    return ParquetCache(PARQUET_CACHE_DIR, PARQUET_CACHE_MAX_BYTES)
+
 # st.session_state.data = load_data_from_s3(BUCKET_NAME, s3_folder, AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY, AWS_DEFAULT_REGION)
 
+@st.cache_resource
+def get_query_cache():
+    # Aggregation results keyed by (query name, dataset version), shared by every session
+    return QueryCache(QUERY_CACHE_MAX_ENTRIES)
+
+
+@st.cache_resource
+def get_chart_cache():
+    # Rendered charts keyed by (query name, chart parameters, dataset version), shared by every session
+    return QueryCache(CHART_CACHE_MAX_ENTRIES)
+
+
+@st.cache_resource
+def get_table_pager():
+    # Pages of the table viewer keyed by (table, sort, filter, page, dataset version), shared by every session
+    return TablePager(PAGE_CACHE_MAX_ENTRIES)
+
+
+sql_queries = {
+    "Sales by staff and location": sales_by_staff_and_location,
+    "Sales by product design": sales_by_product_design,
+    "Sales by currency": sales_by_currency
+}
+
+
+def compute_analysis(dataset, query_name):
+    """
+    Runs one of the sql_queries on a dataset with the configured engine.
+
+    Parameters:
+    - dataset: Dataset: The dataset to analyse
+    - query_name: str: Key of sql_queries
+
+    Returns:
+    - pandas.DataFrame: The result
+    """
+    query = sql_queries[query_name]
+    # Up to date summary tables are read directly by the pandas analyses, whatever the engine
+    if QUERY_ENGINE == 'duckdb' and summary_table(dataset, ANALYSIS_KEYS[query.__name__][0]) is None:
+        engine, compute = 'duckdb', lambda: run_analysis(dataset, query.__name__)
+    else:
+        engine, compute = 'pandas', lambda: query(dataset)
+    with span('analysis', query=query.__name__, engine=engine) as attributes:
+        result = compute()
+        attributes['rows'] = len(result)
+        return result
+
+
+def get_analysis(query_cache, dataset, query_name):
+    # Computed once per query and dataset version, shared by every session
+    return query_cache.get_or_compute(query_name, dataset.version, lambda: compute_analysis(dataset, query_name))
+
+
+def sales_history_filters():
+    # Called by the store on every refresh, so the window moves forward while the server runs;
+    # with the partitioned fact table, older months are not even downloaded
+    months_filter = recent_months_filter(int(SALES_HISTORY_MONTHS), PARTITION_DATE_COLUMNS['fact_sales_order'])
+    # The daily summaries are filtered on the same created_date column as the fact table
+    return {'fact_sales_order': months_filter,
+            **{f"{summary}{DAILY_SUFFIX}": months_filter for summary in SUMMARY_TABLES.values()}}
+
+
+@st.cache_resource
+def get_dataset_store():
+    # One shared, read-only dataset per server process; sessions only keep a reference to it
+    filters = sales_history_filters if SALES_HISTORY_MONTHS else None
+    store = DatasetStore(BUCKET_NAME, s3_folder, AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY, AWS_DEFAULT_REGION,
+                         cache=get_parquet_cache(), filters=filters, backend=DATA_BACKEND, compact=COMPACT_TABLES,
+                         columns=required_columns() if COLUMN_PROJECTION else None)
+    store.subscribe(get_query_cache().on_dataset_swap)
+    store.subscribe(get_table_pager().on_dataset_swap)
+    store.subscribe(get_chart_cache().on_dataset_swap)
+
+    # The cache is captured here: the warmer runs on the refresher's thread, outside any script run
+    query_cache = get_query_cache()
+
+    def warm_analyses(dataset):
+        # Recompute the analyses sessions have looked at before the new version is swapped in
+        current = store.current
+        for query_name in query_cache.names(current.version) if current is not None else []:
+            if query_name in sql_queries:
+                get_analysis(query_cache, dataset, query_name)
+    store.add_warmer(warm_analyses)
+    return store
+
+
+@st.cache_resource
+def get_dataset_refresher():
+    # One poller per server process, however many sessions are open
+    return DatasetRefresher(get_dataset_store(), DATA_REFRESH_SECONDS).start()
+
+
+dataset_store = get_dataset_store()
+dataset_refresher = get_dataset_refresher()
+
 # Initialize session state for data storage
 if 'data' not in st.session_state:
-    st.session_state.data = load_data_from_s3(BUCKET_NAME, s3_folder, AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY, AWS_DEFAULT_REGION)
+    st.session_state.data = dataset_store.get()
     st.success("Data loaded from AWS S3")
 
-# Button to reload the latest data from S3
+# Button to check S3 for new data now; it is loaded in the background and picked up by a later rerun
 if st.button("Reload Data from AWS S3"):
-    st.session_state.data = load_data_from_s3(BUCKET_NAME, s3_folder, AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY, AWS_DEFAULT_REGION)
-    st.success("Data reloaded from S3")
+    dataset_refresher.request()
+    st.success("Checking S3 for new data in the background; it will be shown once it is loaded")
+
+# Pick up a newer dataset swapped in by the refresher
+if dataset_store.current is not None and st.session_state.data.version != dataset_store.current.version:
+    st.session_state.data = dataset_store.current
+st.caption(f"Data version {st.session_state.data.version}, loaded at {st.session_state.data.loaded_at:%Y-%m-%d %H:%M:%S}"
+           + (f"; the last check for new data failed: {dataset_refresher.last_error}" if dataset_refresher.last_error else ""))
 
 
 # Use data from session state
 data = st.session_state.data
 
+# Tables are loaded on first access. Start loading the tables of the selected analysis (the first
+# one in a new session) in the background while the rest of the page renders
+prefetch_query_name = st.session_state.get('selected_query') or next(iter(sql_queries))
+data.prefetch(required_tables(data, [sql_queries[prefetch_query_name].__name__]))
+
+
+def show_dataframe(df):
+    # Streamlit serializes the DataFrame to Arrow within the call, so the span covers it
+    with span('serialize.dataframe', rows=len(df), columns=len(df.columns)):
+        st.dataframe(df)
+
+
+def display_performance_panel(collector):
+    """
+    Shows where the time of this rerun went: every span recorded while the script ran, totalled by
+    span name, and the totals of the server process since it started.
+
+    Parameters:
+    - collector: SpanCollector: The stopped collector of the rerun
+    """
+    with st.expander("Performance", expanded=True):
+        st.caption(f"Rerun took {collector.seconds * 1000:.0f} ms; {len(collector.spans)} spans recorded")
+        if collector.spans:
+            spans_df = pd.DataFrame([{
+                'span': span_record['name'],
+                'ms': span_record['seconds'] * 1000,
+                'cpu_ms': span_record['cpu_seconds'] * 1000,
+                'rss_delta_mib': (span_record['rss_delta_bytes'] or 0) / 2**20,
+                'arrow_delta_mib': span_record['arrow_delta_bytes'] / 2**20,
+                'thread': span_record['thread'],
+                'error': span_record['error'],
+                'attributes': json.dumps(span_record['attributes'], default=str),
+            } for span_record in sorted(collector.spans, key=lambda span_record: span_record['started_at'])])
+            st.write("**This rerun, by span**")
+            st.dataframe(spans_df.groupby('span').agg(count=('ms', 'size'), total_ms=('ms', 'sum'), max_ms=('ms', 'max'))
+                         .sort_values('total_ms', ascending=False))
+            st.write("**This rerun, every span**")
+            st.dataframe(spans_df)
+
+        st.write("**Server process totals**")
+        totals = pd.DataFrame.from_dict(span_registry.metrics(), orient='index', columns=['count', 'errors', 'seconds', 'cpu_seconds'])
+        st.dataframe(totals.sort_values('seconds', ascending=False))
+        st.download_button("Download Prometheus metrics", span_registry.prometheus_text(), file_name="metrics.prom",
+                           mime="text/plain")
+
 
 # # Functions to interact with pre-loaded data
 def get_data_from_table(table_name, limit = 10):
-    return data[table_name].head(limit)
+    return data.full_table(table_name).head(limit)
 
-def handle_null_values(df, method):
+def handle_null_values(df, profile, method):
+    """
+    Applies a null handling method to a table as a NullHandledView: the shared table is not
+    copied or changed, only the rows displayed are cleaned.
+    """
+    df_cleaned = NullHandledView(df, profile, method)
     if method == 'Drop Rows':
-        df_cleaned = df.dropna()
         st.write("Rows with null value has dropped")
     elif method == 'Drop Columns':
-        df_cleaned == df.dropna(axis=1)
         st.write("Columns with null values have been dropped")
     elif method == 'Fill with 0':
-        df_cleaned = df.fillna(0)
         st.write("Null values have been filled with 0.")
     elif method == 'Fill with Mean':
-        for col in df.select_dtypes(include='number').columns:
-            df[col] = df[col].fillna(df[col].mean())
-        df_cleaned = df
         st.write("Null values have been filled with the column mean.")
     else:
-        df_cleaned = df
         st.write("No null handling applied.")
     
     return df_cleaned
 
 
-def check_null_values(df, selected_table_name):
+def check_null_values(df, profile, selected_table_name):
     st.subheader("Null Values Check")
-    null_counts = df.isnull().sum()  # Count null values in each column
-    st.write(null_counts)
+    # Null counts from the cached profile rather than a scan of the table on every click
+    st.write(profile.null_counts)
 
     # Check if there are any null values
-    if df.isnull().values.any():
+    if profile.has_nulls:
         st.warning(f"There are null values in {selected_table_name}")
-        null_handling_method = st.selectbox("How would you like to handle null values?", 
-                                        ['Drop Rows', 'Drop Columns', 'Fill with 0', 'Fill with Mean', 'Do Nothing'])
+        null_handling_method = st.selectbox("How would you like to handle null values?", NULL_METHODS)
         
-        df_cleaned = handle_null_values(df, null_handling_method)
+        df_cleaned = handle_null_values(df, profile, null_handling_method)
 
-        #display the cleaned DataFrame
+        #display the first page of the cleaned DataFrame, not the whole table
         st.subheader(f"Cleaned Data for {selected_table_name}")
-        st.dataframe(df_cleaned)
+        show_dataframe(df_cleaned.head(DEFAULT_PAGE_SIZE))
+        st.caption(f"First {min(DEFAULT_PAGE_SIZE, len(df_cleaned))} of {len(df_cleaned)} rows")
     else:
         st.success(f"There are no null values in {selected_table_name}")
 
-def sales_by_staff_and_location(data):
-    df_fso = data['fact_sales_order']
-    df_staff = data['dim_staff']
-    df_location = data['dim_location']
-
-    df = pd.merge(df_fso, df_staff, left_on='sales_staff_id', right_on='staff_id')
-    df = pd.merge(df, df_location, left_on='agreed_delivery_location_id', right_on='location_id')
-
-    # Renaming 'country' column to 'location_name' 
-    df.rename(columns={'country': 'location_name'}, inplace=True)
-
-    df['total_sales_amount'] = df['units_sold'] * df['unit_price']
-
-    df = df.groupby(['first_name', 'last_name', 'location_name']).agg(total_sales_amount=('total_sales_amount', 'sum')).reset_index()
-
-    df['staff_name'] = df['first_name'] + ' ' + df['last_name']
-
-    df['total_sales_amount'] = pd.to_numeric(df['total_sales_amount'], errors='coerce')
-
-    # Sort by 'total_sales_amount' in descending order, without the old index being added as a column
-    df = df.sort_values(by='total_sales_amount', ascending=False).reset_index(drop=True)
-
-    return df[['staff_name', 'location_name', 'total_sales_amount']]
-
-
-def sales_by_product_design(data):
-    df_fso = data['fact_sales_order']
-    df_design = data['dim_design']
-
-    df = pd.merge(df_fso, df_design, on='design_id')
-
-    df['total_sales_amount'] = df['units_sold'] * df['unit_price']
-
-    df = df.groupby('design_name').agg(total_sales_amount=('total_sales_amount', 'sum')).reset_index()
-
-    df['total_sales_amount'] = pd.to_numeric(df['total_sales_amount'], errors='coerce')
-
-    # Sort by 'total_sales_amount' in descending order, without the old index being added as a column
-    df = df.sort_values(by='total_sales_amount', ascending=False).reset_index(drop=True)
-
-    return df
-
-
-def sales_by_currency(data):
-    df_fso = data['fact_sales_order']
-    df_currency = data['dim_currency']
-
-    df = pd.merge(df_fso, df_currency, on='currency_id')
-
-    df['total_sales_amount'] = df['units_sold'] * df['unit_price']
-
-    df = df.groupby('currency_code').agg(total_sales_amount=('total_sales_amount', 'sum')).reset_index()
-
-    # Sort by 'total_sales_amount' in descending order, without the old index being added as a column
-    df = df.sort_values(by='total_sales_amount', ascending=False).reset_index(drop=True)
+def display_table_page(table_name, columns):
+    """
+    Shows one page of a table, sorted and filtered on the server, so only the visible rows are sent
+    to the browser.
 
-    return df
+    Parameters:
+    - table_name: str: The table to show
+    - columns: list: Its column names
+    """
+    sort_column, order_column, filter_column_col, filter_value_col = st.columns(4)
+    sort_by = sort_column.selectbox("Sort by", columns, index=None, placeholder="Table order", key=f"sort_by_{table_name}")
+    ascending = order_column.radio("Order", ["Ascending", "Descending"], horizontal=True,
+                                   key=f"order_{table_name}") == "Ascending"
+    filter_column = filter_column_col.selectbox("Filter column", columns, index=None, placeholder="No filter",
+                                                key=f"filter_column_{table_name}")
+    filter_value = filter_value_col.text_input("Filter value", key=f"filter_value_{table_name}",
+                                               help="Equal to the value for numeric columns, containing it otherwise")
+
+    page_size_column, page_column = st.columns(2)
+    page_size = page_size_column.selectbox("Rows per page", PAGE_SIZES, index=PAGE_SIZES.index(DEFAULT_PAGE_SIZE),
+                                           key=f"page_size_{table_name}")
+    _, total_rows = get_table_pager().page(data, table_name, 1, page_size, sort_by, ascending, filter_column, filter_value)
+    page_count = max(1, -(-total_rows // page_size))
+    page = page_column.number_input(f"Page (of {page_count})", min_value=1, max_value=page_count, value=1, step=1,
+                                    key=f"page_{table_name}")
+    page = min(int(page), page_count)
+
+    page_df, total_rows = get_table_pager().page(data, table_name, page, page_size, sort_by, ascending,
+                                                 filter_column, filter_value)
+    show_dataframe(page_df)
+    first_row = (page - 1) * page_size + 1 if total_rows else 0
+    st.caption(f"Rows {first_row}-{first_row + len(page_df) - 1 if total_rows else 0} of {total_rows}")
 
 
 # Function to display statistics for the DataFrame
-def describe_table(df):
+def describe_table(profile):
     st.subheader("Descriptive Statistics and Data Types")
     st.write("**Column data types**")
-    st.write(df.dtypes)  # this works in the app production, but there is error message "Serialization of dataframe to Arrow table was unsuccessful" 
+    st.write(profile.dtypes)
     st.write("**Descriptive Statistics**")
-    st.write(df.describe(include=['number']))
+    # From the cached profile; distinct counts of large tables are estimated from a sample
+    st.write(profile.numeric_summary())
 
 
 
-def plot_bar_chart(df, x_column, y_column, title, x_label, y_label):
+def plot_bar_chart(df, x_column, y_column, title, x_label, y_label, query_name=None, max_bars=DEFAULT_TOP_N):
     """
     Plots a bar chart from a DataFrame and displays it using Streamlit.
 
+    Only the max_bars largest bars (and series) are drawn, the rest are summed into an "Other" bar.
+    With the matplotlib renderer the chart is rendered once per query, dataset version and chart
+    parameters and then served from the chart cache; with the streamlit renderer only the
+    bucketed data is sent to the browser.
+
     Parameters:
     df (pandas.DataFrame): The DataFrame containing the data to plot.
     x_column (str): The column name for the x-axis.
-    y_column (str): The column name for the y-axis.
+    y_column (str or list): The column name(s) for the y-axis.
     title (str): The title of the chart.
     x_label (str): The label for the x-axis.
     y_label (str): The label for the y-axis.
+    query_name (str): The query the data comes from; charts without one are not cached.
+    max_bars (int): Maximum number of bars (and series) before the "Other" one.
     """
-    fig, ax = plt.subplots(figsize=(10, 6))
-    df.plot(kind='bar', x=x_column, y=y_column, ax=ax)
-    ax.set_xlabel(x_label)
-    ax.set_ylabel(y_label)
-    ax.set_title(title)
-    plt.xticks(rotation=45, ha='right')
-    st.pyplot(fig)
+    y_columns = [y_column] if isinstance(y_column, str) else list(y_column)
+
+    if CHART_RENDERER == 'streamlit':
+        chart_df, chart_columns = top_n(df, x_column, y_columns, max_bars)
+        with span('serialize.chart', bars=len(chart_df), series=len(chart_columns)):
+            st.bar_chart(chart_df, x=x_column, y=chart_columns, x_label=x_label, y_label=y_label)
+        return
+
+    def render():
+        with span('chart.render', title=title) as attributes:
+            chart_df, chart_columns = top_n(df, x_column, y_columns, max_bars)
+            png = render_bar_chart(chart_df, x_column, chart_columns, title, x_label, y_label)
+            attributes['bytes'] = len(png)
+            return png
+
+    if query_name is None:
+        png = render()
+    else:
+        chart_key = (query_name, x_column, tuple(y_columns), title, x_label, y_label, max_bars)
+        png = get_chart_cache().get_or_compute(chart_key, data.version, render)
+    st.image(png)
 
 
 # Function to display Statistical Summary for Total Sales
@@ -193,79 +402,68 @@ st.subheader("Data Warehouse Column Viewer")
 
 
 ############
-primary_key_columns = {
-    'fact_sales_order': 'sales_record_id',
-    'dim_staff': 'staff_id',
-    'dim_location': 'location_id',
-    'dim_design': 'design_id',
-    'dim_date': 'date_id',
-    'dim_currency': 'currency_id',
-    'dim_counterparty': 'counterparty_id'
-}
+primary_key_columns = PRIMARY_KEY_COLUMNS
 
 tables = list(primary_key_columns.keys())
 
-selected_table_name = st.selectbox("Select table name to filter by", tables)
+selected_table_name = st.selectbox("Select table name to filter by", tables, index=None, placeholder="Choose a table")
 
-data_table = data[selected_table_name]
+if selected_table_name:
+    # Every column of the table, loaded now if the dataset was loaded with a column projection
+    data_table = data.full_table(selected_table_name)
+    # Profile it in the background while the page renders, for the statistics and null checks below
+    prefetch_profile(data, selected_table_name)
 
+    st.subheader(f"Columns in {selected_table_name}")
 
+    # Extract column names
+    columns = data_table.columns
 
-st.subheader(f"Columns in {selected_table_name}")
+    # Highlight the primary key
+    primary_key = primary_key_columns[selected_table_name]
 
-# Extract column names
-columns = data_table.columns
-
-# Highlight the primary key
-primary_key = primary_key_columns[selected_table_name]
+    # Display each column with primary key highlighted
+    for column in columns:
+        if column == primary_key:
+            st.markdown(f"**{column}** (Primary Key)")
+        else:
+            st.markdown(column)
 
-# Display each column with primary key highlighted
-for column in columns:
-    if column == primary_key:
-        st.markdown(f"**{column}** (Primary Key)")
-    else:
-        st.markdown(column)
 
+    ############
+    st.subheader(f"Data from {selected_table_name}")
 
-############
-st.subheader(f"Data from {selected_table_name}")
+    display_table_page(selected_table_name, list(columns))
 
-st.dataframe(data_table)
 
+    ################
+    if st.button(f"Describe summary statistics for the table {selected_table_name}"):
+        describe_table(get_profile(data, selected_table_name))
 
-################
-if st.button(f"Describe summary statistics for the table {selected_table_name}"):
-    describe_table(data_table)
 
- 
-###########
-if st.button(f"Check for Null Values in {selected_table_name}"):
-    check_null_values(data_table, selected_table_name)
+    ###########
+    if st.button(f"Check for Null Values in {selected_table_name}"):
+        check_null_values(data_table, get_profile(data, selected_table_name), selected_table_name)
 
 
 
 
-sql_queries = {
-    "Sales by staff and location": sales_by_staff_and_location,
-    "Sales by product design": sales_by_product_design,
-    "Sales by currency": sales_by_currency
-}
-
 # Add a dropdown for users to select a query
 st.subheader("Select a Query for Sale Analysis")
-selected_query_name = st.selectbox("Choose a query", list(sql_queries.keys()))
+selected_query_name = st.selectbox("Choose a query", list(sql_queries.keys()), key='selected_query')
 
 if selected_query_name:
-    # Get the corresponding SQL query
-    selected_query = sql_queries[selected_query_name]
-    df = selected_query(data)
+    # Only recomputed when the dataset version changes, not on every widget interaction.
+    # The result is shared between sessions, so it is never modified below.
+    df = get_analysis(get_query_cache(), data, selected_query_name)
 
-    df['total_sales_amount'] = pd.to_numeric(df['total_sales_amount'], errors='coerce')
+    max_bars = st.slider("Bars per chart", min_value=5, max_value=50, value=DEFAULT_TOP_N, key='chart_max_bars',
+                         help='The smaller groups are added up into an "Other" bar')
 
      # Perform specific analysis for each query
     if selected_query_name == "Sales by staff and location":
         st.subheader("Total Sales by Staff and Location (Country)")
-        st.dataframe(df)
+        show_dataframe(df)
         
 
         if df['total_sales_amount'].isnull().all():
@@ -279,7 +477,9 @@ if selected_query_name:
                 y_column=sales_by_staff_location.columns,  # All columns are countries
                 title="Total Sales by Staff and Location",
                 x_label="Staff Member",
-                y_label="Total Sales Amount"
+                y_label="Total Sales Amount",
+                query_name=selected_query_name,
+                max_bars=max_bars
             )
 
             # Display statistical summary for the result
@@ -290,7 +490,7 @@ if selected_query_name:
 
     elif selected_query_name == "Sales by product design":
         st.subheader("Total Sales by Product Design")
-        st.dataframe(df)
+        show_dataframe(df)
 
 
         if df['total_sales_amount'].isnull().all():
@@ -302,7 +502,9 @@ if selected_query_name:
                 y_column='total_sales_amount',
                 title="Sales by Product Design",
                 x_label="Product Design",
-                y_label="Total Sales Amount"
+                y_label="Total Sales Amount",
+                query_name=selected_query_name,
+                max_bars=max_bars
             )
 
             st.subheader(f"Statistical Summary for Total Sales by Product Design")
@@ -310,7 +512,7 @@ if selected_query_name:
     
     elif selected_query_name == "Sales by currency":
         st.subheader("Total Sales by Currency")
-        st.dataframe(df)
+        show_dataframe(df)
 
 
         if df['total_sales_amount'].isnull().all():
@@ -322,7 +524,9 @@ if selected_query_name:
                 y_column='total_sales_amount',
                 title="Sales by Currency",
                 x_label="Currency",
-                y_label="Total Sales Amount"
+                y_label="Total Sales Amount",
+                query_name=selected_query_name,
+                max_bars=max_bars
             )
 
             st.subheader(f"Statistical Summary for Total Sales by Currency")
@@ -330,6 +534,35 @@ if selected_query_name:
 
 
 
+############
+st.subheader("Run a SQL Query")
+st.caption(f"DuckDB SQL over the tables above: {', '.join(primary_key_columns)}. "
+           f"At most {SQL_MAX_ROWS} rows are shown and queries are cancelled after {SQL_TIMEOUT_SECONDS:g} seconds.")
+sql_text = st.text_area("SQL", "SELECT * FROM dim_currency", key='sql_text')
+
+def run_sql_query(sql):
+    with span('sql.query') as attributes:
+        # Only the warehouse tables: the agg_* summaries are an internal shortcut of the analyses
+        sql_df, truncated = run_sql(data, sql, max_rows=SQL_MAX_ROWS, timeout=SQL_TIMEOUT_SECONDS, table_names=TABLES)
+        attributes.update(rows=len(sql_df), truncated=truncated)
+        return sql_df, truncated
+
+
+if st.button("Run SQL") and sql_text.strip():
+    try:
+        # Cached per query text and dataset version, like the analyses
+        sql_df, truncated = get_query_cache().get_or_compute(
+            ('sql', sql_text.strip(), SQL_MAX_ROWS), data.version,
+            lambda: run_sql_query(sql_text)
+        )
+    except (duckdb.Error, TimeoutError, ValueError) as e:
+        st.error(f"Query failed: {e}")
+    else:
+        show_dataframe(sql_df)
+        if truncated:
+            st.warning(f"Only the first {SQL_MAX_ROWS} rows are shown")
+
+
 ############
 st.subheader("Streamlit Dashboard Website Link")
 
@@ -374,3 +607,11 @@ if option == 'Yes':
 else:
     st.write("Select 'Yes' to load the Tableau dashboard.")
 
+
+############
+rerun_spans.stop()
+if METRICS_FILE:
+    span_registry.write_prometheus(METRICS_FILE)
+
+if PERFORMANCE_PANEL or st.query_params.get('perf') == '1':
+    display_performance_panel(rerun_spans)
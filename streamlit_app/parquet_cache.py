@@ -0,0 +1,142 @@
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+
+logger = logging.getLogger('parquet_cache')
+logger.setLevel(logging.INFO)
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "totesys_dashboard", "parquet")
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+
+# Versions (ETags) kept per key: the new one and the previous one, which the Dataset still being
+# served until the refresh swaps in the new version may read (full_table, a prefetch)
+DEFAULT_VERSIONS_PER_KEY = 2
+
+
+class ParquetCache:
+    """
+    On-disk cache of parquet objects downloaded from S3, keyed by S3 key and ETag.
+
+    Each entry is a single file named '<hash of key>-<hash of etag>.parquet', so a new upload of
+    the same key (new ETag) never matches a stale file. The file modification time records the last
+    use, and the least recently used files are evicted once the directory grows past max_bytes.
+    Storing a new version of a key keeps the most recently used older versions, up to
+    versions_per_key in all, and drops the rest.
+    Files are written to a temporary name and renamed into place, so concurrent readers never see
+    a partial file.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES, versions_per_key=DEFAULT_VERSIONS_PER_KEY):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.versions_per_key = versions_per_key
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def _digest(value):
+        return hashlib.sha256(value.encode("utf-8")).hexdigest()[:32]
+
+    def path_for(self, key, etag):
+        """
+        Returns the file path an object with this key and ETag is cached under.
+        """
+        return os.path.join(self.cache_dir, f"{self._digest(key)}-{self._digest(etag)}.parquet")
+
+    def get(self, key, etag):
+        """
+        Returns the cached file path for key/etag, or None on a miss. A hit marks the entry as recently used.
+        """
+        path = self.path_for(key, etag)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def put(self, key, etag, body):
+        """
+        Stores the bytes of an S3 object, drops the older versions of the same key beyond
+        versions_per_key and evicts least recently used entries above the size cap.
+
+        Parameters:
+        - key: str: The S3 key of the object
+        - etag: str: The ETag of the object
+        - body: bytes: The object content
+
+        Returns:
+        - str: The path of the cached file
+        """
+        path = self.path_for(key, etag)
+        key_prefix = f"{self._digest(key)}-"
+
+        with self._lock:
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+            with os.fdopen(fd, "wb") as wfile:
+                wfile.write(body)
+            os.replace(tmp_path, path)
+
+            older = []
+            for file_name in os.listdir(self.cache_dir):
+                older_path = os.path.join(self.cache_dir, file_name)
+                if file_name.startswith(key_prefix) and file_name.endswith(".parquet") and older_path != path:
+                    try:
+                        older.append((os.stat(older_path).st_mtime, older_path))
+                    except FileNotFoundError:
+                        continue
+            # The most recently used older versions are kept
+            for _, older_path in sorted(older, reverse=True)[max(self.versions_per_key - 1, 0):]:
+                self._remove(older_path)
+
+            self._evict(keep=path)
+
+        return path
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def _evict(self, keep=None):
+        entries = []
+        for file_name in os.listdir(self.cache_dir):
+            if not file_name.endswith(".parquet"):
+                continue
+            path = os.path.join(self.cache_dir, file_name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            self._remove(path)
+            total -= size
+            logger.info(f"Evicted {path} from the parquet cache")
+
+    def size(self):
+        """
+        Returns the total size in bytes of the cached files.
+        """
+        return sum(
+            os.path.getsize(os.path.join(self.cache_dir, file_name))
+            for file_name in os.listdir(self.cache_dir)
+            if file_name.endswith(".parquet")
+        )
+
+    def clear(self):
+        """
+        Removes every cached file.
+        """
+        with self._lock:
+            for file_name in os.listdir(self.cache_dir):
+                self._remove(os.path.join(self.cache_dir, file_name))
+        logger.info(f"Cleared parquet cache at {self.cache_dir}")
@@ -0,0 +1,245 @@
+import logging
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+logger = logging.getLogger('profiles')
+logger.setLevel(logging.INFO)
+
+# Columns with more rows than this get a distinct count estimated from a sample of this many rows
+DISTINCT_SAMPLE_ROWS = 100_000
+
+# Quartiles shown next to the other statistics, as in DataFrame.describe()
+QUANTILES = (0.25, 0.5, 0.75)
+QUANTILE_NAMES = ['25%', '50%', '75%']
+
+# The statistics of a column, in the order the profile lists them
+STATISTICS = ['dtype', 'nulls', 'min', 'max', 'mean', 'std', *QUANTILE_NAMES, 'distinct']
+
+# Rows scanned at a time when looking for the first rows without nulls
+SCAN_CHUNK_ROWS = 64 * 1024
+
+NULL_METHODS = ['Drop Rows', 'Drop Columns', 'Fill with 0', 'Fill with Mean', 'Do Nothing']
+
+
+def estimate_distinct(values, rows):
+    """
+    Estimates the number of distinct values of a column from a random sample of it, with the GEE
+    estimator: values seen once in the sample are scaled up by sqrt(rows / sample size), values
+    seen more often are counted once.
+
+    Parameters:
+    - values: pyarrow.Array: The sample
+    - rows: int: Number of rows of the whole column
+
+    Returns:
+    - int: The estimate
+    """
+    counts = pc.value_counts(values).field('counts').to_numpy()
+    seen_once = int((counts == 1).sum())
+    if seen_once == len(values):
+        # No value repeats in the sample: the column looks unique, which GEE badly underestimates
+        return rows
+    return int(round(np.sqrt(rows / max(len(values), 1)) * seen_once + (len(counts) - seen_once)))
+
+
+def to_arrow(series):
+    """
+    The column as an Arrow array with missing values as nulls; ArrowDtype columns are not copied.
+    """
+    if isinstance(series.dtype, pd.ArrowDtype):
+        return pa.chunked_array(series.array._pa_array).combine_chunks()
+    return pa.array(series, from_pandas=True)
+
+
+def profile_column(series, rng):
+    """
+    Computes the statistics of one column, each with a single vectorised Arrow kernel.
+    """
+    rows = len(series)
+    stats = {**dict.fromkeys(STATISTICS), 'dtype': str(series.dtype)}
+    try:
+        values = to_arrow(series)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+        # Mixed Python objects: only what pandas can count
+        stats['nulls'] = int(series.isna().sum())
+        return stats
+
+    stats['nulls'] = values.null_count
+    value_type = values.type.value_type if pa.types.is_dictionary(values.type) else values.type
+    numeric = (pa.types.is_integer(value_type) or pa.types.is_floating(value_type) or pa.types.is_decimal(value_type)) \
+        and not pa.types.is_dictionary(values.type)
+    if rows > stats['nulls'] and (numeric or pa.types.is_temporal(value_type)):
+        min_max = pc.min_max(values)
+        stats['min'], stats['max'] = min_max['min'].as_py(), min_max['max'].as_py()
+    if rows > stats['nulls'] and numeric:
+        as_float = pc.cast(values, pa.float64())
+        stats['mean'] = pc.mean(as_float).as_py()
+        stats['std'] = pc.stddev(as_float, ddof=1).as_py()
+        # Interpolated as pandas does; Arrow's exact quantile is faster than its t-digest estimate here
+        stats.update(zip(QUANTILE_NAMES, pc.quantile(as_float, q=list(QUANTILES)).to_pylist()))
+
+    if pa.types.is_null(value_type):
+        # No values at all (an empty table, or a column of only None), which the kernels do not take
+        stats['distinct'] = 0
+    elif pa.types.is_dictionary(values.type):
+        # The distinct values of a dictionary column are the dictionary entries it uses
+        stats['distinct'] = len(pc.unique(values.indices.drop_null()))
+    elif rows <= DISTINCT_SAMPLE_ROWS:
+        stats['distinct'] = pc.count_distinct(values).as_py()
+    else:
+        sample = values.take(pa.array(rng.choice(rows, DISTINCT_SAMPLE_ROWS, replace=False)))
+        stats['distinct'] = min(estimate_distinct(sample.drop_null(), rows - stats['nulls']), rows - stats['nulls'])
+    return stats
+
+
+class TableProfile:
+    """
+    Per-column statistics of a table: dtype, null count, min, max, mean, standard deviation,
+    quartiles and (estimated) number of distinct values, computed once per table and
+    dataset version.
+
+    Tables are read-only, so a profile stays valid for as long as its Dataset is in use.
+    """
+
+    def __init__(self, df, seed=0):
+        """
+        Parameters:
+        - df: pandas.DataFrame: The table to profile
+        - seed: int: Seed of the samples the distinct counts of large columns are estimated from
+        """
+        rng = np.random.default_rng(seed)
+        self.rows = len(df)
+        self.columns = pd.DataFrame.from_dict(
+            {column: profile_column(df[column], rng) for column in df.columns}, orient='index', columns=STATISTICS
+        )
+        logger.info(f"Profiled {self.rows} rows x {len(self.columns)} columns")
+
+    @property
+    def dtypes(self):
+        return self.columns['dtype']
+
+    @property
+    def null_counts(self):
+        return self.columns['nulls'].astype('int64')
+
+    @property
+    def null_columns(self):
+        """
+        Names of the columns with at least one null.
+        """
+        return list(self.columns.index[self.columns['nulls'] > 0])
+
+    @property
+    def has_nulls(self):
+        return bool(self.null_columns)
+
+    def numeric_summary(self):
+        """
+        describe()-style statistics of the numeric columns: count, mean, std, min, 25%, 50%, 75%,
+        max, distinct.
+        """
+        numeric = self.columns[self.columns['mean'].notna()]
+        return pd.DataFrame({
+            'count': self.rows - numeric['nulls'],
+            'mean': numeric['mean'],
+            'std': numeric['std'],
+            'min': numeric['min'],
+            **{name: numeric[name] for name in QUANTILE_NAMES},
+            'max': numeric['max'],
+            'distinct': numeric['distinct'],
+        }).astype('float64').T
+
+
+def build_profile(table_name):
+    return lambda dataset: TableProfile(dataset.full_table(table_name))
+
+
+def get_profile(data, table_name):
+    """
+    Returns the profile of a table with all of its columns, computed once per Dataset version and
+    shared by every session, or computed on the spot for a plain dict.
+    """
+    if hasattr(data, 'derived'):
+        return data.derived(f"profile:{table_name}", build_profile(table_name))
+    return TableProfile(data[table_name])
+
+
+def prefetch_profile(data, table_name):
+    """
+    Starts profiling a table in the background (see Dataset.prefetch_derived); does nothing for a
+    plain dict.
+    """
+    if hasattr(data, 'prefetch_derived'):
+        data.prefetch_derived(f"profile:{table_name}", build_profile(table_name))
+
+
+class NullHandledView:
+    """
+    A table with one of the NULL_METHODS applied, without copying it.
+
+    The shared table is never modified. Only the rows asked for through head() are cleaned; the
+    profile tells which columns have nulls, so the columns without any are passed through as they
+    are and the means come from the profile instead of another pass over the table.
+    """
+
+    def __init__(self, df, profile, method):
+        """
+        Parameters:
+        - df: pandas.DataFrame: The shared table
+        - profile: TableProfile: Its profile
+        - method: str: One of NULL_METHODS
+        """
+        if method not in NULL_METHODS:
+            raise ValueError(f"Unknown null handling method {method!r}")
+        self.df = df
+        self.profile = profile
+        self.method = method
+        self._rows = None
+
+    @property
+    def columns(self):
+        if self.method == 'Drop Columns':
+            return [column for column in self.df.columns if column not in self.profile.null_columns]
+        return list(self.df.columns)
+
+    def __len__(self):
+        if self._rows is None:
+            if self.method == 'Drop Rows' and self.profile.has_nulls:
+                self._rows = int((~self.df[self.profile.null_columns].isna().any(axis=1)).sum())
+            else:
+                self._rows = self.profile.rows
+        return self._rows
+
+    def _fill(self, df):
+        null_columns = [column for column in self.profile.null_columns if column in df.columns]
+        if self.method == 'Fill with 0':
+            # Text columns are stored as categoricals or Arrow strings, which only accept existing categories or strings
+            text_columns = [column for column in null_columns
+                            if isinstance(df[column].dtype, (pd.CategoricalDtype, pd.ArrowDtype))
+                            and not pd.api.types.is_numeric_dtype(df[column].dtype)]
+            return df.astype({column: object for column in text_columns}).fillna({column: 0 for column in null_columns})
+        means = self.profile.columns.loc[null_columns, 'mean'].dropna()
+        return df.fillna(means.to_dict())
+
+    def head(self, n):
+        """
+        Returns the first n rows after null handling.
+        """
+        if self.method == 'Drop Columns':
+            return self.df[self.columns].head(n)
+        if self.method in ('Fill with 0', 'Fill with Mean'):
+            return self._fill(self.df.head(n))
+        if self.method == 'Drop Rows' and self.profile.has_nulls:
+            # Scan chunk by chunk, and only the columns with nulls, until n complete rows are found
+            positions = []
+            subset = self.df[self.profile.null_columns]
+            for start in range(0, len(self.df), SCAN_CHUNK_ROWS):
+                chunk = subset.iloc[start:start + SCAN_CHUNK_ROWS]
+                positions.extend(start + np.flatnonzero(~chunk.isna().any(axis=1).to_numpy()))
+                if len(positions) >= n:
+                    break
+            return self.df.take(positions[:n])
+        return self.df.head(n)
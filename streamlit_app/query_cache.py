@@ -0,0 +1,93 @@
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger('query_cache')
+logger.setLevel(logging.INFO)
+
+DEFAULT_MAX_ENTRIES = 32
+
+
+class QueryCache:
+    """
+    Bounded, thread-safe LRU cache of query results keyed by (query name, dataset version).
+
+    A dataset version only changes when the loader picks up new parquet files, so a cached result
+    stays valid until then; on_dataset_swap drops the results of every other version. Results are
+    shared between sessions and must be treated as read-only.
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_compute(self, query_name, version, compute):
+        """
+        Returns the cached result for (query_name, version), calling compute() on a miss.
+
+        Concurrent misses for the same key wait for a single computation instead of repeating it.
+
+        Parameters:
+        - query_name: str: Name of the query
+        - version: str: Version of the dataset the query runs on
+        - compute: callable: Zero-argument function producing the result
+
+        Returns:
+        - The cached or freshly computed result
+        """
+        key = (query_name, version)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        with key_lock:
+            with self._lock:
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return self._entries[key]
+
+            try:
+                result = compute()
+                with self._lock:
+                    self.misses += 1
+                    self._entries[key] = result
+                    self._entries.move_to_end(key)
+                    while len(self._entries) > self.max_entries:
+                        self._entries.popitem(last=False)
+            finally:
+                # Also when compute() fails, so failing keys (e.g. bad SQL) do not pile up locks
+                with self._lock:
+                    self._key_locks.pop(key, None)
+
+        logger.info(f"Computed {query_name} for dataset {version}")
+        return result
+
+    def on_dataset_swap(self, dataset):
+        """
+        Drops cached results that belong to any version other than the new dataset's.
+        """
+        with self._lock:
+            for key in [key for key in self._entries if key[1] != dataset.version]:
+                del self._entries[key]
+
+    def names(self, version):
+        """
+        Names of the queries with a cached result for a dataset version.
+        """
+        with self._lock:
+            return [key[0] for key in self._entries if key[1] == version]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
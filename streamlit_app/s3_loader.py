@@ -1,13 +1,25 @@
 import streamlit as st
 import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError
 import pandas as pd
-from io import BytesIO
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.fs as pa_fs
+import pyarrow.parquet as pq
+import io
 import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
-from datetime import datetime
+from datetime import date, datetime
 
 import os
 import json
+import hashlib
+
+from instrumentation import span, in_context
+from compaction import compact_table
 
 logger = logging.getLogger('s3_loader')
 logger.setLevel(logging.INFO)
@@ -16,52 +28,737 @@ load_dotenv()
 
 BUCKET_NAME = os.environ.get("DATA_BUCKET_NAME")
 
-def load_data_from_s3(bucket_name, s3_folder="", aws_access_key_id=None,    aws_secret_access_key=None, region_name=None):
+TABLES = ['fact_sales_order', 'dim_staff', 'dim_location', 'dim_design', 'dim_date', 'dim_currency', 'dim_counterparty']
+
+# Pre-aggregated sales summaries written by transfer_data.py, loaded when the manifest lists them
+SUMMARY_TABLES = [
+    'agg_sales_by_staff_location', 'agg_sales_by_staff_location_daily',
+    'agg_sales_by_design', 'agg_sales_by_design_daily',
+    'agg_sales_by_currency', 'agg_sales_by_currency_daily',
+]
+
+# Written by upload_to_s3.py next to the daily folders, naming the latest object of every table
+MANIFEST_NAME = 'latest.json'
+
+# Upper bound on concurrent table downloads; the S3 connection pool is sized to match
+DEFAULT_MAX_WORKERS = 8
+
+# Tables that can be stored as hive-partitioned parquet (<table>/year=YYYY/month=M/part-0.parquet),
+# by the date column their partitions are derived from. Filters on that column skip whole partitions
+PARTITION_DATE_COLUMNS = {'fact_sales_order': 'created_date'}
+
+PARTITION_SCHEMA = pa.schema([('year', pa.int16()), ('month', pa.int8())])
+
+# Partition value of rows whose date is null
+HIVE_NULL_PARTITION = '__HIVE_DEFAULT_PARTITION__'
+
+# What tables are returned as: 'numpy' for NumPy-backed pandas DataFrames, 'pyarrow' for pandas
+# DataFrames with ArrowDtype columns sharing the Arrow memory, 'arrow' for pyarrow Tables
+BACKENDS = ('numpy', 'pyarrow', 'arrow')
+DEFAULT_BACKEND = 'numpy'
+
+# Size of the chunks a download is streamed in
+DOWNLOAD_CHUNK_BYTES = 1024 * 1024
+
+# Objects smaller than this are downloaded whole even when only some columns are read: pyarrow's
+# first footer read alone covers most of a small file, and a whole download can be cached
+RANGED_READ_MIN_BYTES = 8 * 1024 * 1024
 
+# With a cache, objects up to this fraction of its size are downloaded whole and cached even when only
+# some columns are read: every later process and refresh then reads them from disk instead of S3.
+# Larger objects would evict most of the cache, so they are still read with ranged GETs
+CACHED_OBJECT_MAX_FRACTION = 0.5
+
+
+def get_s3_client(aws_access_key_id=None, aws_secret_access_key=None, region_name=None, max_workers=DEFAULT_MAX_WORKERS):
     """
-    Loads the most recent parquet files from an S3 bucket
+    Creates an S3 client whose connection pool can serve max_workers concurrent requests.
+
+    boto3 clients are thread safe, so a single client is shared by all download threads.
+    """
+    return boto3.client(
+            's3',
+            aws_access_key_id=aws_access_key_id,
+            aws_secret_access_key=aws_secret_access_key,
+            region_name=region_name,
+            config=Config(max_pool_connections=max(max_workers, 10))
+    )
+
+
+def table_name_from_key(key, tables=TABLES):
+    """
+    Returns the table a parquet key belongs to, or None if it is not one of the tables.
+
+    Matches on the file name (e.g. '2024/10/18/dim_staff.parquet') rather than a substring of
+    the whole key, so a table name that is part of a folder name is never picked up by mistake.
+    """
+    file_name = key.rsplit('/', 1)[-1]
+    for table in tables:
+        if file_name == f"{table}.parquet":
+            return table
+    return None
+
+
+def partition_path_from_key(key, tables=TABLES):
+    """
+    Splits a key inside a partitioned table directory into its table and partition path, e.g.
+    '2024/10/18/fact_sales_order/year=2024/month=3/part-0.parquet' ->
+    ('fact_sales_order', 'year=2024/month=3/part-0.parquet').
+
+    Returns:
+    - tuple: (table, partition path), or None if the key is not a partition of one of the tables
+    """
+    parts = key.split('/')
+    if not parts[-1].endswith('.parquet'):
+        return None
+    for i, part in enumerate(parts[:-1]):
+        partition_parts = parts[i + 1:-1]
+        if part in tables and partition_parts and all('=' in partition_part for partition_part in partition_parts):
+            return part, '/'.join(parts[i + 1:])
+    return None
+
+
+def partitioned_object(partitions):
+    """
+    Describes a partitioned table the way a single object is described, so the rest of the loader
+    can treat both alike.
+
+    The 'Key' is the table directory of the newest upload and the 'ETag' a digest of every
+    partition's key and ETag, so it changes whenever any partition does.
 
     Parameters:
+    - partitions: dict: partition path -> {'Key', 'ETag', 'Size', ...}
+
+    Returns:
+    - dict: {'Key', 'ETag', 'Size', 'Partitions'}, where 'Partitions' lists the partitions sorted by
+      path with their 'Path' added
+    """
+    partitions = [{**partitions[path], 'Path': path} for path in sorted(partitions)]
+    digest = hashlib.sha1()
+    for partition in partitions:
+        digest.update(f"{partition['Path']}:{partition['Key']}:{partition['ETag']}\n".encode("utf-8"))
+    newest = max(partitions, key=lambda partition: partition['Key'])
+    return {
+        'Key': newest['Key'][:-len(newest['Path'])],
+        'ETag': digest.hexdigest(),
+        'Size': sum(partition.get('Size') or 0 for partition in partitions),
+        'Partitions': partitions,
+    }
+
+
+def list_latest_objects(s3_client, bucket_name, s3_folder="", tables=TABLES):
+    """
+    Pages through every object under s3_folder and picks the most recent parquet file per table
+
+    For a partitioned table, the most recent object of every partition path is picked instead;
+    unchanged partitions may still live in an older daily folder. A table that has been uploaded in
+    both layouts uses whichever was uploaded last.
+
+    Parameters:
+    - s3_client: boto3 S3 client
     - bucket_name: str: The name of S3 bucket to read from.
     - s3_folder: str: The S3 folder where the files are stored
+    - tables: list: Table names to look for
 
     Returns:
-    - dict: A dictionary where keys are table names and values are pandas DataFrames
+    - dict: table name -> {'Key', 'ETag', 'Size'} of the latest object for that table
+    """
+    prefix = f"{s3_folder}/" if s3_folder else ""
+    paginator = s3_client.get_paginator('list_objects_v2')
+
+    latest = {}
+    partitions = {}
+    with span('s3.list', prefix=prefix) as attributes:
+        attributes['pages'] = attributes['objects'] = 0
+        for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix):
+            attributes['pages'] += 1
+            attributes['objects'] += len(page.get('Contents', []))
+            for obj in page.get('Contents', []):
+                s3_object = {'Key': obj['Key'], 'ETag': obj['ETag'].strip('"'), 'Size': obj['Size']}
+                table = table_name_from_key(obj['Key'], tables)
+                # Keys are laid out as YYYY/MM/DD, so the lexically greatest key is the newest
+                if table is not None:
+                    if table not in latest or obj['Key'] > latest[table]['Key']:
+                        latest[table] = s3_object
+                    continue
+                partition = partition_path_from_key(obj['Key'], tables)
+                if partition is not None:
+                    table, path = partition
+                    table_partitions = partitions.setdefault(table, {})
+                    if path not in table_partitions or obj['Key'] > table_partitions[path]['Key']:
+                        table_partitions[path] = s3_object
+
+    for table, table_partitions in partitions.items():
+        s3_object = partitioned_object(table_partitions)
+        # Compare the daily folders: '<folder>/fact_sales_order/' against '<folder>/fact_sales_order.parquet'
+        if table not in latest or s3_object['Key'][:-len(table) - 1] >= latest[table]['Key'].rsplit('/', 1)[0] + '/':
+            latest[table] = s3_object
+
+    return {table: latest[table] for table in tables if table in latest}
+
+
+def read_manifest(s3_client, bucket_name, s3_folder="", tables=TABLES, optional_tables=SUMMARY_TABLES):
     """
+    Reads the latest.json manifest written by the uploader, which names each table's latest object
 
-    s3_client = boto3.client(
-            's3',
-            aws_access_key_id=aws_access_key_id,
-            aws_secret_access_key=aws_secret_access_key,
-            region_name=region_name
-    )
+    Parameters:
+    - s3_client: boto3 S3 client
+    - bucket_name: str: The name of S3 bucket to read from.
+    - s3_folder: str: The S3 folder where the files are stored
+    - tables: list: Table names to look for
+    - optional_tables: list: Table names included when the manifest has them
+
+    Returns:
+    - dict: table name -> {'Key', 'ETag', 'Size', 'Rows', 'SchemaHash', 'Sha256'} in the same form as
+      list_latest_objects (plus 'Partitions' for partitioned tables, and the 'Source' a summary was
+      computed from), or None if there is no manifest or it does not cover every table
+    """
+    key = f"{s3_folder}/{MANIFEST_NAME}" if s3_folder else MANIFEST_NAME
+    with span('s3.get_manifest', key=key) as attributes:
+        try:
+            response = s3_client.get_object(Bucket=bucket_name, Key=key)
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+                attributes['found'] = False
+                return None
+            raise
+        body = response['Body'].read()
+        attributes.update(found=True, bytes=len(body))
+
+    entries = json.loads(body).get('tables', {})
+    missing = [table for table in tables if table not in entries]
+    if missing:
+        logger.info(f"Manifest {key} has no entry for {', '.join(missing)}")
+        return None
+
+    latest_objects = {}
+    for table in [*tables, *(table for table in optional_tables or [] if table in entries)]:
+        entry = entries[table]
+        if 'partitions' in entry:
+            s3_object = partitioned_object({
+                partition['path']: {'Key': partition['key'], 'ETag': partition['etag'], 'Size': partition.get('size'),
+                                    'Rows': partition.get('rows'), 'Sha256': partition.get('sha256')}
+                for partition in entry['partitions']
+            })
+        else:
+            s3_object = {'Key': entry['key'], 'ETag': entry['etag'], 'Size': entry.get('size'), 'Sha256': entry.get('sha256')}
+        latest_objects[table] = {**s3_object, 'Rows': entry.get('rows'), 'SchemaHash': entry.get('schema_hash')}
+        if 'source' in entry:
+            latest_objects[table]['Source'] = entry['source']
+    return latest_objects
+
+
+def get_manifest_etag(s3_client, bucket_name, s3_folder=""):
+    """
+    Returns the ETag of the latest.json manifest with a single HEAD request, so a poller can tell
+    whether anything was uploaded without reading the manifest or listing the folder.
+
+    Returns:
+    - str: The ETag, or None if there is no manifest
+    """
+    key = f"{s3_folder}/{MANIFEST_NAME}" if s3_folder else MANIFEST_NAME
+    with span('s3.head_manifest', key=key) as attributes:
+        try:
+            response = s3_client.head_object(Bucket=bucket_name, Key=key)
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+                attributes['found'] = False
+                return None
+            raise
+        attributes['found'] = True
+        return response['ETag']
+
+
+def source_fingerprint(s3_object):
+    """
+    Fingerprints a table from the SHA-256 of its file, or of each of its partitions, as recorded in
+    the manifest. It is the fingerprint transfer_data.py stores in the summaries it computes from
+    the table, so equal fingerprints mean a summary is up to date.
 
-    data = {}
+    Returns:
+    - str: The hex digest, or None when a SHA-256 is unknown (e.g. the objects come from a listing)
+    """
+    files = [(partition['Path'], partition.get('Sha256')) for partition in s3_object['Partitions']] \
+        if 'Partitions' in s3_object else [('', s3_object.get('Sha256'))]
+    if any(sha256 is None for _, sha256 in files):
+        return None
+    digest = hashlib.sha256()
+    for path, sha256 in sorted(files):
+        digest.update(f"{path}:{sha256}\n".encode("utf-8"))
+    return digest.hexdigest()
 
-    tables = ['fact_sales_order', 'dim_staff', 'dim_location', 'dim_design', 'dim_date', 'dim_currency', 'dim_counterparty']
 
-    prefix = f"{s3_folder}/"            
-    response = s3_client.list_objects_v2(Bucket=bucket_name, Prefix=prefix)
+def get_latest_objects(s3_client, bucket_name, s3_folder="", tables=TABLES):
+    """
+    Returns the latest object of each table from the manifest (a single GET), falling back to
+    listing the whole folder when there is no usable manifest.
+    """
+    latest_objects = read_manifest(s3_client, bucket_name, s3_folder, tables)
+    if latest_objects is None:
+        logger.info(f"No usable manifest in {s3_folder}, listing the folder")
+        latest_objects = list_latest_objects(s3_client, bucket_name, s3_folder, tables)
+    return latest_objects
 
-    if not response["Contents"]:
-        logger.error(f"No files found in the S3 folder: {s3_folder}")
-    else:
-        all_keys = [obj['Key'] for obj in response['Contents']]
 
-        for table in tables:
-            matching_files = [key for key in all_keys if table in key]
+def recent_months_filter(months, date_column, today=None):
+    """
+    Builds a filter keeping the rows of the last `months` calendar months, the current one included.
+
+    Parameters:
+    - months: int: Number of months to keep
+    - date_column: str: The date column to filter on
+    - today: date: Optional reference date, today by default
+
+    Returns:
+    - list: The filter in pyarrow's list-of-tuples form, e.g. [[('created_date', '>=', date(2024, 8, 1))]]
+    """
+    today = today or date.today()
+    year, month = divmod(today.year * 12 + today.month - 1 - (months - 1), 12)
+    return [[(date_column, '>=', date(year, month + 1, 1))]]
+
+
+def to_expression(filters):
+    """
+    Converts filters in pyarrow's list-of-tuples form to a dataset expression; expressions are returned as is.
+    """
+    if filters is None or isinstance(filters, ds.Expression):
+        return filters
+    return pq.filters_to_expression(filters)
 
-            if not matching_files:
-                logger.error(f"No files found for table: {table}")
-                continue
 
-            latest_file_key = sorted(matching_files)[-1]
-            logger.info(f"Latest file for table {table}: {latest_file_key}")
+def partition_expression(path, date_column=None):
+    """
+    Returns the expression every row of a partition satisfies, e.g. year == 2024 and month == 3 for
+    'year=2024/month=3/part-0.parquet'.
+
+    With a date_column, the expression also states the range of dates the partition covers, so a
+    filter on the date column (not just on year and month) can rule the partition out.
+    """
+    values = dict(part.split('=', 1) for part in path.split('/')[:-1])
+    if values.get('year') == HIVE_NULL_PARTITION:
+        expression = ds.field('year').is_null() & ds.field('month').is_null()
+        return expression & ds.field(date_column).is_null() if date_column else expression
+
+    year, month = int(values['year']), int(values['month'])
+    expression = (ds.field('year') == year) & (ds.field('month') == month)
+    if date_column:
+        next_month = date(year + month // 12, month % 12 + 1, 1)
+        expression = expression & (ds.field(date_column) >= date(year, month, 1)) & (ds.field(date_column) < next_month)
+    return expression
+
+
+class S3RangeReader(io.RawIOBase):
+    """
+    Read-only, seekable file over an S3 object that downloads only the byte ranges actually read.
+
+    Given to pyarrow, reading a parquet file costs a GET of the footer and GETs of the column
+    chunks of the requested columns (adjacent chunks coalesced with pre_buffer), instead of the
+    whole object. Every GET is pinned to the ETag, so an object overwritten halfway through a
+    read fails rather than mixing two versions.
+    """
+
+    def __init__(self, s3_client, bucket_name, key, size=None, etag=None):
+        """
+        Parameters:
+        - s3_client: boto3 S3 client
+        - bucket_name: str: The name of S3 bucket to read from.
+        - key: str: The key of the object
+        - size: int: The object size, fetched with head_object when not given
+        - etag: str: Optional ETag every ranged GET must match
+        """
+        self.s3_client = s3_client
+        self.bucket_name = bucket_name
+        self.key = key
+        if size is None or etag is None:
+            response = s3_client.head_object(Bucket=bucket_name, Key=key)
+            size = response['ContentLength'] if size is None else size
+            etag = response['ETag'].strip('"') if etag is None else etag
+        self.size = size
+        self.etag = etag
+        self.position = 0
+        self.bytes_read = 0
+        self.requests = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self.position = offset
+        elif whence == io.SEEK_CUR:
+            self.position += offset
+        else:
+            self.position = self.size + offset
+        return self.position
+
+    def read(self, size=-1):
+        end = self.size if size is None or size < 0 else min(self.size, self.position + size)
+        if end <= self.position:
+            return b''
+        with span('s3.get_range', key=self.key, bytes=end - self.position):
+            response = self.s3_client.get_object(Bucket=self.bucket_name, Key=self.key, IfMatch=f'"{self.etag}"',
+                                                 Range=f"bytes={self.position}-{end - 1}")
+            body = response['Body'].read()
+        self.position += len(body)
+        self.bytes_read += len(body)
+        self.requests += 1
+        return body
+
+    def readinto(self, buffer):
+        body = self.read(len(buffer))
+        buffer[:len(body)] = body
+        return len(body)
+
+
+def read_body(response, chunk_size=DOWNLOAD_CHUNK_BYTES):
+    """
+    Streams a get_object body into a single Arrow buffer allocated up front from its ContentLength.
+
+    The body is held in memory once: there is no list of chunks joined into a bytes object and no
+    BytesIO copy, and pyarrow decodes straight from the buffer.
+
+    Returns:
+    - pyarrow.Buffer
+    """
+    size = response.get('ContentLength')
+    if size is None:
+        return pa.py_buffer(response['Body'].read())
+
+    buffer = pa.allocate_buffer(size)
+    view = memoryview(buffer).cast('B')
+    offset = 0
+    for chunk in response['Body'].iter_chunks(chunk_size):
+        view[offset:offset + len(chunk)] = chunk
+        offset += len(chunk)
+    if offset != size:
+        raise IOError(f"Expected {size} bytes, received {offset}")
+    return buffer
+
+
+def open_object(s3_client, bucket_name, s3_object, cache=None, ranged=False):
+    """
+    Returns a readable source for an object: the cached file when the key and ETag match, otherwise
+    the downloaded body, or with ranged=True an S3RangeReader that only fetches the parts pyarrow
+    reads (for objects of at least RANGED_READ_MIN_BYTES that the cache cannot hold, see
+    CACHED_OBJECT_MAX_FRACTION).
+
+    Only whole downloads are added to the cache, so a cacheable object is downloaded whole even
+    when ranged: one larger download, then no more GETs for it in this or any later process.
+
+    Returns:
+    - tuple: (source, ETag, whether it was a cache hit), where source is the path (str) of the cached
+      file, a pyarrow.BufferReader over the downloaded body or an S3RangeReader
+    """
+    etag = s3_object.get('ETag')
+    cached_path = cache.get(s3_object['Key'], etag) if cache is not None and etag else None
+    if cached_path:
+        return cached_path, etag, True
+
+    size = s3_object.get('Size') or 0
+    cacheable = cache is not None and etag and size <= cache.max_bytes * CACHED_OBJECT_MAX_FRACTION
+    if ranged and size >= RANGED_READ_MIN_BYTES and not cacheable:
+        reader = S3RangeReader(s3_client, bucket_name, s3_object['Key'], s3_object.get('Size'), etag)
+        return reader, reader.etag, False
+
+    with span('s3.get', key=s3_object['Key']) as attributes:
+        response = s3_client.get_object(Bucket=bucket_name, Key=s3_object['Key'])
+        body = read_body(response)
+        attributes['bytes'] = body.size
+    # The object may have been overwritten since it was listed; cache it under the ETag actually received
+    etag = response.get('ETag', etag or '').strip('"')
+    if cache is not None and etag:
+        cache.put(s3_object['Key'], etag, body)
+    return pa.BufferReader(body), etag, False
+
+
+def source_stats(source):
+    """
+    Returns the bytes transferred and the GET requests made for a source returned by open_object.
+    """
+    if isinstance(source, S3RangeReader):
+        return source.bytes_read, source.requests
+    if isinstance(source, pa.BufferReader):
+        return source.size(), 1
+    return os.path.getsize(source), 0
+
+
+def read_partitioned_table(s3_client, bucket_name, table, s3_object, cache=None, columns=None, filters=None,
+                           max_workers=DEFAULT_MAX_WORKERS):
+    """
+    Reads a hive-partitioned table through a pyarrow dataset, downloading only the partitions the filters can match
+
+    Partitions are pruned from their paths alone, before anything is downloaded; the remaining
+    files are then scanned with the filters pushed down to their row group statistics, and only
+    the requested columns are decoded. With columns, partitions that are not cached are read with
+    ranged GETs of those columns only.
+
+    Parameters:
+    - s3_client: boto3 S3 client
+    - bucket_name: str: The name of S3 bucket to read from.
+    - table: str: The table name
+    - s3_object: dict: The table's entry from get_latest_objects, with its 'Partitions'
+    - cache: ParquetCache: Optional on-disk cache; partitions are cached one by one
+    - columns: list: Columns to read, all of the table's columns by default
+    - filters: list or pyarrow.dataset.Expression: Row filter, in pyarrow's list-of-tuples form or as an expression
+    - max_workers: int: Maximum number of partitions downloaded at the same time
+
+    Returns:
+    - tuple: (pyarrow Table, list of the sources read, dict with cache_hit, partitions_read and partitions_total)
+    """
+    partitions = s3_object['Partitions']
+    date_column = PARTITION_DATE_COLUMNS.get(table)
+    expressions = {partition['Path']: partition_expression(partition['Path'], date_column) for partition in partitions}
+    file_format = ds.ParquetFileFormat()
+    expression = to_expression(filters)
+    sources = []
+
+    selected = partitions
+    if expression is not None:
+        # The newest partition's footer gives the schema the filters are checked against
+        newest = max(partitions, key=lambda partition: partition['Key'])
+        cached_path = cache.get(newest['Key'], newest['ETag']) if cache is not None and newest.get('ETag') else None
+        source = cached_path or S3RangeReader(s3_client, bucket_name, newest['Key'], newest.get('Size'), newest.get('ETag'))
+        file_schema = pq.read_schema(source)
+        sources.append(source)
+        # Placeholder fragments are never opened: get_fragments only compares the filter with their partition expressions
+        local_fs = pa_fs.LocalFileSystem()
+        placeholders = ds.FileSystemDataset(
+            [file_format.make_fragment(partition['Path'], filesystem=local_fs, partition_expression=expressions[partition['Path']])
+             for partition in partitions],
+            pa.unify_schemas([file_schema, PARTITION_SCHEMA]), file_format, local_fs
+        )
+        matching = {fragment.path for fragment in placeholders.get_fragments(filter=expression)}
+        # Keep one partition when nothing matches, so the empty result still has the table's columns
+        selected = [partition for partition in partitions if partition['Path'] in matching] or partitions[-1:]
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(selected)))) as executor:
+        opened = list(executor.map(
+            in_context(lambda partition: open_object(s3_client, bucket_name, partition, cache, ranged=columns is not None)),
+            selected
+        ))
+
+    fragments = []
+    for partition, (source, _, _) in zip(selected, opened):
+        sources.append(source)
+        partition_filter = expressions[partition['Path']]
+        if isinstance(source, str):
+            fragments.append(file_format.make_fragment(source, filesystem=pa_fs.LocalFileSystem(), partition_expression=partition_filter))
+        else:
+            fragments.append(file_format.make_fragment(source, partition_expression=partition_filter))
+
+    file_schema = pa.unify_schemas([fragment.physical_schema for fragment in fragments])
+    dataset = ds.FileSystemDataset(fragments, pa.unify_schemas([file_schema, PARTITION_SCHEMA]), file_format)
+    with span('parquet.decode', table=table, partitions=len(fragments)) as attributes:
+        arrow_table = dataset.to_table(columns=columns or file_schema.names, filter=expression)
+        attributes['rows'] = arrow_table.num_rows
+
+    stats = {
+        'cache_hit': all(cache_hit for _, _, cache_hit in opened),
+        'partitions_read': len(selected),
+        'partitions_total': len(partitions),
+    }
+    return arrow_table, sources, stats
+
+
+def to_backend(arrow_table, backend=DEFAULT_BACKEND):
+    """
+    Converts a decoded Arrow table to what the given backend returns.
+
+    For 'numpy', the Arrow memory is released column by column during the conversion
+    (self_destruct), so the table and the DataFrame are not both held in full at the peak.
+    The table must not be used afterwards.
+
+    Parameters:
+    - arrow_table: pyarrow.Table: The decoded table
+    - backend: str: One of BACKENDS
+    """
+    if backend == 'arrow':
+        return arrow_table
+    if backend == 'pyarrow':
+        return arrow_table.to_pandas(types_mapper=pd.ArrowDtype)
+    if backend == 'numpy':
+        return arrow_table.to_pandas(split_blocks=True, self_destruct=True)
+    raise ValueError(f"Unknown backend {backend!r}, expected one of {', '.join(BACKENDS)}")
+
+
+def fetch_table(s3_client, bucket_name, table, s3_object, cache=None, columns=None, filters=None,
+                max_workers=DEFAULT_MAX_WORKERS, backend=DEFAULT_BACKEND, compact=False):
+    """
+    Downloads and decodes one parquet object, reading it from the local cache when the key and ETag match
+
+    With columns (projection), an object that is not cached is not downloaded whole: its footer and
+    the chunks of those columns are fetched with ranged GETs, so the network time is part of
+    decode_seconds.
+
+    Parameters:
+    - s3_client: boto3 S3 client
+    - bucket_name: str: The name of S3 bucket to read from.
+    - table: str: The table the object belongs to
+    - s3_object: dict: {'Key', 'ETag', ...} as returned by list_latest_objects
+    - cache: ParquetCache: Optional on-disk cache of previously downloaded objects
+    - columns: list: Optional columns to read instead of all of them
+    - filters: list or pyarrow.dataset.Expression: Optional row filter, applied through pyarrow dataset
+      filtering; for partitioned tables it also decides which partitions are downloaded
+    - max_workers: int: Maximum number of partitions of a partitioned table downloaded at the same time
+    - backend: str: 'numpy' (default), 'pyarrow' or 'arrow', see BACKENDS
+    - compact: bool: Store the columns in the smallest types that hold their values exactly (see
+      compaction.compact_table) before converting the table to the backend
+
+    Returns:
+    - tuple: (pandas DataFrame or pyarrow Table, dict of timings and sizes for the table)
+    """
+    start = time.perf_counter()
+
+    with span('table.load', table=table, backend=backend) as attributes:
+        if 'Partitions' in s3_object:
+            arrow_table, sources, partition_stats = read_partitioned_table(s3_client, bucket_name, table, s3_object, cache,
+                                                                           columns, filters, max_workers)
+            downloaded = time.perf_counter()
+            etag, cache_hit = s3_object.get('ETag'), partition_stats.pop('cache_hit')
+        else:
+            source, etag, cache_hit = open_object(s3_client, bucket_name, s3_object, cache, ranged=columns is not None)
+            sources = [source]
+            partition_stats = {}
+            downloaded = time.perf_counter()
+            with span('parquet.decode', table=table) as decode_attributes:
+                # Cached files are memory mapped rather than read into memory
+                arrow_table = pq.read_table(source, columns=columns, filters=filters, memory_map=isinstance(source, str))
+                decode_attributes['rows'] = arrow_table.num_rows
+        num_rows, num_columns = arrow_table.num_rows, arrow_table.num_columns
+        compaction_stats = {}
+        if compact:
+            with span('arrow.compact', table=table) as compact_attributes:
+                arrow_table, compaction_stats = compact_table(arrow_table)
+                compact_attributes.update(bytes_before=compaction_stats['bytes_before'],
+                                          bytes_after=compaction_stats['bytes_after'])
+            logger.info(f"Compacted {table} from {compaction_stats['bytes_before'] / 2**20:.1f} MiB "
+                        f"to {compaction_stats['bytes_after'] / 2**20:.1f} MiB")
+        with span('arrow.to_backend', table=table, backend=backend):
+            df = to_backend(arrow_table, backend)
+        del arrow_table
+        decoded = time.perf_counter()
+        attributes.update(rows=num_rows, columns=num_columns, cache_hit=cache_hit)
+
+    transferred = [source_stats(source) for source in sources]
+    stats = {
+        'key': s3_object['Key'],
+        'etag': etag,
+        'bytes': sum(size for size, _ in transferred),
+        'requests': sum(requests for _, requests in transferred),
+        'columns': num_columns,
+        'rows': num_rows,
+        'cache_hit': cache_hit,
+        'download_seconds': downloaded - start,
+        'decode_seconds': decoded - downloaded,
+        'total_seconds': decoded - start,
+        **partition_stats,
+    }
+    if compact:
+        stats.update(memory_bytes_before=compaction_stats['bytes_before'], memory_bytes_after=compaction_stats['bytes_after'],
+                     compacted_columns=compaction_stats['compacted_columns'])
+    source_name = "cache" if cache_hit else s3_object['Key']
+    logger.info(f"Loaded {table} from {source_name} in {stats['total_seconds']:.3f}s")
+    return df, stats
+
+
+def load_objects(s3_client, bucket_name, latest_objects, max_workers=DEFAULT_MAX_WORKERS, cache=None, columns=None,
+                 filters=None, backend=DEFAULT_BACKEND, compact=False):
+    """
+    Downloads and decodes the given parquet objects concurrently on a bounded thread pool
+
+    Parameters:
+    - s3_client: boto3 S3 client
+    - bucket_name: str: The name of S3 bucket to read from.
+    - latest_objects: dict: table name -> S3 object, as returned by list_latest_objects
+    - max_workers: int: Maximum number of tables downloaded at the same time
+    - cache: ParquetCache: Optional on-disk cache; only tables whose key or ETag changed are downloaded
+    - columns: dict: Optional table name -> list of columns to read
+    - filters: dict: Optional table name -> row filter (see fetch_table)
+    - backend: str: 'numpy' (default), 'pyarrow' or 'arrow', see BACKENDS
+    - compact: bool: Compact the tables' column types (see fetch_table)
+
+    Returns:
+    - tuple: (dict of table name -> DataFrame or pyarrow Table, dict of table name -> timings)
+    """
+    columns = columns or {}
+    filters = filters or {}
+    results = {}
+    if latest_objects:
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(latest_objects)))) as executor:
+            futures = {
+                executor.submit(in_context(fetch_table), s3_client, bucket_name, table, s3_object, cache, columns.get(table),
+                                filters.get(table), max_workers, backend, compact): table
+                for table, s3_object in latest_objects.items()
+            }
+            for future in as_completed(futures):
+                table = futures[future]
+                try:
+                    results[table] = future.result()
+                except Exception as e:
+                    logger.error(f"Failed to load table {table}: {e}")
+                    raise
+
+    # Keep the table order of latest_objects rather than completion order
+    data = {table: results[table][0] for table in latest_objects}
+    stats = {table: results[table][1] for table in latest_objects}
+    return data, stats
+
+
+def load_data_from_s3(bucket_name, s3_folder="", aws_access_key_id=None, aws_secret_access_key=None, region_name=None,
+                      max_workers=DEFAULT_MAX_WORKERS, with_stats=False, cache=None, columns=None, filters=None,
+                      backend=DEFAULT_BACKEND, compact=False):
+
+    """
+    Loads the most recent parquet files from an S3 bucket
+
+    The latest file of every table comes from the latest.json manifest (or a paginated listing
+    when there is none), and the files are downloaded and decoded in parallel, so a cold start costs roughly the slowest table rather than the sum of all.
+
+    Parameters:
+    - bucket_name: str: The name of S3 bucket to read from.
+    - s3_folder: str: The S3 folder where the files are stored
+    - max_workers: int: Maximum number of tables downloaded at the same time
+    - with_stats: bool: Also return the per-table timings
+    - cache: ParquetCache: Optional on-disk cache keyed by S3 key and ETag, so unchanged tables are
+      read from local disk instead of being downloaded again
+    - columns: dict: Optional table name -> list of columns to read
+    - filters: dict: Optional table name -> row filter in pyarrow's list-of-tuples form or as a
+      pyarrow.dataset expression, e.g. {'fact_sales_order': recent_months_filter(3, 'created_date')};
+      only the partitions of a partitioned table that can match are downloaded
+    - backend: str: 'numpy' for NumPy-backed DataFrames (default), 'pyarrow' for DataFrames with
+      ArrowDtype columns, or 'arrow' for pyarrow Tables, which skip the pandas conversion entirely
+    - compact: bool: Downcast integer keys and quantities, store low-cardinality text as categoricals
+      and decimals such as unit_price as exact floats instead of Python objects; the per-table
+      timings then include the Arrow bytes before and after (memory_bytes_before, memory_bytes_after)
+
+    Returns:
+    - dict: A dictionary where keys are the TABLES names and values are pandas DataFrames (or pyarrow
+      Tables); the SUMMARY_TABLES are only used through a Dataset (see summaries.summary_table)
+    - (dict, dict): The same dictionary plus per-table timings when with_stats is True
+    """
+
+    s3_client = get_s3_client(aws_access_key_id, aws_secret_access_key, region_name, max_workers)
+
+    latest_objects = {table: s3_object for table, s3_object in get_latest_objects(s3_client, bucket_name, s3_folder).items()
+                      if table in TABLES}
+
+    if not latest_objects:
+        logger.error(f"No files found in the S3 folder: {s3_folder}")
+
+    for table in TABLES:
+        if table not in latest_objects:
+            logger.error(f"No files found for table: {table}")
 
-            obj = s3_client.get_object(Bucket=bucket_name, Key=latest_file_key)
-            data[table] = pd.read_parquet(BytesIO(obj['Body'].read()))
-            logger.info(f"Loaded data from {latest_file_key}")
+    data, stats = load_objects(s3_client, bucket_name, latest_objects, max_workers, cache, columns, filters, backend, compact)
 
+    if with_stats:
+        return data, stats
     return data 
 
 
@@ -0,0 +1,173 @@
+import logging
+import re
+import threading
+
+import duckdb
+import pandas as pd
+import pyarrow as pa
+
+logger = logging.getLogger('sql_engine')
+logger.setLevel(logging.INFO)
+
+DEFAULT_MAX_ROWS = 10_000
+DEFAULT_TIMEOUT_SECONDS = 30
+
+# The analyses of analysis.py as SQL over the star schema. Rows with a missing name are left out
+# and an empty total is 0, as groupby().sum() does.
+ANALYSIS_SQL = {
+    'sales_by_staff_and_location': """
+        SELECT s.first_name || ' ' || s.last_name AS staff_name,
+               l.country AS location_name,
+               COALESCE(SUM(CAST(f.units_sold AS DOUBLE) * CAST(f.unit_price AS DOUBLE)), 0) AS total_sales_amount
+        FROM fact_sales_order f
+        JOIN dim_staff s ON f.sales_staff_id = s.staff_id
+        JOIN dim_location l ON f.agreed_delivery_location_id = l.location_id
+        WHERE s.first_name IS NOT NULL AND s.last_name IS NOT NULL AND l.country IS NOT NULL
+        GROUP BY s.first_name, s.last_name, l.country
+        ORDER BY total_sales_amount DESC
+    """,
+    'sales_by_product_design': """
+        SELECT d.design_name,
+               COALESCE(SUM(CAST(f.units_sold AS DOUBLE) * CAST(f.unit_price AS DOUBLE)), 0) AS total_sales_amount
+        FROM fact_sales_order f
+        JOIN dim_design d ON f.design_id = d.design_id
+        WHERE d.design_name IS NOT NULL
+        GROUP BY d.design_name
+        ORDER BY total_sales_amount DESC
+    """,
+    'sales_by_currency': """
+        SELECT c.currency_code,
+               COALESCE(SUM(CAST(f.units_sold AS DOUBLE) * CAST(f.unit_price AS DOUBLE)), 0) AS total_sales_amount
+        FROM fact_sales_order f
+        JOIN dim_currency c ON f.currency_id = c.currency_id
+        WHERE c.currency_code IS NOT NULL
+        GROUP BY c.currency_code
+        ORDER BY total_sales_amount DESC
+    """,
+}
+
+
+# An identifier token: a quoted name (with "" for a quote inside it) or a bare name
+IDENTIFIER = re.compile(r'"((?:[^"]|"")*)"|([A-Za-z_][A-Za-z0-9_$]*)')
+
+
+def referenced_tables(sql, table_names):
+    """
+    Returns the names of table_names a SQL statement mentions, from DuckDB's tokenizer.
+
+    Unlike duckdb.get_table_names, the statement is not bound, so queries that only bind once their
+    tables exist (JOIN ... USING, NATURAL JOIN, COLUMNS(...)) work. A column or alias named like a
+    table makes that table count as mentioned, which only registers a table the query does not read.
+
+    Parameters:
+    - sql: str: The SQL statement
+    - table_names: iterable: The table names that can be registered
+
+    Returns:
+    - set: The mentioned table names
+    """
+    names = {name.lower(): name for name in table_names}
+    found = set()
+    for position, token_type in duckdb.tokenize(sql):
+        if token_type != duckdb.token_type.identifier:
+            continue
+        match = IDENTIFIER.match(sql, position)
+        if match is None:
+            continue
+        identifier = match.group(1).replace('""', '"') if match.group(1) is not None else match.group(2)
+        if identifier.lower() in names:
+            found.add(names[identifier.lower()])
+    return found
+
+
+def connect(data, table_names, full_tables=False, threads=None):
+    """
+    Opens an in-memory DuckDB connection with tables of a Dataset registered as views.
+
+    The DataFrames are scanned where they are, not copied into DuckDB. Once they are registered,
+    file and network access is switched off and the configuration locked, so a query can only read
+    the registered tables.
+
+    Parameters:
+    - data: Dataset or dict: table name -> DataFrame
+    - table_names: iterable: The tables to register
+    - full_tables: bool: Register every column (Dataset.full_table) rather than the loaded projection
+    - threads: int: Optional number of DuckDB worker threads, all cores by default
+
+    Returns:
+    - duckdb.DuckDBPyConnection
+    """
+    con = duckdb.connect(config={'threads': threads} if threads else {})
+    for table_name in table_names:
+        df = data.full_table(table_name) if full_tables and hasattr(data, 'full_table') else data[table_name]
+        if any(isinstance(dtype, pd.ArrowDtype) for dtype in df.dtypes):
+            # ArrowDtype columns wrap Arrow arrays: hand DuckDB those rather than have it convert them
+            df = pa.Table.from_pandas(df, preserve_index=False)
+        con.register(table_name, df)
+    con.execute("SET enable_external_access = false")
+    con.execute("SET lock_configuration = true")
+    return con
+
+
+def run_sql(data, sql, max_rows=DEFAULT_MAX_ROWS, timeout=DEFAULT_TIMEOUT_SECONDS, full_tables=True, threads=None,
+            table_names=None):
+    """
+    Runs a SQL query over the tables of a Dataset.
+
+    Only the tables the query names are registered (and, for a lazily loaded Dataset, loaded).
+
+    Parameters:
+    - data: Dataset or dict: table name -> DataFrame
+    - sql: str: A single SQL statement
+    - max_rows: int: Maximum number of rows returned, or None for all of them
+    - timeout: float: Seconds after which the query is interrupted, or None to let it run
+    - full_tables: bool: Register every column of projected tables (see connect)
+    - threads: int: Optional number of DuckDB worker threads
+    - table_names: iterable: Optional tables the query may read, every table of data by default
+
+    Returns:
+    - tuple: (pandas DataFrame, whether the result was cut at max_rows)
+
+    Raises:
+    - TimeoutError: The query ran for longer than timeout
+    - duckdb.Error: The query is invalid or failed
+    """
+    table_names = referenced_tables(sql, [name for name in data if table_names is None or name in table_names])
+    con = connect(data, sorted(table_names), full_tables, threads)
+    timer = threading.Timer(timeout, con.interrupt) if timeout else None
+    if timer is not None:
+        timer.start()
+    try:
+        relation = con.sql(sql)
+        if relation is None:
+            raise ValueError("The statement does not return rows")
+        if max_rows is not None:
+            relation = relation.limit(max_rows + 1)
+        df = relation.df()
+    except duckdb.InterruptException:
+        raise TimeoutError(f"Query cancelled after {timeout} seconds")
+    finally:
+        if timer is not None:
+            timer.cancel()
+        con.close()
+
+    truncated = max_rows is not None and len(df) > max_rows
+    if truncated:
+        df = df.head(max_rows)
+    logger.info(f"Ran SQL over {sorted(table_names)}: {len(df)} rows{' (truncated)' if truncated else ''}")
+    return df, truncated
+
+
+def run_analysis(data, analysis_name, timeout=DEFAULT_TIMEOUT_SECONDS, threads=None):
+    """
+    Runs one of the analyses of analysis.py with DuckDB instead of pandas.
+
+    Parameters:
+    - data: Dataset or dict: table name -> DataFrame
+    - analysis_name: str: Name of the analysis function, a key of ANALYSIS_SQL
+
+    Returns:
+    - pandas.DataFrame: The same columns as the pandas analysis
+    """
+    df, _ = run_sql(data, ANALYSIS_SQL[analysis_name], max_rows=None, timeout=timeout, full_tables=False, threads=threads)
+    return df
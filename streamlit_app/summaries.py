@@ -0,0 +1,98 @@
+import logging
+
+import numpy as np
+import pandas as pd
+
+from s3_loader import source_fingerprint
+from star_schema import FACT_TABLE, FACT_FOREIGN_KEYS, PRIMARY_KEY_COLUMNS, get_star_schema
+
+logger = logging.getLogger('summaries')
+logger.setLevel(logging.INFO)
+
+# Summary tables written by transfer_data.py, by the fact foreign keys they total
+# units_sold * unit_price by. The '_daily' tables are also split by created_date
+SUMMARY_TABLES = {
+    ('sales_staff_id', 'agreed_delivery_location_id'): 'agg_sales_by_staff_location',
+    ('design_id',): 'agg_sales_by_design',
+    ('currency_id',): 'agg_sales_by_currency',
+}
+DAILY_SUFFIX = '_daily'
+
+
+def summary_table(data, foreign_keys):
+    """
+    Returns the name of the summary table that can replace the fact table when totalling sales by
+    foreign_keys, or None when there is none or it is stale.
+
+    A summary is only used when the fingerprint of the fact table it was computed from matches the
+    fact table of the dataset. When the fact table is loaded with a filter (e.g. only recent
+    months), the daily summary is used, loaded with the same filter.
+
+    Parameters:
+    - data: Dataset: The dataset; plain dicts have no summaries
+    - foreign_keys: iterable: Fact foreign key columns
+
+    Returns:
+    - str: The summary table name, or None
+    """
+    name = SUMMARY_TABLES.get(tuple(foreign_keys))
+    sources = getattr(data, 'sources', None)
+    if name is None or sources is None or FACT_TABLE not in sources:
+        return None
+    if (getattr(data, 'filters', None) or {}).get(FACT_TABLE):
+        name += DAILY_SUFFIX
+    if name not in sources:
+        return None
+
+    fingerprint = source_fingerprint(sources[FACT_TABLE])
+    if fingerprint is None or (sources[name].get('Source') or {}).get('fingerprint') != fingerprint:
+        logger.info(f"Summary {name} is stale, computing from {FACT_TABLE}")
+        return None
+    return name
+
+
+def summary_totals(data, foreign_keys):
+    """
+    Totals sales per combination of dimension rows from a summary table, in the form of
+    StarSchema.sum_by.
+
+    Returns:
+    - tuple: (list of int arrays with the dimension row positions of each group, float array with
+      the total_sales_amount of each group), or None when there is no up to date summary
+    """
+    name = summary_table(data, foreign_keys)
+    if name is None:
+        return None
+    summary = data[name]
+
+    matched = np.ones(len(summary), dtype=bool)
+    positions, sizes = [], []
+    for foreign_key in foreign_keys:
+        dimension = FACT_FOREIGN_KEYS[foreign_key]
+        dimension_index = pd.Index(data[dimension][PRIMARY_KEY_COLUMNS[dimension]])
+        if not dimension_index.is_unique:
+            raise ValueError(f"{PRIMARY_KEY_COLUMNS[dimension]} is not unique in {dimension}")
+        dimension_positions = dimension_index.get_indexer(summary[foreign_key]).astype('int64')
+        matched &= dimension_positions >= 0
+        positions.append(dimension_positions)
+        sizes.append(len(dimension_index))
+
+    # Daily rows (and keys that map to the same dimension row) are combined per group
+    codes = np.zeros(int(matched.sum()), dtype='int64')
+    for dimension_positions, size in zip(positions, sizes):
+        codes = codes * size + dimension_positions[matched]
+    weights = summary['total_sales_amount'].to_numpy(dtype='float64', na_value=0.0)[matched]
+    present, inverse = np.unique(codes, return_inverse=True)
+    totals = np.bincount(inverse, weights=np.nan_to_num(weights, nan=0.0), minlength=len(present))
+    return list(np.unravel_index(present, sizes)), totals
+
+
+def sales_totals(data, *foreign_keys):
+    """
+    Totals sales per combination of dimension rows, from an up to date summary table when the
+    dataset has one and from the fact table otherwise (see StarSchema.sum_by).
+    """
+    totals = summary_totals(data, foreign_keys)
+    if totals is not None:
+        return totals
+    return get_star_schema(data).sum_by(*foreign_keys)
@@ -0,0 +1,133 @@
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from query_cache import QueryCache
+
+DEFAULT_PAGE_SIZE = 100
+PAGE_SIZES = (25, 100, 500, 1000)
+
+# A row order holds one int64 per row of the table, so only a few are kept
+DEFAULT_MAX_ORDERS = 4
+DEFAULT_MAX_PAGES = 64
+
+
+def filter_mask(series, value):
+    """
+    Rows of a column matching a filter value typed by the user: equal to it for numeric columns,
+    containing it (case-insensitive) for every other column.
+
+    Parameters:
+    - series: pandas.Series: The column
+    - value: str: The filter value
+
+    Returns:
+    - numpy bool array
+    """
+    if pd.api.types.is_numeric_dtype(series.dtype) and not pd.api.types.is_bool_dtype(series.dtype):
+        try:
+            number = float(value)
+        except ValueError:
+            return np.zeros(len(series), dtype=bool)
+        return (series == number).fillna(False).to_numpy(dtype=bool)
+
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        # Match the few categories instead of every row
+        categories = series.cat.categories
+        matched = categories[categories.astype(str).str.contains(value, case=False, regex=False)]
+        return series.isin(matched).to_numpy(dtype=bool)
+
+    return series.astype(str).str.contains(value, case=False, regex=False).fillna(False).to_numpy(dtype=bool)
+
+
+def row_order(df, sort_by=None, ascending=True, filter_column=None, filter_value=None):
+    """
+    Positions of the rows of a table that pass a filter, in sort order.
+
+    Parameters:
+    - df: pandas.DataFrame: The table
+    - sort_by: str: Optional column to sort by; missing values go last
+    - ascending: bool: Sort direction
+    - filter_column: str: Optional column to filter on
+    - filter_value: str: Value the filter column must match (see filter_mask)
+
+    Returns:
+    - numpy int64 array of row positions
+    """
+    positions = np.arange(len(df), dtype='int64')
+    if filter_column and filter_value:
+        positions = positions[filter_mask(df[filter_column], filter_value)]
+
+    if sort_by:
+        column = df[sort_by].take(positions).reset_index(drop=True)
+        if isinstance(column.dtype, pd.CategoricalDtype) and not column.cat.ordered:
+            # Sort text categoricals alphabetically rather than in the order the categories were seen
+            column = column.cat.reorder_categories(column.cat.categories.sort_values(), ordered=True)
+        elif isinstance(column.dtype, pd.ArrowDtype) and pa.types.is_dictionary(column.dtype.pyarrow_dtype):
+            # Arrow cannot sort dictionary arrays; sort the decoded values
+            column = column.astype(pd.ArrowDtype(column.dtype.pyarrow_dtype.value_type))
+        order = column.sort_values(ascending=ascending, kind='stable', na_position='last').index.to_numpy()
+        positions = positions[order]
+    return positions
+
+
+class TablePager:
+    """
+    Serves one page of a table at a time, so the browser is only sent the rows on screen.
+
+    Sorting and filtering run on the server over the in-memory table. The resulting row order is
+    cached per (table, sort, filter) and every page per (table, sort, filter, page, page size), both
+    for the dataset version they were computed on, so paging back and forth does not sort again.
+    Pages are shared between sessions and must be treated as read-only.
+    """
+
+    def __init__(self, max_pages=DEFAULT_MAX_PAGES, max_orders=DEFAULT_MAX_ORDERS):
+        self._orders = QueryCache(max_orders)
+        self._pages = QueryCache(max_pages)
+
+    def page(self, data, table_name, page=1, page_size=DEFAULT_PAGE_SIZE, sort_by=None, ascending=True,
+             filter_column=None, filter_value=None):
+        """
+        Returns one page of a table of a Dataset.
+
+        Parameters:
+        - data: Dataset: The dataset the table is read from (all of its columns)
+        - table_name: str: The table
+        - page: int: 1-based page number; pages past the end are empty
+        - page_size: int: Rows per page
+        - sort_by, ascending, filter_column, filter_value: see row_order
+
+        Returns:
+        - tuple: (pandas DataFrame with the rows of the page, number of rows matching the filter)
+        """
+        if not (filter_column and filter_value):
+            filter_column = filter_value = None
+        view = (table_name, sort_by, bool(ascending) if sort_by else None, filter_column, filter_value)
+
+        def order():
+            return row_order(data.full_table(table_name), sort_by, ascending, filter_column, filter_value)
+
+        def rows():
+            df = data.full_table(table_name)
+            start = (page - 1) * page_size
+            if sort_by is None and filter_column is None:
+                return df.iloc[start:start + page_size]
+            return df.take(self._orders.get_or_compute(view, data.version, order)[start:start + page_size])
+
+        page_df = self._pages.get_or_compute(view + (page, page_size), data.version, rows)
+        if sort_by is None and filter_column is None:
+            total_rows = len(data.full_table(table_name))
+        else:
+            total_rows = len(self._orders.get_or_compute(view, data.version, order))
+        return page_df, total_rows
+
+    def on_dataset_swap(self, dataset):
+        """
+        Drops the orders and pages of every version other than the new dataset's.
+        """
+        self._orders.on_dataset_swap(dataset)
+        self._pages.on_dataset_swap(dataset)
+
+    def clear(self):
+        self._orders.clear()
+        self._pages.clear()
@@ -0,0 +1,28 @@
+import os
+import sys
+
+import boto3
+import pytest
+from moto import mock_aws
+
+# The modules import each other by their flat names, as when each script runs from its own directory
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for directory in ('streamlit_app', 'transfer_data', 'upload_script'):
+    sys.path.insert(0, os.path.join(ROOT, directory))
+
+BUCKET_NAME = 'test-bucket'
+REGION = 'eu-west-2'
+
+
+@pytest.fixture
+def s3_client(monkeypatch):
+    """
+    A client of an in-process S3 stand-in (moto) with an empty BUCKET_NAME bucket.
+    """
+    for name in ('AWS_ACCESS_KEY_ID', 'AWS_SECRET_ACCESS_KEY'):
+        monkeypatch.setenv(name, 'testing')
+    monkeypatch.setenv('AWS_DEFAULT_REGION', REGION)
+    with mock_aws():
+        client = boto3.client('s3', region_name=REGION)
+        client.create_bucket(Bucket=BUCKET_NAME, CreateBucketConfiguration={'LocationConstraint': REGION})
+        yield client
@@ -0,0 +1,113 @@
+import io
+import json
+import threading
+from datetime import date
+
+import pandas as pd
+import pytest
+
+from conftest import BUCKET_NAME, REGION
+from dataset import DatasetStore
+from query_cache import QueryCache
+from s3_loader import MANIFEST_NAME, TABLES, load_data_from_s3
+
+S3_FOLDER = 'db/parquet_files'
+
+
+def sales(rows):
+    return pd.DataFrame({'sales_order_id': range(rows),
+                         'created_date': [date(2024, 1 + i % 12, 1) for i in range(rows)],
+                         'units_sold': [i % 7 + 1 for i in range(rows)]})
+
+
+def upload(s3_client, day, tables):
+    """
+    Uploads {table name: DataFrame} to a daily folder and points the manifest at them, keeping the
+    entries of the other tables. Returns the manifest entries.
+    """
+    manifest_key = f"{S3_FOLDER}/{MANIFEST_NAME}"
+    try:
+        entries = json.loads(s3_client.get_object(Bucket=BUCKET_NAME, Key=manifest_key)['Body'].read())['tables']
+    except s3_client.exceptions.NoSuchKey:
+        entries = {}
+    for table, df in tables.items():
+        buffer = io.BytesIO()
+        df.to_parquet(buffer)
+        key = f"{S3_FOLDER}/{day}/{table}.parquet"
+        etag = s3_client.put_object(Bucket=BUCKET_NAME, Key=key, Body=buffer.getvalue())['ETag'].strip('"')
+        entries[table] = {'key': key, 'etag': etag, 'size': buffer.tell(), 'rows': len(df)}
+    s3_client.put_object(Bucket=BUCKET_NAME, Key=manifest_key, Body=json.dumps({'tables': entries}).encode("utf-8"))
+    return entries
+
+
+@pytest.fixture
+def populated(s3_client):
+    tables = {table: pd.DataFrame({'id': range(5)}) for table in TABLES}
+    tables['fact_sales_order'] = sales(120)
+    upload(s3_client, '2024/10/18', tables)
+    return s3_client
+
+
+def make_store(**kwargs):
+    return DatasetStore(BUCKET_NAME, S3_FOLDER, region_name=REGION, max_workers=2, **kwargs)
+
+
+def test_filters_function_is_evaluated_on_every_refresh(populated):
+    window = {'start': date(2024, 7, 1)}
+    store = make_store(filters=lambda: {'fact_sales_order': [[('created_date', '>=', window['start'])]]})
+    dataset = store.get()
+    assert len(dataset['fact_sales_order']) == 60
+    dataset['dim_staff']
+    assert store.poll() is dataset
+
+    # The window moves forward although the data in S3 did not change
+    window['start'] = date(2024, 10, 1)
+    moved = store.poll()
+    assert moved is not dataset and moved.version != dataset.version
+    assert len(moved['fact_sales_order']) == 30
+    assert moved.filters['fact_sales_order'] == [[('created_date', '>=', date(2024, 10, 1))]]
+    # The unfiltered table is carried over
+    assert moved['dim_staff'] is dataset['dim_staff']
+
+
+def test_load_data_from_s3_returns_only_the_warehouse_tables(populated):
+    upload(populated, '2024/10/18', {'agg_sales_by_currency': pd.DataFrame({'currency_id': [1], 'total_sales': [1.0]})})
+    data = load_data_from_s3(BUCKET_NAME, S3_FOLDER, region_name=REGION)
+    assert sorted(data) == sorted(TABLES)
+
+
+def test_poll_swaps_in_new_data_once_warmed(populated):
+    store = make_store()
+    query_cache = QueryCache()
+    store.subscribe(query_cache.on_dataset_swap)
+    old = store.get()
+    assert query_cache.get_or_compute('orders', old.version, lambda: len(old['fact_sales_order'])) == 120
+    assert store.poll() is old
+
+    warming, release = threading.Event(), threading.Event()
+
+    def blocking_warmer(dataset):
+        warming.set()
+        release.wait(10)
+    store.add_warmer(blocking_warmer)
+
+    upload(populated, '2024/10/19', {'fact_sales_order': sales(150)})
+    poller = threading.Thread(target=store.poll)
+    poller.start()
+    try:
+        assert warming.wait(10)
+        # Sessions keep the old version while the new one warms
+        assert store.get() is old and store.current is old
+    finally:
+        release.set()
+        poller.join(10)
+    assert not poller.is_alive()
+
+    new = store.get()
+    assert new is not old and new.version != old.version
+    # The tables the old version had loaded were loaded by the warm refresh
+    assert 'fact_sales_order' in new.loaded
+    assert query_cache.names(old.version) == []
+    misses = query_cache.misses
+    assert query_cache.get_or_compute('orders', new.version, lambda: len(new['fact_sales_order'])) == 150
+    assert query_cache.misses == misses + 1
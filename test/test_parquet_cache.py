@@ -0,0 +1,96 @@
+import io
+import os
+
+import pandas as pd
+import pyarrow as pa
+import pytest
+
+import s3_loader
+from conftest import BUCKET_NAME
+from parquet_cache import ParquetCache
+from s3_loader import S3RangeReader, open_object
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return ParquetCache(str(tmp_path / 'cache'), max_bytes=1000)
+
+
+def set_last_use(path, seconds):
+    os.utime(path, (seconds, seconds))
+
+
+def test_hit_on_same_etag(cache):
+    path = cache.put('db/dim_staff.parquet', 'etag-1', b'abc')
+    assert cache.get('db/dim_staff.parquet', 'etag-1') == path
+    with open(path, 'rb') as rfile:
+        assert rfile.read() == b'abc'
+
+
+def test_miss_after_etag_change(cache):
+    cache.put('db/dim_staff.parquet', 'etag-1', b'abc')
+    assert cache.get('db/dim_staff.parquet', 'etag-2') is None
+    assert cache.get('db/dim_currency.parquet', 'etag-1') is None
+
+
+def test_keeps_the_previous_version_of_a_key(cache):
+    first = cache.put('db/dim_staff.parquet', 'etag-1', b'a')
+    set_last_use(first, 1)
+    second = cache.put('db/dim_staff.parquet', 'etag-2', b'b')
+    set_last_use(second, 2)
+    # The Dataset still served until the swap can read the previous version
+    assert cache.get('db/dim_staff.parquet', 'etag-1') == first
+
+    set_last_use(first, 1)
+    cache.put('db/dim_staff.parquet', 'etag-3', b'c')
+    assert cache.get('db/dim_staff.parquet', 'etag-1') is None
+    assert cache.get('db/dim_staff.parquet', 'etag-2') == second
+    assert cache.get('db/dim_staff.parquet', 'etag-3') is not None
+
+
+def test_evicts_least_recently_used_over_max_bytes(cache):
+    paths = {}
+    for i, key in enumerate(['a', 'b']):
+        paths[key] = cache.put(key, 'etag', b'x' * 400)
+        set_last_use(paths[key], 10 + i)
+    # 'a' is used again, so 'b' is the least recently used
+    assert cache.get('a', 'etag') == paths['a']
+    cache.put('c', 'etag', b'x' * 400)
+
+    assert cache.get('b', 'etag') is None
+    assert cache.get('a', 'etag') == paths['a']
+    assert cache.get('c', 'etag') is not None
+    assert cache.size() <= cache.max_bytes
+
+
+def put_parquet(s3_client, key):
+    buffer = io.BytesIO()
+    pd.DataFrame({'id': range(100), 'name': [f'name {i}' for i in range(100)]}).to_parquet(buffer)
+    s3_client.put_object(Bucket=BUCKET_NAME, Key=key, Body=buffer.getvalue())
+    head = s3_client.head_object(Bucket=BUCKET_NAME, Key=key)
+    return {'Key': key, 'ETag': head['ETag'].strip('"'), 'Size': head['ContentLength']}
+
+
+def test_projected_read_of_a_cacheable_object_is_cached(s3_client, tmp_path, monkeypatch):
+    monkeypatch.setattr(s3_loader, 'RANGED_READ_MIN_BYTES', 0)
+    s3_object = put_parquet(s3_client, 'db/dim_staff.parquet')
+    cache = ParquetCache(str(tmp_path), max_bytes=s3_object['Size'] * 10)
+
+    source, etag, cache_hit = open_object(s3_client, BUCKET_NAME, s3_object, cache, ranged=True)
+    assert isinstance(source, pa.BufferReader) and not cache_hit
+    source, etag, cache_hit = open_object(s3_client, BUCKET_NAME, s3_object, cache, ranged=True)
+    assert cache_hit and source == cache.get(s3_object['Key'], s3_object['ETag'])
+
+
+def test_object_too_large_for_the_cache_is_read_with_ranged_gets(s3_client, tmp_path, monkeypatch):
+    monkeypatch.setattr(s3_loader, 'RANGED_READ_MIN_BYTES', 0)
+    s3_object = put_parquet(s3_client, 'db/dim_staff.parquet')
+    # Larger than CACHED_OBJECT_MAX_FRACTION of the cache
+    cache = ParquetCache(str(tmp_path), max_bytes=int(s3_object['Size'] / s3_loader.CACHED_OBJECT_MAX_FRACTION) - 1)
+
+    source, _, cache_hit = open_object(s3_client, BUCKET_NAME, s3_object, cache, ranged=True)
+    assert isinstance(source, S3RangeReader) and not cache_hit
+    assert cache.get(s3_object['Key'], s3_object['ETag']) is None
+
+    source, _, _ = open_object(s3_client, BUCKET_NAME, s3_object, None, ranged=True)
+    assert isinstance(source, S3RangeReader)
@@ -0,0 +1,101 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import profiles
+from profiles import NULL_METHODS, NullHandledView, TableProfile
+
+
+@pytest.fixture
+def df():
+    rng = np.random.default_rng(0)
+    rows = 1000
+    units = rng.integers(1, 100, rows)
+    prices = np.round(rng.random(rows) * 10, 2)
+    prices[::7] = np.nan
+    return pd.DataFrame({
+        'units_sold': units,
+        'unit_price': prices,
+        'currency_code': pd.Series(rng.choice(['GBP', 'USD', 'EUR', None], rows), dtype=object),
+        'created_date': pd.date_range('2024-01-01', periods=rows, freq='h'),
+    })
+
+
+def test_numeric_summary_matches_describe(df):
+    summary = TableProfile(df).numeric_summary()
+    expected = df.describe()
+    for column in ['units_sold', 'unit_price']:
+        for statistic in expected.index:
+            assert summary.loc[statistic, column] == pytest.approx(expected.loc[statistic, column]), (column, statistic)
+
+
+def test_column_statistics(df):
+    columns = TableProfile(df).columns
+    assert columns.loc['unit_price', 'nulls'] == df['unit_price'].isna().sum()
+    assert columns.loc['currency_code', 'nulls'] == df['currency_code'].isna().sum()
+    assert columns.loc['currency_code', 'distinct'] == df['currency_code'].nunique()
+    assert columns.loc['units_sold', 'distinct'] == df['units_sold'].nunique()
+    assert columns.loc['created_date', 'min'] == df['created_date'].min()
+    assert columns.loc['created_date', 'max'] == df['created_date'].max()
+
+
+def test_empty_table():
+    profile = TableProfile(pd.DataFrame())
+    assert profile.rows == 0 and profile.null_columns == [] and not profile.has_nulls
+    assert profile.numeric_summary().empty
+
+    profile = TableProfile(pd.DataFrame({'units_sold': pd.Series([], dtype='int64'),
+                                         'currency_code': pd.Series([], dtype=object)}))
+    assert profile.columns['nulls'].tolist() == [0, 0]
+    assert profile.columns['distinct'].tolist() == [0, 0]
+    assert profile.numeric_summary().empty
+
+
+def test_all_null_column():
+    profile = TableProfile(pd.DataFrame({'units_sold': [1, 2, 3], 'note': [None, None, None]}))
+    assert profile.columns.loc['note', 'nulls'] == 3
+    assert profile.columns.loc['note', 'distinct'] == 0
+    assert profile.null_columns == ['note']
+    assert list(profile.numeric_summary().columns) == ['units_sold']
+
+
+def expected_null_handling(df, method):
+    if method == 'Drop Rows':
+        return df.dropna()
+    if method == 'Drop Columns':
+        return df.dropna(axis=1)
+    if method == 'Fill with 0':
+        return df.fillna(0)
+    if method == 'Fill with Mean':
+        return df.fillna(df.mean(numeric_only=True))
+    return df
+
+
+@pytest.mark.parametrize('method', NULL_METHODS)
+def test_null_handling_methods(df, method, monkeypatch):
+    # Small chunks, so Drop Rows has to scan several of them
+    monkeypatch.setattr(profiles, 'SCAN_CHUNK_ROWS', 16)
+    view = NullHandledView(df, TableProfile(df), method)
+    expected = expected_null_handling(df, method)
+    assert len(view) == len(expected)
+    assert view.columns == list(expected.columns)
+    pd.testing.assert_frame_equal(view.head(100), expected.head(100))
+
+
+@pytest.mark.parametrize('method', NULL_METHODS)
+def test_null_handling_of_all_null_and_empty_tables(method):
+    df = pd.DataFrame({'units_sold': [1.0, None, 3.0], 'note': pd.Series([None, None, None], dtype=object)})
+    view = NullHandledView(df, TableProfile(df), method)
+    expected = expected_null_handling(df, method)
+    assert len(view) == len(expected)
+    pd.testing.assert_frame_equal(view.head(10), expected.head(10))
+
+    empty = df.iloc[:0]
+    view = NullHandledView(empty, TableProfile(empty), method)
+    assert len(view) == 0
+    assert view.head(10).empty
+
+
+def test_unknown_method(df):
+    with pytest.raises(ValueError):
+        NullHandledView(df, TableProfile(df), 'Drop Everything')
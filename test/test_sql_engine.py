@@ -0,0 +1,46 @@
+import duckdb
+import pandas as pd
+import pytest
+
+from sql_engine import referenced_tables, run_sql
+
+
+@pytest.fixture
+def data():
+    return {
+        'fact_sales_order': pd.DataFrame({'sales_order_id': [1, 2, 3], 'currency_id': [1, 2, 1], 'units_sold': [5, 6, 7]}),
+        'dim_currency': pd.DataFrame({'currency_id': [1, 2], 'currency_code': ['GBP', 'USD']}),
+        'dim_staff': pd.DataFrame({'staff_id': [1], 'first_name': ['Ann']}),
+    }
+
+
+def test_join_using(data):
+    df, truncated = run_sql(data, "SELECT currency_code, SUM(units_sold) AS units FROM fact_sales_order "
+                                  "JOIN dim_currency USING (currency_id) GROUP BY currency_code ORDER BY currency_code")
+    assert df.to_dict('list') == {'currency_code': ['GBP', 'USD'], 'units': [12, 6]}
+    assert not truncated
+
+
+def test_natural_join(data):
+    df, _ = run_sql(data, "SELECT sales_order_id, currency_code FROM fact_sales_order NATURAL JOIN dim_currency "
+                          "ORDER BY sales_order_id")
+    assert df['currency_code'].tolist() == ['GBP', 'USD', 'GBP']
+
+
+def test_columns_expression(data):
+    df, _ = run_sql(data, "SELECT COLUMNS('currency_.*') FROM dim_currency ORDER BY currency_id")
+    assert list(df.columns) == ['currency_id', 'currency_code']
+
+
+def test_referenced_tables_ignores_strings_and_comments(data):
+    sql = """SELECT * FROM "Dim_Currency" c -- dim_staff
+             WHERE c.currency_code <> 'fact_sales_order'"""
+    assert referenced_tables(sql, data) == {'dim_currency'}
+
+
+def test_table_names_limits_the_tables_a_query_can_read(data):
+    data['agg_sales_by_currency'] = pd.DataFrame({'currency_id': [1], 'total_sales': [1.0]})
+    df, _ = run_sql(data, "SELECT COUNT(*) AS n FROM dim_currency", table_names=['dim_currency'])
+    assert df['n'].tolist() == [2]
+    with pytest.raises(duckdb.CatalogException):
+        run_sql(data, "SELECT * FROM agg_sales_by_currency", table_names=['dim_currency'])
@@ -0,0 +1,49 @@
+import json
+
+import pandas as pd
+import pytest
+
+from conftest import BUCKET_NAME
+from upload_to_s3 import HASH_METADATA_KEY, MANIFEST_NAME, upload_files_to_s3
+
+S3_FOLDER = 'db/parquet_files'
+
+
+@pytest.fixture
+def files(tmp_path):
+    paths = []
+    for table in ['dim_staff', 'dim_currency']:
+        path = tmp_path / f"{table}.parquet"
+        pd.DataFrame({'id': range(10)}).to_parquet(path)
+        paths.append(str(path))
+    return paths
+
+
+def statuses(results):
+    return {result['name']: result['status'] for result in results}
+
+
+def test_unchanged_files_are_not_uploaded_again(s3_client, files):
+    results = upload_files_to_s3(BUCKET_NAME, files, S3_FOLDER)
+    assert statuses(results) == {'dim_staff.parquet': 'uploaded', 'dim_currency.parquet': 'uploaded'}
+    uploaded = {result['name']: result for result in results}
+    head = s3_client.head_object(Bucket=BUCKET_NAME, Key=uploaded['dim_staff.parquet']['key'])
+    assert head['Metadata'][HASH_METADATA_KEY] == uploaded['dim_staff.parquet']['sha256']
+
+    pd.DataFrame({'id': range(20)}).to_parquet(files[0])
+    results = upload_files_to_s3(BUCKET_NAME, files, S3_FOLDER)
+    assert statuses(results) == {'dim_staff.parquet': 'uploaded', 'dim_currency.parquet': 'skipped'}
+    # The manifest keeps pointing at the earlier object of the unchanged file
+    manifest = json.loads(s3_client.get_object(Bucket=BUCKET_NAME, Key=f"{S3_FOLDER}/{MANIFEST_NAME}")['Body'].read())
+    assert manifest['tables']['dim_currency']['etag'] == uploaded['dim_currency.parquet']['etag']
+    assert manifest['tables']['dim_staff']['rows'] == 20
+
+
+def test_unchanged_files_are_skipped_without_a_manifest(s3_client, files):
+    upload_files_to_s3(BUCKET_NAME, files, S3_FOLDER, update_manifest=False)
+    # Found by listing the folder and comparing the SHA-256 stored in the object metadata
+    results = upload_files_to_s3(BUCKET_NAME, files, S3_FOLDER, update_manifest=False)
+    assert statuses(results) == {'dim_staff.parquet': 'skipped', 'dim_currency.parquet': 'skipped'}
+
+    results = upload_files_to_s3(BUCKET_NAME, files, S3_FOLDER, skip_unchanged=False, update_manifest=False)
+    assert statuses(results) == {'dim_staff.parquet': 'uploaded', 'dim_currency.parquet': 'uploaded'}
@@ -0,0 +1,128 @@
+import io
+import os
+from datetime import date
+from decimal import Decimal
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+import pytest
+
+from writers import HIVE_NULL_PARTITION, PartitionedParquetWriter, TableWriter
+
+SCHEMA = pa.schema([
+    ('sales_order_id', pa.int64()),
+    ('currency_code', pa.dictionary(pa.int32(), pa.string())),
+    ('created_date', pa.date32()),
+    ('unit_price', pa.decimal128(10, 2)),
+])
+
+
+def batch(start, rows):
+    return pa.RecordBatch.from_pydict({
+        'sales_order_id': list(range(start, start + rows)),
+        'currency_code': pa.array([['GBP', 'USD', None][i % 3] for i in range(rows)]).dictionary_encode()
+                           .cast(SCHEMA.field('currency_code').type),
+        'created_date': [date(2024, 1 + i % 12, 1 + i % 28) for i in range(start, start + rows)],
+        'unit_price': [Decimal(f"{i % 1000}.{i % 100:02d}") for i in range(rows)],
+    }, schema=SCHEMA)
+
+
+@pytest.fixture
+def batches():
+    return [batch(0, 50), batch(50, 70)]
+
+
+def expected(batches):
+    return pa.Table.from_batches(batches).to_pandas()
+
+
+def test_parquet_round_trip(tmp_path, batches):
+    path = str(tmp_path / 'fact_sales_order.parquet')
+    with TableWriter({'parquet': path}, SCHEMA) as writer:
+        for record_batch in batches:
+            writer.write(record_batch)
+    table = pq.read_table(path)
+    assert table.schema.field('currency_code').type == SCHEMA.field('currency_code').type
+    pd.testing.assert_frame_equal(table.to_pandas(), expected(batches))
+
+
+def test_csv_round_trip(tmp_path, batches):
+    path = str(tmp_path / 'fact_sales_order.csv')
+    with TableWriter({'csv': path}, SCHEMA) as writer:
+        for record_batch in batches:
+            writer.write(record_batch)
+    # One header row, however many batches were written; the dictionary-encoded text is written as its values
+    column_types = {field.name: field.type.value_type if pa.types.is_dictionary(field.type) else field.type
+                    for field in SCHEMA}
+    table = pa_csv.read_csv(path, convert_options=pa_csv.ConvertOptions(column_types=column_types,
+                                                                        strings_can_be_null=True))
+    source = pa.Table.from_batches(batches)
+    assert table.num_rows == source.num_rows
+    for name in SCHEMA.names:
+        assert table.column(name).to_pylist() == source.column(name).to_pylist(), name
+
+
+def test_json_lines_round_trip(tmp_path, batches):
+    path = str(tmp_path / 'fact_sales_order.json')
+    with TableWriter({'json': path}, SCHEMA) as writer:
+        for record_batch in batches:
+            writer.write(record_batch)
+    with open(path, encoding="utf-8") as rfile:
+        lines = rfile.read().splitlines()
+    # One JSON object per line, the batches not glued together on one line
+    assert len(lines) == 120
+    df = pd.read_json(io.StringIO("\n".join(lines)), lines=True)
+    source = expected(batches)
+    assert df['sales_order_id'].tolist() == source['sales_order_id'].tolist()
+    assert df['currency_code'].fillna('').tolist() == source['currency_code'].astype(object).fillna('').tolist()
+    assert df['unit_price'].tolist() == [float(price) for price in source['unit_price']]
+
+
+def test_every_format_at_once(tmp_path, batches):
+    output_files = {'parquet': str(tmp_path / 't.parquet'), 'csv': str(tmp_path / 't.csv'), 'json': str(tmp_path / 't.json')}
+    with TableWriter(output_files, SCHEMA) as writer:
+        for record_batch in batches:
+            writer.write(record_batch)
+    assert pq.read_table(output_files['parquet']).num_rows == 120
+    assert pa_csv.read_csv(output_files['csv']).num_rows == 120
+    assert len(pd.read_json(output_files['json'], lines=True)) == 120
+
+
+def test_unknown_format(tmp_path):
+    with pytest.raises(ValueError):
+        TableWriter({'xml': str(tmp_path / 't.xml')}, SCHEMA)
+
+
+def test_partitioned_parquet_layout(tmp_path, batches):
+    base_dir = str(tmp_path / 'fact_sales_order')
+    writer = PartitionedParquetWriter(base_dir, SCHEMA, 'created_date', row_group_size=16, max_buffered_rows=48)
+    for record_batch in batches:
+        writer.write(record_batch)
+    writer.write(pa.RecordBatch.from_pydict({**batch(120, 1).to_pydict(), 'created_date': [None]}, schema=SCHEMA))
+    writer.close()
+
+    partitions = sorted(os.path.relpath(os.path.join(root, name), base_dir)
+                        for root, _, names in os.walk(base_dir) for name in names)
+    assert partitions == sorted([f"year=2024/month={month}/part-0.parquet" for month in range(1, 13)]
+                                + [f"year={HIVE_NULL_PARTITION}/month={HIVE_NULL_PARTITION}/part-0.parquet"])
+    assert not os.path.exists(f"{base_dir}.tmp")
+
+    march = pq.read_table(os.path.join(base_dir, 'year=2024', 'month=3', 'part-0.parquet'))
+    # The partition columns are only in the paths
+    assert march.schema.names == SCHEMA.names
+    assert {created.month for created in march.column('created_date').to_pylist()} == {3}
+
+    table = ds.dataset(base_dir, format='parquet', partitioning='hive').to_table()
+    assert table.num_rows == 121
+    assert sorted(table.column('sales_order_id').to_pylist()) == list(range(121))
+
+
+def test_partitioned_parquet_abort(tmp_path, batches):
+    base_dir = str(tmp_path / 'fact_sales_order')
+    writer = PartitionedParquetWriter(base_dir, SCHEMA, 'created_date')
+    writer.write(batches[0])
+    writer.abort()
+    assert not os.path.exists(base_dir) and not os.path.exists(f"{base_dir}.tmp")
@@ -0,0 +1,155 @@
+import hashlib
+import logging
+import os
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+logger = logging.getLogger('aggregates')
+logger.setLevel(logging.INFO)
+
+FACT_TABLE = 'fact_sales_order'
+DATE_COLUMN = 'created_date'
+MEASURE_COLUMNS = ['units_sold', 'unit_price']
+
+# Summary table -> fact foreign keys it totals units_sold * unit_price by. Each summary is written
+# twice: as totals per key, and with DAILY_SUFFIX as totals per key and created_date
+SUMMARIES = {
+    'agg_sales_by_staff_location': ['sales_staff_id', 'agreed_delivery_location_id'],
+    'agg_sales_by_design': ['design_id'],
+    'agg_sales_by_currency': ['currency_id'],
+}
+DAILY_SUFFIX = '_daily'
+
+# Parquet metadata naming the fact table a summary was computed from, and its fingerprint
+SOURCE_TABLE_KEY = b'source_table'
+SOURCE_FINGERPRINT_KEY = b'source_fingerprint'
+
+# Fact rows aggregated at a time; the partial totals are combined whenever they exceed COMBINE_ROWS
+DEFAULT_BATCH_SIZE = 1024 * 1024
+COMBINE_ROWS = 1024 * 1024
+
+# Empty totals are 0 rather than null, as in the dashboard's groupby().sum()
+SUM_OPTIONS = pc.ScalarAggregateOptions(min_count=0)
+
+
+def file_sha256(file_path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def source_fingerprint(fact_path):
+    """
+    Fingerprints the parquet file, or partitioned directory, of the fact table.
+
+    The fingerprint is a SHA-256 over the path of every file inside the table directory ('' for a
+    single file) and the file's own SHA-256: the values the uploader records in latest.json, so the
+    dashboard can tell from the manifest alone whether a summary matches the fact table it has.
+
+    Returns:
+    - str: The hex digest
+    """
+    if os.path.isdir(fact_path):
+        files = []
+        for root, _, file_names in os.walk(fact_path):
+            for file_name in file_names:
+                if file_name.endswith('.parquet'):
+                    file_path = os.path.join(root, file_name)
+                    files.append((os.path.relpath(file_path, fact_path).replace(os.sep, '/'), file_sha256(file_path)))
+    else:
+        files = [('', file_sha256(fact_path))]
+
+    digest = hashlib.sha256()
+    for path, sha256 in sorted(files):
+        digest.update(f"{path}:{sha256}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _aggregate(table, keys, combine=False):
+    """
+    Totals sales per keys, from fact rows (sales_amount) or from partial totals (combine=True).
+    """
+    if combine:
+        aggregations = [('total_sales_amount', 'sum', SUM_OPTIONS), ('sales_count', 'sum')]
+    else:
+        aggregations = [('sales_amount', 'sum', SUM_OPTIONS), ('sales_amount', 'count', pc.CountOptions(mode='all'))]
+    # Single-threaded, so the totals, and the files, are the same from one run to the next
+    result = table.group_by(keys, use_threads=False).aggregate(aggregations)
+    return result.rename_columns([*keys, 'total_sales_amount', 'sales_count']).select([*keys, 'total_sales_amount', 'sales_count'])
+
+
+def _with_sales_amount(table):
+    amount = pc.multiply(pc.cast(table['units_sold'], pa.float64()), pc.cast(table['unit_price'], pa.float64()))
+    return table.append_column('sales_amount', amount)
+
+
+def compute_summaries(fact_path, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Computes the daily summaries of the fact table in one pass over its batches.
+
+    Parameters:
+    - fact_path: str: The fact table's parquet file or partitioned directory
+    - batch_size: int: Fact rows read at a time; memory depends on this and on the number of groups,
+      not on the size of the fact table
+
+    Returns:
+    - dict: summary name -> pyarrow Table with created_date, the keys, total_sales_amount and sales_count
+    """
+    dataset = ds.dataset(fact_path, format='parquet')
+    key_columns = list(dict.fromkeys(key for keys in SUMMARIES.values() for key in keys))
+    missing = [column for column in [DATE_COLUMN, *MEASURE_COLUMNS, *key_columns] if column not in dataset.schema.names]
+    if missing:
+        raise ValueError(f"{FACT_TABLE} has no column {', '.join(missing)}")
+
+    columns = [DATE_COLUMN, *MEASURE_COLUMNS, *key_columns]
+    # Start from an empty table, so an empty fact table still gives (empty) summaries with the right schema
+    empty = _with_sales_amount(pa.schema([dataset.schema.field(column) for column in columns]).empty_table())
+    partials = {name: [_aggregate(empty, [DATE_COLUMN, *keys])] for name, keys in SUMMARIES.items()}
+    for batch in dataset.to_batches(columns=columns, batch_size=batch_size):
+        table = _with_sales_amount(pa.Table.from_batches([batch]))
+        for name, keys in SUMMARIES.items():
+            partials[name].append(_aggregate(table, [DATE_COLUMN, *keys]))
+            if sum(partial.num_rows for partial in partials[name]) > COMBINE_ROWS:
+                partials[name] = [_aggregate(pa.concat_tables(partials[name]), [DATE_COLUMN, *keys], combine=True)]
+
+    summaries = {}
+    for name, keys in SUMMARIES.items():
+        daily = _aggregate(pa.concat_tables(partials[name]), [DATE_COLUMN, *keys], combine=True)
+        summaries[name] = daily.sort_by([(column, 'ascending') for column in [DATE_COLUMN, *keys]])
+    return summaries
+
+
+def write_summaries(fact_path, output_dir, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Writes every summary of SUMMARIES to output_dir as <name>.parquet (totals per key) and
+    <name>_daily.parquet (totals per key and created_date).
+
+    The files carry the fingerprint of the fact table they were computed from in their metadata.
+    Each file is written under a temporary name and renamed into place.
+
+    Parameters:
+    - fact_path: str: The fact table's parquet file or partitioned directory
+    - output_dir: str: Directory to write the summaries to
+    - batch_size: int: Fact rows read at a time
+
+    Returns:
+    - dict: summary file name (without .parquet) -> number of rows
+    """
+    metadata = {SOURCE_TABLE_KEY: FACT_TABLE.encode("utf-8"), SOURCE_FINGERPRINT_KEY: source_fingerprint(fact_path).encode("utf-8")}
+
+    rows = {}
+    for name, daily in compute_summaries(fact_path, batch_size).items():
+        keys = SUMMARIES[name]
+        totals = _aggregate(daily, keys, combine=True).sort_by([(key, 'ascending') for key in keys])
+        for file_name, table in ((name, totals), (f"{name}{DAILY_SUFFIX}", daily)):
+            path = os.path.join(output_dir, f"{file_name}.parquet")
+            pq.write_table(table.replace_schema_metadata(metadata), f"{path}.tmp")
+            os.replace(f"{path}.tmp", path)
+            rows[file_name] = table.num_rows
+    logger.info(f"Wrote {len(rows)} summaries of {fact_path} to {output_dir}")
+    return rows
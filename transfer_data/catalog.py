@@ -0,0 +1,104 @@
+import pyarrow as pa
+
+# Postgres information_schema data_type -> Arrow type written to parquet.
+# Text is dictionary encoded: warehouse text columns repeat a small set of values, and readers
+# get pandas categoricals instead of object columns.
+PG_ARROW_TYPES = {
+    'smallint': pa.int16(),
+    'integer': pa.int32(),
+    'bigint': pa.int64(),
+    'real': pa.float32(),
+    'double precision': pa.float64(),
+    'boolean': pa.bool_(),
+    'text': pa.dictionary(pa.int32(), pa.string()),
+    'character varying': pa.dictionary(pa.int32(), pa.string()),
+    'character': pa.dictionary(pa.int32(), pa.string()),
+    'date': pa.date32(),
+    'time without time zone': pa.time64('us'),
+    'timestamp without time zone': pa.timestamp('us'),
+    'timestamp with time zone': pa.timestamp('us', tz='UTC'),
+}
+
+
+def get_catalog(conn, schema):
+    """
+    Fetches the columns of every table in a schema with a single catalog query
+
+    Parameters:
+    - conn: pg8000 Connection
+    - schema: str: The schema name
+
+    Returns:
+    - dict: table name -> list of column dicts (name, data_type, precision, scale, primary_key)
+      in ordinal_position order, i.e. the order of SELECT *
+    """
+    query = """
+    SELECT c.table_name, c.column_name, c.data_type, c.numeric_precision, c.numeric_scale,
+           pk.column_name IS NOT NULL AS is_primary_key
+    FROM information_schema.columns c
+    JOIN information_schema.tables t
+        ON t.table_schema = c.table_schema AND t.table_name = c.table_name AND t.table_type = 'BASE TABLE'
+    LEFT JOIN (
+        SELECT kcu.table_name, kcu.column_name
+        FROM information_schema.table_constraints tc
+        JOIN information_schema.key_column_usage kcu
+            ON tc.constraint_name = kcu.constraint_name AND tc.table_schema = kcu.table_schema
+        WHERE tc.constraint_type = 'PRIMARY KEY' AND tc.table_schema = :schema
+    ) pk ON pk.table_name = c.table_name AND pk.column_name = c.column_name
+    WHERE c.table_schema = :schema
+    ORDER BY c.table_name, c.ordinal_position
+    """
+    catalog = {}
+    for table, column, data_type, precision, scale, is_primary_key in conn.run(query, schema=schema):
+        catalog.setdefault(table, []).append({
+            'name': column,
+            'data_type': data_type,
+            'precision': precision,
+            'scale': scale,
+            'primary_key': is_primary_key,
+        })
+    return catalog
+
+
+def primary_key(columns):
+    """
+    Returns the name of the single-column primary key, or None for no or a composite primary key.
+    """
+    keys = [column['name'] for column in columns if column['primary_key']]
+    return keys[0] if len(keys) == 1 else None
+
+
+def arrow_type(column):
+    """
+    Maps a catalog column to an Arrow type, or None when the type has to be inferred from the data
+    (unconstrained numeric and types without a mapping).
+    """
+    if column['data_type'] == 'numeric':
+        if column['precision'] is None:
+            return None
+        return pa.decimal128(column['precision'], column['scale'] or 0)
+    return PG_ARROW_TYPES.get(column['data_type'])
+
+
+def arrow_schema(columns, sample=None):
+    """
+    Builds the Arrow schema for a table from its catalog columns.
+
+    Parameters:
+    - columns: list: Catalog columns as returned by get_catalog
+    - sample: dict: Optional column name -> list of values, used for columns whose type is not in
+      the catalog mapping; such columns become strings when there is nothing to infer from
+
+    Returns:
+    - pyarrow.Schema
+    """
+    fields = []
+    for column in columns:
+        type_ = arrow_type(column)
+        if type_ is None:
+            values = (sample or {}).get(column['name'])
+            type_ = pa.array(values).type if values else pa.null()
+            if pa.types.is_null(type_):
+                type_ = pa.string()
+        fields.append(pa.field(column['name'], type_))
+    return pa.schema(fields)
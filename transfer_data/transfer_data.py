@@ -1,14 +1,62 @@
 import pandas as pd
-from pg8000.native import Connection
+from pg8000.native import Connection, identifier
 import os
+import sys
+import json
+import logging
+import argparse
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import date, datetime, time
+from decimal import Decimal
+from time import perf_counter
 from dotenv import load_dotenv
 import pyarrow as pa
+import pyarrow.compute as pc
 import pyarrow.parquet as pq
 
+from catalog import get_catalog, primary_key, arrow_schema
+from writers import TableWriter, OUTPUT_FORMATS, DEFAULT_FORMATS
+from aggregates import FACT_TABLE, write_summaries
+# instrumentation.py is shared with the dashboard and kept in streamlit_app/ only; appended, so
+# this directory's own modules still come first
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'streamlit_app'))
+from instrumentation import configure as configure_spans, registry as span_registry, span, in_context  # noqa: E402
+
+logger = logging.getLogger('transfer_data')
+logger.setLevel(logging.INFO)
+
+ch = logging.StreamHandler()
+ch.setLevel(logging.INFO)
+
+formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+ch.setFormatter(formatter)
+
+logger.addHandler(ch)
+
 load_dotenv()
 # Establish connection to PostgreSQL
 # conn = Connection(user="your_user", password="your_password", database="your_database", host="your_host", port=your_port)
 
+SCHEMA = 'project_team_7'
+
+# Column preferred as the incremental watermark; tables without it fall back to their primary key
+WATERMARK_COLUMN = 'last_updated'
+
+# Rows fetched per round-trip in streaming mode; peak memory is proportional to this, not to the table size
+DEFAULT_BATCH_SIZE = 50_000
+
+# Tables written as hive-partitioned parquet (year=YYYY/month=M), by the date column the partitions come from.
+# The fact table is the only large one, and the dashboard mostly reads its recent months
+PARTITIONED_TABLES = {'fact_sales_order': 'created_date'}
+
+# Timing spans are appended to SPANS_JSONL_FILE as JSON lines ('-' for stdout), and their counters written to
+# METRICS_FILE in the Prometheus text format at the end of the run
+SPANS_JSONL_FILE = os.getenv("SPANS_JSONL_FILE")
+METRICS_FILE = os.getenv("METRICS_FILE")
+
 def get_connection():
     return Connection(
             user=os.getenv("POSTGRES_USERNAME"),
@@ -18,6 +66,46 @@ def get_connection():
             port=int(os.getenv("POSTGRES_PORT")),
         )
 
+class ConnectionPool:
+    """
+    Small fixed-size pool of pg8000 connections, opened on first use.
+
+    pg8000 connections are not thread safe, so each worker holds one connection for the duration of
+    a table. At most `size` connections are checked out at once; a connection that raised an error
+    is closed instead of being returned, and the next worker opens a fresh one.
+    """
+
+    def __init__(self, size, connect=None):
+        self.size = size
+        self._connect = connect or get_connection
+        self._slots = threading.BoundedSemaphore(size)
+        self._idle = queue.LifoQueue()
+
+    @contextmanager
+    def connection(self):
+        with self._slots:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                conn = self._connect()
+            try:
+                yield conn
+            except Exception:
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+                raise
+            self._idle.put(conn)
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
 def get_tables_in_database():
     # Connect to your PostgreSQL database
     conn = get_connection()
@@ -38,13 +126,13 @@ def get_tables_in_database():
 
     # Execute the query
     result = conn.run(query)
-    
+
     # Close the connection
     conn.close()
-    
+
     # Extract table names from the result
     tables = [row[0] for row in result]
-    
+
     return tables
 
 # Base directory for saving files
@@ -57,56 +145,448 @@ formats_dirs = {
     'json': os.path.join(base_dir, 'json_files/tmp')
 }
 
+# Delta files from incremental runs are kept next to the full parquet snapshots
+delta_dir = os.path.join(formats_dirs['parquet'], 'delta')
 
-# Ensure that all format directories exist
-for dir_path in formats_dirs.values():
-    os.makedirs(dir_path, exist_ok=True)
+# Last extracted watermark value per table
+watermarks_file = os.path.join(base_dir, 'watermarks.json')
 
 
+def ensure_output_dirs(formats=DEFAULT_FORMATS):
+    # Ensure that the directories of the selected formats exist
+    for dir_path in [*(formats_dirs[output_format] for output_format in formats), delta_dir]:
+        os.makedirs(dir_path, exist_ok=True)
 
-tables = get_tables_in_database()
-# print(tables)
 
-conn = get_connection()
-for table in tables:
-    # Query to fetch the table data
-    query = f'SELECT * FROM project_team_7.{table}'
-    
-    # Execute the query using connection.run and convert the result to a DataFrame
-    result = conn.run(query)
-    
-    # Manually fetch the column names
-    col_query = f"""
-    SELECT column_name
-    FROM information_schema.columns
-    WHERE table_schema = 'project_team_7' AND table_name = '{table}'
-    """
-    col_result = conn.run(col_query)
-    columns = [row[0] for row in col_result]
-    
+def get_partition_column(table, columns):
+    """
+    Returns the date column a table's parquet output is partitioned by, or None for a single file.
+    """
+    partition_column = PARTITIONED_TABLES.get(table)
+    if any(column['name'] == partition_column for column in columns):
+        return partition_column
+    return None
+
+
+def get_watermark_column(columns):
+    """
+    Picks the column used to find new rows: last_updated if the table has it, otherwise the primary key.
+
+    Parameters:
+    - columns: list: The table's catalog columns
+    """
+    if any(column['name'] == WATERMARK_COLUMN for column in columns):
+        return WATERMARK_COLUMN
+    return primary_key(columns)
+
+
+def load_watermarks(path=watermarks_file):
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as rfile:
+        return json.load(rfile)
+
+
+def save_watermarks(watermarks, path=watermarks_file):
+    # Write to a temporary file first so an interrupted run never leaves a truncated state file
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding="utf-8") as wfile:
+        json.dump(watermarks, wfile, indent=4)
+    os.replace(tmp_path, path)
+
+
+def to_watermark_value(value):
+    """
+    Converts a column value to something JSON can store and Postgres can compare against.
+    """
+    if isinstance(value, (datetime, date, time)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    if hasattr(value, 'item'):
+        return value.item()
+    return value
+
+
+def table_query(table, watermark_column=None, watermark_value=None):
+    """
+    Builds the SELECT for a table, restricted to rows above watermark_value when one is given.
+
+    Returns:
+    - tuple: (query, dict of query parameters)
+    """
+    if watermark_column is None or watermark_value is None:
+        # Query to fetch the table data
+        return f'SELECT * FROM {identifier(SCHEMA)}.{identifier(table)}', {}
+    query = f"""
+    SELECT * FROM {identifier(SCHEMA)}.{identifier(table)}
+    WHERE {identifier(watermark_column)} > :watermark
+    ORDER BY {identifier(watermark_column)}
+    """
+    return query, {'watermark': watermark_value}
+
+
+def fetch_rows(conn, table, columns, watermark_column=None, watermark_value=None):
+    """
+    Fetches the rows of a table, or only those whose watermark column is greater than watermark_value.
+
+    Parameters:
+    - columns: list: The table's catalog columns, in SELECT * order
+    """
+    query, params = table_query(table, watermark_column, watermark_value)
+    with span('extract.fetch', table=table) as attributes:
+        result = conn.run(query, **params)
+        attributes['rows'] = len(result)
+
     # Convert the result to a pandas DataFrame
-    df = pd.DataFrame(result, columns=columns)
-    
+    return pd.DataFrame(result, columns=[column['name'] for column in columns])
+
+
+def to_arrow(df, columns):
+    """
+    Converts extracted rows to an Arrow table with the schema derived from the catalog,
+    instead of leaving the column types to pandas inference.
+    """
+    schema = arrow_schema(columns, {column: df[column].head(1000).tolist() for column in df.columns})
+    return pa.Table.from_pandas(df, schema=schema, preserve_index=False)
+
+
+def write_table(df, table, columns, formats=DEFAULT_FORMATS):
+    """
+    Writes the extracted rows in the selected formats, all encoded in parallel from one Arrow table.
+    """
     # Convert DataFrame to Arrow Table
-    table_arrow = pa.Table.from_pandas(df)
-    
-   # Define the file paths for each format
-    parquet_file = os.path.join(formats_dirs['parquet'], f'{table}.parquet')
-    csv_file = os.path.join(formats_dirs['csv'], f'{table}.csv')
-    json_file = os.path.join(formats_dirs['json'], f'{table}.json')
-
-
-    # Write the table to a Parquet file
-    pq.write_table(table_arrow, parquet_file)
-
-    # Write the table to a CSV file
-    df.to_csv(csv_file, index=False)
-    
-    # Write the table to an Excel file
-    # df.to_excel(f'{table}.xlsx', index=False)
-
-    # Write the table to a JSON file
-    df.to_json(json_file, orient='records', lines=True)
- 
-# Close the connection
-conn.close()
\ No newline at end of file
+    with span('extract.convert', table=table, rows=len(df)):
+        table_arrow = to_arrow(df, columns)
+
+    partition_column = get_partition_column(table, columns)
+    output_files = output_files_for(table, formats, partitioned=partition_column is not None)
+    with span('extract.write', table=table, rows=table_arrow.num_rows, formats=list(formats)):
+        with TableWriter(output_files, table_arrow.schema, partition_column) as writer:
+            writer.write(table_arrow)
+
+
+def iter_row_batches(conn, query, batch_size=DEFAULT_BATCH_SIZE, params=None):
+    """
+    Runs a query through a server-side cursor and yields its rows batch_size rows at a time.
+
+    The first batch is always yielded, even when empty, so callers can still write an empty file.
+
+    Yields:
+    - list: rows
+    """
+    conn.run("START TRANSACTION READ ONLY")
+    try:
+        conn.run(f"DECLARE extract_cursor NO SCROLL CURSOR FOR {query}", **(params or {}))
+        first = True
+        while True:
+            with span('extract.fetch', batch_size=batch_size) as attributes:
+                rows = conn.run(f"FETCH FORWARD {int(batch_size)} FROM extract_cursor")
+                attributes['rows'] = len(rows)
+            if rows or first:
+                yield rows
+            if len(rows) < batch_size:
+                break
+            first = False
+        conn.run("CLOSE extract_cursor")
+    finally:
+        # The transaction is read-only, so ending it with a rollback is always safe
+        conn.run("ROLLBACK")
+
+
+def rows_to_record_batch(rows, schema):
+    columns = list(zip(*rows)) if rows else [()] * len(schema)
+    arrays = [pa.array(values, type=field.type) for values, field in zip(columns, schema)]
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+def write_streaming(conn, query, output_files, columns, batch_size=DEFAULT_BATCH_SIZE, params=None,
+                    watermark_column=None, keep_empty=True, partition_column=None):
+    """
+    Streams a query result into files in fixed-size batches, so memory stays flat whatever the table size.
+
+    Each batch is converted straight to an Arrow record batch and appended to every output file
+    (one parquet row group per batch).
+
+    Parameters:
+    - conn: pg8000 Connection
+    - query: str: The SELECT to stream
+    - output_files: dict: format ('parquet', 'csv', 'json') -> file path
+    - columns: list: The table's catalog columns, used for the Arrow schema
+    - batch_size: int: Rows per batch
+    - params: dict: Query parameters
+    - watermark_column: str: Optional column whose maximum value is returned
+    - keep_empty: bool: Write the files even when the query returns no rows
+    - partition_column: str: Optional date column to partition the parquet output by
+
+    Returns:
+    - tuple: (number of rows written, maximum of watermark_column or None)
+    """
+    writer = None
+    rows_written = 0
+    watermark_max = None
+
+    try:
+        for rows in iter_row_batches(conn, query, batch_size, params):
+            if not rows and not keep_empty:
+                break
+            if writer is None:
+                sample = {column['name']: [row[i] for row in rows[:1000]] for i, column in enumerate(columns)}
+                schema = arrow_schema(columns, sample)
+                writer = TableWriter(output_files, schema, partition_column)
+
+            with span('extract.convert', rows=len(rows)):
+                batch = rows_to_record_batch(rows, schema)
+            del rows
+            with span('extract.write', rows=batch.num_rows, formats=list(output_files)):
+                writer.write(batch)
+
+            if watermark_column is not None and batch.num_rows:
+                batch_max = pc.max(batch.column(watermark_column)).as_py()
+                if batch_max is not None and (watermark_max is None or batch_max > watermark_max):
+                    watermark_max = batch_max
+
+            rows_written += batch.num_rows
+    except Exception:
+        if writer is not None:
+            writer.abort()
+        raise
+    if writer is not None:
+        writer.close()
+
+    return rows_written, watermark_max
+
+
+def output_files_for(table, formats=DEFAULT_FORMATS, partitioned=False):
+    # Define the file paths for each format
+    output_files = {output_format: os.path.join(formats_dirs[output_format], f'{table}.{output_format}') for output_format in formats}
+    if partitioned and 'parquet' in output_files:
+        # Partitioned parquet is a directory named after the table
+        output_files['parquet'] = os.path.join(formats_dirs['parquet'], table)
+    return output_files
+
+
+def update_watermark(watermarks, table, watermark_column, value):
+    if watermark_column is not None and value is not None and not pd.isna(value):
+        watermarks[table] = {'column': watermark_column, 'value': to_watermark_value(value)}
+
+
+def extract_full(conn, table, columns, watermarks=None, batch_size=None, formats=DEFAULT_FORMATS):
+    """
+    Writes a full snapshot of the table in the selected formats. Tables in PARTITIONED_TABLES are
+    written as a hive-partitioned parquet directory instead of a single parquet file.
+
+    Parameters:
+    - conn: pg8000 Connection
+    - table: str: The table name
+    - columns: list: The table's catalog columns
+    - watermarks: dict: Optional table -> {'column', 'value'}; updated in place so a later
+      incremental run continues from this snapshot
+    - batch_size: int: Stream the table in batches of this many rows instead of loading it whole
+    - formats: tuple: Output formats, any of 'parquet', 'csv' and 'json'
+
+    Returns:
+    - int: The number of rows extracted
+    """
+    watermark_column = get_watermark_column(columns) if watermarks is not None else None
+
+    if batch_size:
+        query, params = table_query(table)
+        partition_column = get_partition_column(table, columns)
+        output_files = output_files_for(table, formats, partitioned=partition_column is not None)
+        rows, watermark_max = write_streaming(conn, query, output_files, columns, batch_size, params,
+                                              watermark_column, partition_column=partition_column)
+    else:
+        df = fetch_rows(conn, table, columns)
+        write_table(df, table, columns, formats)
+        rows = len(df)
+        watermark_max = df[watermark_column].max() if watermark_column and rows else None
+    logger.info(f"Extracted full snapshot of {table}: {rows} rows")
+
+    if watermarks is not None:
+        update_watermark(watermarks, table, watermark_column, watermark_max)
+    return rows
+
+
+def extract_incremental(conn, table, columns, watermarks, run_id, batch_size=None, formats=DEFAULT_FORMATS):
+    """
+    Writes only the rows newer than the table's watermark to a delta parquet file and advances the watermark.
+
+    A table without a stored watermark, or without a usable watermark column, gets a full snapshot instead.
+
+    Parameters:
+    - conn: pg8000 Connection
+    - table: str: The table name
+    - columns: list: The table's catalog columns
+    - watermarks: dict: table -> {'column', 'value'}, updated in place
+    - run_id: str: Timestamp used to name the delta file
+    - batch_size: int: Stream the rows in batches of this many rows instead of loading them whole
+    - formats: tuple: Output formats of the full snapshot, if one has to be taken; deltas are always parquet
+
+    Returns:
+    - int: The number of rows extracted
+    """
+    watermark_column = get_watermark_column(columns)
+    previous = watermarks.get(table)
+
+    if watermark_column is None or previous is None or previous.get('column') != watermark_column:
+        logger.info(f"No watermark for {table}, extracting full snapshot")
+        return extract_full(conn, table, columns, watermarks, batch_size, formats)
+
+    delta_file = os.path.join(delta_dir, f'{table}_{run_id}.parquet')
+    if batch_size:
+        query, params = table_query(table, watermark_column, previous['value'])
+        rows, watermark_max = write_streaming(conn, query, {'parquet': delta_file}, columns, batch_size, params,
+                                              watermark_column, keep_empty=False)
+    else:
+        df = fetch_rows(conn, table, columns, watermark_column, previous['value'])
+        rows = len(df)
+        watermark_max = df[watermark_column].max() if rows else None
+        if rows:
+            pq.write_table(to_arrow(df, columns), delta_file)
+
+    if rows:
+        logger.info(f"Extracted {rows} new rows of {table} to {delta_file}")
+    else:
+        logger.info(f"No new rows in {table} since {watermark_column} = {previous['value']}")
+
+    update_watermark(watermarks, table, watermark_column, watermark_max)
+    return rows
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Transfer the project_team_7 tables from PostgreSQL to local files.")
+    parser.add_argument(
+        '--mode', choices=['full', 'incremental'], default='full',
+        help="'full' re-extracts every table (default); 'incremental' only extracts rows newer than "
+             "each table's watermark and writes them as delta parquet files"
+    )
+    parser.add_argument('--tables', nargs='+', help="Only extract these tables")
+    parser.add_argument(
+        '--formats', nargs='+', choices=OUTPUT_FORMATS,
+        default=os.getenv("TRANSFER_FORMATS", ",".join(DEFAULT_FORMATS)).split(","),
+        help="Output formats to write (default: parquet, or the comma-separated TRANSFER_FORMATS variable); "
+             "extra formats are encoded in parallel from the same Arrow table"
+    )
+    parser.add_argument(
+        '--stream', action='store_true',
+        help="Read tables through a server-side cursor in batches and append them to the output files, "
+             "keeping memory flat regardless of table size"
+    )
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help="Rows per batch in --stream mode")
+    parser.add_argument(
+        '--workers', type=int, default=1,
+        help="Number of tables extracted at the same time, each on its own database connection"
+    )
+    parser.add_argument(
+        '--skip-summaries', action='store_true',
+        help=f"Do not rebuild the pre-aggregated sales summaries after extracting {FACT_TABLE}"
+    )
+    return parser.parse_args(argv)
+
+
+def extract_table(pool, table, columns, args, watermarks, watermarks_lock, run_id):
+    """
+    Extracts one table on its own pooled connection and reports the outcome instead of raising,
+    so a failing table does not stop the others.
+
+    Returns:
+    - dict: table, rows, seconds and error (None on success)
+    """
+    start = perf_counter()
+    batch_size = args.batch_size if args.stream else None
+    # Each worker only reads and writes its own table's entry; the shared dict is only touched under the lock
+    with watermarks_lock:
+        table_watermarks = {table: watermarks[table]} if table in watermarks else {}
+    try:
+        if columns is None:
+            raise ValueError(f"Table {table} not found in schema {SCHEMA}")
+        with span('extract.table', table=table, mode=args.mode) as attributes, pool.connection() as conn:
+            if args.mode == 'incremental':
+                rows = extract_incremental(conn, table, columns, table_watermarks, run_id, batch_size, args.formats)
+            else:
+                rows = extract_full(conn, table, columns, table_watermarks, batch_size, args.formats)
+            attributes['rows'] = rows
+    except Exception as e:
+        logger.error(f"Failed to extract {table}: {e}")
+        return {'table': table, 'rows': None, 'seconds': perf_counter() - start, 'error': str(e)}
+
+    with watermarks_lock:
+        if table in table_watermarks:
+            watermarks[table] = table_watermarks[table]
+        # Persist after every table so a later failure does not lose earlier progress
+        save_watermarks(watermarks)
+
+    seconds = perf_counter() - start
+    logger.info(f"{table}: {rows} rows in {seconds:.2f}s")
+    return {'table': table, 'rows': rows, 'seconds': seconds, 'error': None}
+
+
+def build_summaries():
+    """
+    Rebuilds the pre-aggregated sales summaries from the local parquet snapshot of the fact table,
+    reporting the outcome like extract_table does.
+
+    Returns:
+    - dict: table ('summaries'), rows (summary name -> rows), seconds and error (None on success)
+    """
+    start = perf_counter()
+    try:
+        partitioned_path = output_files_for(FACT_TABLE, ('parquet',), partitioned=True)['parquet']
+        fact_path = partitioned_path if os.path.isdir(partitioned_path) else output_files_for(FACT_TABLE, ('parquet',))['parquet']
+        with span('extract.summaries'):
+            rows = write_summaries(fact_path, formats_dirs['parquet'])
+    except Exception as e:
+        logger.error(f"Failed to build the sales summaries: {e}")
+        return {'table': 'summaries', 'rows': None, 'seconds': perf_counter() - start, 'error': str(e)}
+    return {'table': 'summaries', 'rows': rows, 'seconds': perf_counter() - start, 'error': None}
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    ensure_output_dirs(args.formats)
+    configure_spans('extract', SPANS_JSONL_FILE)
+
+    watermarks = load_watermarks()
+    watermarks_lock = threading.Lock()
+    run_id = datetime.now().strftime("%Y%m%d%H%M%S")
+
+    # Tables are independent, so each one is extracted on its own connection from a small pool
+    pool = ConnectionPool(max(1, args.workers))
+    start = perf_counter()
+    try:
+        # Column names, types and primary keys of every table in one round-trip
+        with span('extract.catalog'), pool.connection() as conn:
+            catalog = get_catalog(conn, SCHEMA)
+
+        tables = args.tables or list(catalog)
+        # print(tables)
+
+        with ThreadPoolExecutor(max_workers=pool.size) as executor:
+            results = list(executor.map(
+                in_context(lambda table: extract_table(pool, table, catalog.get(table), args, watermarks, watermarks_lock, run_id)),
+                tables
+            ))
+    finally:
+        # Close the connections
+        pool.close()
+
+    failed = [result['table'] for result in results if result['error']]
+    logger.info(f"Extracted {len(tables) - len(failed)} of {len(tables)} tables in {perf_counter() - start:.2f}s")
+
+    # The summaries only change with the fact table's snapshot
+    if (not args.skip_summaries and 'parquet' in args.formats
+            and any(result['table'] == FACT_TABLE and not result['error'] for result in results)):
+        results.append(build_summaries())
+        if results[-1]['error']:
+            failed.append('summaries')
+    if failed:
+        logger.error(f"Failed tables: {', '.join(failed)}")
+    if METRICS_FILE:
+        span_registry.write_prometheus(METRICS_FILE)
+    return results
+
+
+if __name__ == "__main__":
+    if any(result['error'] for result in main()):
+        raise SystemExit(1)
@@ -0,0 +1,210 @@
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+
+OUTPUT_FORMATS = ('parquet', 'csv', 'json')
+
+# The uploader and the dashboard only read parquet
+DEFAULT_FORMATS = ('parquet',)
+
+# Rows per row group in partitioned parquet: big enough for fast column scans, small enough that the
+# row group statistics let a date filter skip most of a month
+DEFAULT_ROW_GROUP_SIZE = 128 * 1024
+
+# Rows buffered across all partitions of a PartitionedParquetWriter before the largest buffer is flushed
+DEFAULT_MAX_BUFFERED_ROWS = 4 * DEFAULT_ROW_GROUP_SIZE
+
+# Partition value used by hive layouts for rows whose date is null
+HIVE_NULL_PARTITION = '__HIVE_DEFAULT_PARTITION__'
+
+
+class PartitionedParquetWriter:
+    """
+    Writes a table as a hive-partitioned parquet directory with one partition per year and month of
+    a date column, e.g. base_dir/year=2024/month=3/part-0.parquet.
+
+    The partition columns are only in the paths, not in the files. Rows are buffered per partition
+    and written in row groups of row_group_size rows, however small the incoming batches are. When
+    rows arrive unsorted, so that many partitions are partly filled at once, the buffers together hold
+    at most max_buffered_rows: past that the largest one is written out as a smaller row group, so
+    memory stays flat however many months the table spans. The directory is built under a temporary
+    name and swapped in by close(), so the uploader never sees a half-written snapshot; abort()
+    discards it instead.
+    """
+
+    def __init__(self, base_dir, schema, date_column, row_group_size=DEFAULT_ROW_GROUP_SIZE,
+                 max_buffered_rows=DEFAULT_MAX_BUFFERED_ROWS):
+        """
+        Parameters:
+        - base_dir: str: The directory of the partitioned table
+        - schema: pyarrow.Schema: The schema of everything written
+        - date_column: str: The date or timestamp column the year and month come from
+        - row_group_size: int: Rows per parquet row group
+        - max_buffered_rows: int: Rows buffered across all partitions before the largest buffer is flushed
+        """
+        self.base_dir = base_dir
+        self.schema = schema
+        self.date_column = date_column
+        self.row_group_size = row_group_size
+        self.max_buffered_rows = max_buffered_rows
+        self._staging_dir = f"{base_dir}.tmp"
+        self._writers = {}
+        self._pending = {}
+        # Rows in each partition's buffer, and in all of them
+        self._pending_rows = {}
+        self._buffered_rows = 0
+
+        shutil.rmtree(self._staging_dir, ignore_errors=True)
+        os.makedirs(self._staging_dir)
+
+    def _partition_path(self, partition):
+        if partition is None:
+            year = month = HIVE_NULL_PARTITION
+        else:
+            year, month = divmod(partition, 100)
+        return os.path.join(self._staging_dir, f"year={year}", f"month={month}", "part-0.parquet")
+
+    def _flush(self, partition, final=False):
+        pending = pa.concat_tables(self._pending.pop(partition))
+        self._buffered_rows -= self._pending_rows.pop(partition)
+        # Only whole row groups are written until the partition is final
+        rows = pending.num_rows if final else pending.num_rows - pending.num_rows % self.row_group_size
+        if rows:
+            writer = self._writers.get(partition)
+            if writer is None:
+                path = self._partition_path(partition)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                writer = self._writers[partition] = pq.ParquetWriter(path, self.schema)
+            writer.write_table(pending.slice(0, rows), row_group_size=self.row_group_size)
+        if rows < pending.num_rows:
+            self._pending[partition] = [pending.slice(rows)]
+            self._pending_rows[partition] = pending.num_rows - rows
+            self._buffered_rows += pending.num_rows - rows
+
+    def write(self, data):
+        """
+        Splits a pyarrow Table or RecordBatch by year and month and appends each part to its partition.
+        """
+        table = pa.Table.from_batches([data]) if isinstance(data, pa.RecordBatch) else data
+        dates = table.column(self.date_column)
+        # year * 100 + month, null where the date is null
+        partitions = pc.add(pc.multiply(pc.year(dates), 100), pc.month(dates))
+
+        for partition in pc.unique(partitions).to_pylist():
+            mask = pc.is_null(partitions) if partition is None else pc.equal(partitions, partition)
+            part = table.filter(mask)
+            self._pending.setdefault(partition, []).append(part)
+            self._pending_rows[partition] = self._pending_rows.get(partition, 0) + part.num_rows
+            self._buffered_rows += part.num_rows
+            if self._pending_rows[partition] >= self.row_group_size:
+                self._flush(partition)
+
+        while self._buffered_rows > self.max_buffered_rows:
+            self._flush(max(self._pending_rows, key=self._pending_rows.get), final=True)
+
+    def close(self):
+        for partition in list(self._pending):
+            self._flush(partition, final=True)
+        if not self._writers:
+            # Keep an empty table readable: write its schema to the null partition
+            path = self._partition_path(None)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self._writers[None] = pq.ParquetWriter(path, self.schema)
+        for writer in self._writers.values():
+            writer.close()
+
+        shutil.rmtree(self.base_dir, ignore_errors=True)
+        os.replace(self._staging_dir, self.base_dir)
+
+    def abort(self):
+        for writer in self._writers.values():
+            writer.close()
+        shutil.rmtree(self._staging_dir, ignore_errors=True)
+
+
+class TableWriter:
+    """
+    Appends Arrow tables or record batches to one file per output format.
+
+    Every format is encoded from the same Arrow data: parquet through a ParquetWriter, csv through
+    Arrow's native CSV writer and json as JSON lines. When more than one format is written, each
+    write() encodes the formats in parallel threads; the parquet and csv writers release the GIL.
+    With a partition_column, the parquet output is a hive-partitioned directory instead of a single file.
+    """
+
+    def __init__(self, output_files, schema, partition_column=None):
+        """
+        Parameters:
+        - output_files: dict: format ('parquet', 'csv', 'json') -> file path (a directory for
+          partitioned parquet)
+        - schema: pyarrow.Schema: The schema of everything written
+        - partition_column: str: Optional date column to partition the parquet output by year and month
+        """
+        unknown = set(output_files) - set(OUTPUT_FORMATS)
+        if unknown:
+            raise ValueError(f"Unsupported output formats: {', '.join(sorted(unknown))}")
+
+        self.output_files = output_files
+        self._writers = {}
+        for output_format, path in output_files.items():
+            if output_format == 'parquet' and partition_column:
+                self._writers[output_format] = PartitionedParquetWriter(path, schema, partition_column)
+            elif output_format == 'parquet':
+                self._writers[output_format] = pq.ParquetWriter(path, schema)
+            elif output_format == 'csv':
+                self._writers[output_format] = pa_csv.CSVWriter(path, schema)
+            else:
+                self._writers[output_format] = open(path, 'w', encoding="utf-8")
+
+        self._executor = ThreadPoolExecutor(max_workers=len(output_files)) if len(output_files) > 1 else None
+
+    def _write(self, output_format, data):
+        writer = self._writers[output_format]
+        if output_format == 'json':
+            data.to_pandas().to_json(writer, orient='records', lines=True)
+        else:
+            writer.write(data)
+
+    def write(self, data):
+        """
+        Appends a pyarrow Table or RecordBatch to every output file.
+        """
+        if self._executor is None:
+            for output_format in self._writers:
+                self._write(output_format, data)
+            return
+        futures = [self._executor.submit(self._write, output_format, data) for output_format in self._writers]
+        for future in futures:
+            future.result()
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+        for writer in self._writers.values():
+            writer.close()
+
+    def abort(self):
+        """
+        Closes the output after a failure, discarding partitioned output rather than publishing it.
+        """
+        if self._executor is not None:
+            self._executor.shutdown()
+        for writer in self._writers.values():
+            if hasattr(writer, 'abort'):
+                writer.abort()
+            else:
+                writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.abort()
+        else:
+            self.close()
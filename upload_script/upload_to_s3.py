@@ -1,9 +1,24 @@
 import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+from botocore.exceptions import ClientError
 import os
+import sys
+import re
+import json
+import hashlib
+import pyarrow.parquet as pq
 import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime as dt
 from dotenv import load_dotenv
 
+# instrumentation.py is shared with the dashboard and kept in streamlit_app/ only; appended, so
+# this directory's own modules still come first
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'streamlit_app'))
+from instrumentation import configure as configure_spans, registry as span_registry, span, in_context  # noqa: E402
+
 
 
 logger = logging.getLogger('s3_uploader')
@@ -21,30 +36,360 @@ load_dotenv()
 
 BUCKET_NAME = os.environ.get("DATA_BUCKET_NAME")
 
+# Timing spans are appended to SPANS_JSONL_FILE as JSON lines ('-' for stdout, i.e. CloudWatch in the lambda), and
+# their counters written to METRICS_FILE in the Prometheus text format after each run
+SPANS_JSONL_FILE = os.environ.get("SPANS_JSONL_FILE")
+METRICS_FILE = os.environ.get("METRICS_FILE")
+
+
+
+# Files uploaded at the same time
+DEFAULT_MAX_WORKERS = 4
+
+# Multipart settings for each file: parts of 16 MB, up to 4 parts of a file in flight
+TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=16 * 1024 * 1024,
+    multipart_chunksize=16 * 1024 * 1024,
+    max_concurrency=4,
+)
+
+# Object metadata key holding the SHA-256 of the uploaded file
+HASH_METADATA_KEY = 'sha256'
+
+# Manifest written next to the daily folders, listing the latest object of every table
+MANIFEST_NAME = 'latest.json'
+
+# The YYYY/MM/DD folder of each upload run
+DATE_FOLDER = re.compile(r'^\d{4}/\d{2}/\d{2}/')
+
+# Pre-aggregated sales summaries written by transfer_data.py; uploaded when they exist
+SUMMARY_TABLES = [
+    'agg_sales_by_staff_location', 'agg_sales_by_staff_location_daily',
+    'agg_sales_by_design', 'agg_sales_by_design_daily',
+    'agg_sales_by_currency', 'agg_sales_by_currency_daily',
+]
+
+# Parquet metadata of a summary naming the fact table it was computed from, and that table's fingerprint
+SOURCE_TABLE_KEY = b'source_table'
+SOURCE_FINGERPRINT_KEY = b'source_fingerprint'
+
+
+def file_sha256(file_path, chunk_size=1024 * 1024):
+    """
+    Returns the hex SHA-256 of a file, read in chunks.
+    """
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as rfile:
+        for chunk in iter(lambda: rfile.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def upload_name(s3_key, s3_folder):
+    """
+    Returns the name a key was uploaded under, i.e. the key without s3_folder and the YYYY/MM/DD
+    folder: 'dim_staff.parquet' or 'fact_sales_order/year=2024/month=3/part-0.parquet'.
+    """
+    prefix = f"{s3_folder}/" if s3_folder else ""
+    return DATE_FOLDER.sub('', s3_key[len(prefix):], count=1)
+
+
+def find_latest_keys(s3_client, bucket_name, s3_folder, file_names):
+    """
+    Finds the most recent key of each upload name under s3_folder (keys are laid out as YYYY/MM/DD).
+
+    Returns:
+    - dict: upload name -> latest S3 key
+    """
+    prefix = f"{s3_folder}/" if s3_folder else ""
+    latest = {}
+    for page in s3_client.get_paginator('list_objects_v2').paginate(Bucket=bucket_name, Prefix=prefix):
+        for obj in page.get('Contents', []):
+            file_name = upload_name(obj['Key'], s3_folder)
+            if file_name in file_names and obj['Key'] > latest.get(file_name, ''):
+                latest[file_name] = obj['Key']
+    return latest
+
+
+def head_object(s3_client, bucket_name, s3_key):
+    """
+    Returns the head_object response for a key, or None if the object does not exist.
+    """
+    try:
+        return s3_client.head_object(Bucket=bucket_name, Key=s3_key)
+    except ClientError as e:
+        if e.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+            return None
+        raise
+
+
+def manifest_key(s3_folder):
+    return f"{s3_folder}/{MANIFEST_NAME}" if s3_folder else MANIFEST_NAME
+
+
+def read_manifest(s3_client, bucket_name, s3_folder):
+    """
+    Reads the latest.json manifest of s3_folder.
+
+    Returns:
+    - dict: The manifest, or None if there is none yet
+    """
+    with span('upload.read_manifest') as attributes:
+        try:
+            response = s3_client.get_object(Bucket=bucket_name, Key=manifest_key(s3_folder))
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+                attributes['found'] = False
+                return None
+            raise
+        body = response['Body'].read()
+        attributes.update(found=True, bytes=len(body))
+    return json.loads(body)
+
+
+def parquet_summary(file_path):
+    """
+    Returns the row count and a hash of the Arrow schema of a parquet file, read from its footer only.
+    """
+    parquet_file = pq.ParquetFile(file_path)
+    schema = parquet_file.schema_arrow.remove_metadata()
+    return parquet_file.metadata.num_rows, hashlib.sha256(schema.to_string().encode("utf-8")).hexdigest()[:16]
+
+
+def parquet_source(file_path):
+    """
+    Returns the source table and fingerprint recorded in a summary's parquet metadata, or None for
+    other files.
+    """
+    metadata = pq.read_schema(file_path).metadata or {}
+    if SOURCE_FINGERPRINT_KEY not in metadata:
+        return None
+    return {
+        'table': metadata.get(SOURCE_TABLE_KEY, b'').decode("utf-8"),
+        'fingerprint': metadata[SOURCE_FINGERPRINT_KEY].decode("utf-8"),
+    }
 
 
-def upload_files_to_s3(bucket_name, files_to_upload, s3_folder=""):
+def previous_uploads(manifest):
+    """
+    Returns the manifest's objects by upload name, including the partitions of partitioned tables.
+    """
+    previous = {}
+    for table, entry in (manifest or {}).get('tables', {}).items():
+        if 'partitions' in entry:
+            for partition in entry['partitions']:
+                previous[f"{table}/{partition['path']}"] = partition
+        else:
+            previous[f"{table}.parquet"] = entry
+    return previous
+
+
+def write_manifest(s3_client, bucket_name, s3_folder, results, previous_manifest=None):
+    """
+    Writes latest.json with the key, ETag, row count and schema hash of each table's latest object.
+
+    A table uploaded as a partitioned directory (results named '<table>/year=.../part-0.parquet')
+    gets a 'partitions' list instead, one entry per file with its path inside the table directory.
+    Summaries also get the 'source' table and fingerprint they were computed from.
+    Entries of tables that failed to upload, even partly, or were not part of this run, are kept
+    from the previous manifest.
+
+    Parameters:
+    - s3_client: boto3 S3 client
+    - bucket_name: str: The name of the S3 bucket
+    - s3_folder: str: The S3 folder the manifest describes
+    - results: list: Upload results, as returned by upload_file, with their upload 'name'
+    - previous_manifest: dict: The manifest before this run, if any
+
+    Returns:
+    - dict: The manifest written
+    """
+    tables = dict((previous_manifest or {}).get('tables', {}))
+    partitioned = {}
+    for result in results:
+        name = result.get('name', os.path.basename(result['file']))
+        if not name.endswith('.parquet'):
+            continue
+        if '/' in name:
+            table, path = name.split('/', 1)
+            partitioned.setdefault(table, []).append((path, result))
+            continue
+        if result['status'] == 'failed':
+            continue
+        rows, schema_hash = parquet_summary(result['file'])
+        entry = {
+            'key': result['key'],
+            'etag': result['etag'],
+            'size': result['size'],
+            'rows': rows,
+            'schema_hash': schema_hash,
+            'sha256': result['sha256'],
+        }
+        source = parquet_source(result['file'])
+        if source is not None:
+            entry['source'] = source
+        tables[name[:-len('.parquet')]] = entry
+
+    for table, files in partitioned.items():
+        if any(result['status'] == 'failed' for _, result in files):
+            logger.error(f"Manifest entry of {table} not updated, some of its partitions failed to upload")
+            continue
+        partitions = []
+        for path, result in sorted(files, key=lambda item: item[0]):
+            rows, schema_hash = parquet_summary(result['file'])
+            partitions.append({
+                'path': path,
+                'key': result['key'],
+                'etag': result['etag'],
+                'size': result['size'],
+                'rows': rows,
+                'sha256': result['sha256'],
+            })
+        tables[table] = {
+            'size': sum(partition['size'] for partition in partitions),
+            'rows': sum(partition['rows'] for partition in partitions),
+            'schema_hash': schema_hash,
+            'partitions': partitions,
+        }
+
+    manifest = {'generated_at': dt.now().isoformat(), 'tables': tables}
+    s3_client.put_object(
+        Bucket=bucket_name,
+        Key=manifest_key(s3_folder),
+        Body=json.dumps(manifest, indent=4).encode("utf-8"),
+        ContentType='application/json',
+    )
+    logger.info(f"Manifest {bucket_name}/{manifest_key(s3_folder)} written for {len(tables)} tables")
+    return manifest
+
+
+def upload_file(s3_client, bucket_name, file_path, s3_key, previous=None, skip_unchanged=True):
+    """
+    Uploads one file with the multipart TransferConfig, unless the latest object already has the same content.
+
+    Parameters:
+    - s3_client: boto3 S3 client
+    - bucket_name: str: The name of the S3 bucket
+    - file_path: str: The local file
+    - s3_key: str: The key to upload to
+    - previous: dict: Optional latest existing upload of this file to compare against: {'key'} and,
+      when it comes from the manifest, 'sha256', 'etag' and 'size' so no request is needed
+    - skip_unchanged: bool: Skip the upload when s3_key or the previous object already holds the same content
+
+    Returns:
+    - dict: file, key, status ('uploaded', 'skipped' or 'failed'), sha256, etag, size, seconds and error
+    """
+    file_name = os.path.basename(file_path)
+    start = time.perf_counter()
+    result = {'file': file_path, 'key': s3_key, 'status': 'failed', 'sha256': None, 'etag': None, 'size': None,
+              'error': None}
+
+    try:
+        with span('upload.hash', file=file_name):
+            digest = file_sha256(file_path)
+        result['sha256'] = digest
+        previous = previous or {}
+
+        if skip_unchanged and previous.get('sha256') == digest:
+            result.update(key=previous['key'], status='skipped', etag=previous.get('etag'), size=previous.get('size'))
+        elif skip_unchanged:
+            for existing_key in dict.fromkeys(key for key in (s3_key, previous.get('key')) if key):
+                response = head_object(s3_client, bucket_name, existing_key)
+                if response and response.get('Metadata', {}).get(HASH_METADATA_KEY) == digest:
+                    result.update(key=existing_key, status='skipped', etag=response['ETag'].strip('"'),
+                                  size=response['ContentLength'])
+                    break
+
+        if result['status'] == 'skipped':
+            logger.info(f"File {file_name} unchanged since {bucket_name}/{result['key']}, skipped upload")
+        else:
+            with span('upload.put', file=file_name, bytes=os.path.getsize(file_path)):
+                s3_client.upload_file(
+                    file_path, bucket_name, s3_key,
+                    ExtraArgs={'Metadata': {HASH_METADATA_KEY: digest}},
+                    Config=TRANSFER_CONFIG,
+                )
+            # Multipart uploads have an ETag that is not the MD5 of the file, so read back the stored one
+            response = s3_client.head_object(Bucket=bucket_name, Key=s3_key)
+            result.update(status='uploaded', etag=response['ETag'].strip('"'), size=response['ContentLength'])
+            logger.info(f"File {file_name} uploaded to {bucket_name}/{s3_key}")
+    except Exception as e:
+        result['error'] = str(e)
+        logger.error(f"Failed to upload {file_name}: {e}")
+
+    result['seconds'] = time.perf_counter() - start
+    return result
+
+
+def upload_files_to_s3(bucket_name, files_to_upload, s3_folder="", max_workers=DEFAULT_MAX_WORKERS, skip_unchanged=True,
+                       update_manifest=True, local_root=None):
     """
     Uploads a list of files to an S3 bucket.
 
+    Files are uploaded concurrently, each with multipart transfers. With skip_unchanged, a file
+    whose SHA-256 matches its latest upload under s3_folder is not uploaded again; the manifest
+    keeps pointing at that earlier object. Afterwards the latest.json manifest is rewritten, so
+    the loader can find every table's latest object without listing the bucket.
+
     Parameters:
     - bucket_name: str: The name of the S3 bucket
     - files_to_upload: list: List of file paths to upload
     - s3_folder: str: The S3 folder where files should be uploaded. Optional.
+    - max_workers: int: Number of files uploaded at the same time
+    - skip_unchanged: bool: Skip files whose content is already the latest object in S3
+    - update_manifest: bool: Rewrite s3_folder/latest.json after the uploads
+    - local_root: str: Directory the files are named relative to in S3, so partitioned tables keep
+      their sub-directories; by default files are uploaded under their base name
+
+    Returns:
+    - list: One result dict per file (see upload_file), plus the 'name' it was uploaded under
     """
 
-    s3_client = boto3.client('s3')
+    s3_client = boto3.client(
+        's3',
+        config=Config(max_pool_connections=max(10, max_workers * TRANSFER_CONFIG.max_request_concurrency))
+    )
+
+    timestamp = dt.now().strftime("%Y/%m/%d")
+    manifest = read_manifest(s3_client, bucket_name, s3_folder) if (skip_unchanged or update_manifest) else None
+
+    file_names = [
+        os.path.relpath(file_path, local_root).replace(os.sep, '/') if local_root else os.path.basename(file_path)
+        for file_path in files_to_upload
+    ]
+
+    previous = {}
+    if skip_unchanged and manifest is not None:
+        previous = previous_uploads(manifest)
+    elif skip_unchanged:
+        # No manifest yet: find the latest uploads by listing the folder once
+        previous = {
+            file_name: {'key': key}
+            for file_name, key in find_latest_keys(s3_client, bucket_name, s3_folder, set(file_names)).items()
+        }
 
-    for file_path in files_to_upload:
-        file_name = os.path.basename(file_path)
-        timestamp = dt.now().strftime("%Y/%m/%d")
+    jobs = []
+    for file_path, file_name in zip(files_to_upload, file_names):
         s3_key = f"{s3_folder}/{timestamp}/{file_name}" if s3_folder else file_name
+        jobs.append((file_path, s3_key, previous.get(file_name)))
 
-        try:
-            s3_client.upload_file(file_path, bucket_name, s3_key)
-            logger.info(f"File {file_name} uploaded to {bucket_name}/{s3_key}")
-        except Exception as e:
-            logger.error(f"Failed to upload {file_name}: {e}")
+    with span('upload.files', files=len(jobs)), ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        results = list(executor.map(
+            in_context(lambda job: upload_file(s3_client, bucket_name, *job, skip_unchanged=skip_unchanged)), jobs
+        ))
+    for result, file_name in zip(results, file_names):
+        result['name'] = file_name
+
+    uploaded = sum(result['status'] == 'uploaded' for result in results)
+    skipped = sum(result['status'] == 'skipped' for result in results)
+    logger.info(f"Uploaded {uploaded} files, skipped {skipped} unchanged, {len(results) - uploaded - skipped} failed")
+
+    if update_manifest:
+        with span('upload.write_manifest'):
+            write_manifest(s3_client, bucket_name, s3_folder, results, manifest)
+    if METRICS_FILE:
+        span_registry.write_prometheus(METRICS_FILE)
+    return results
 
 
 def lambda_handler(event, context):
@@ -56,16 +401,30 @@ def lambda_handler(event, context):
     - context: object: The context in which the function is called
     """
 
+    configure_spans('upload', SPANS_JSONL_FILE)
     try:
         bucket_name = BUCKET_NAME
 
         tables = ['fact_sales_order', 'dim_staff', 'dim_location', 'dim_design', 'dim_date', 'dim_currency', 'dim_counterparty']
 
-        files_to_upload = [f"db/parquet_files/tmp/{table}.parquet" for table in tables]
+        local_root = "db/parquet_files/tmp"
+
+        files_to_upload = []
+        for table in tables:
+            table_dir = os.path.join(local_root, table)
+            if os.path.isdir(table_dir):
+                # Partitioned table: every parquet file under year=YYYY/month=M
+                for root, _, file_names in sorted(os.walk(table_dir)):
+                    files_to_upload += [os.path.join(root, name) for name in sorted(file_names) if name.endswith('.parquet')]
+            else:
+                files_to_upload.append(f"{local_root}/{table}.parquet")
+        files_to_upload += [
+            f"{local_root}/{table}.parquet" for table in SUMMARY_TABLES if os.path.exists(f"{local_root}/{table}.parquet")
+        ]
 
         s3_folder = "db/parquet_files"
 
-        upload_files_to_s3(bucket_name, files_to_upload, s3_folder)
+        upload_files_to_s3(bucket_name, files_to_upload, s3_folder, local_root=local_root)
 
         return {
             'statusCode': 200,